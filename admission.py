@@ -0,0 +1,204 @@
+import math
+import time
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict
+
+import httpx
+
+import metrics
+from models_loader import load_app_config
+
+_cfg = load_app_config()
+_admission_cfg = _cfg.get("admission") or {}
+
+# значение Retry-After (секунды) в ответах 429/503
+RETRY_AFTER = float(_admission_cfg.get("retry_after", 1.0))
+
+# при перегрузке сервиса эмбеддингов или хранилища векторов отвечать без
+# контекста из репозитория (деградированный режим); иначе — 503
+DEGRADED_MODE = bool(_admission_cfg.get("degraded_mode", True))
+
+# размер пула соединений httpx, если в секции ограничения он не задан
+# и не ограничено число одновременных вызовов (как по умолчанию в httpx)
+DEFAULT_MAX_CONNECTIONS = 100
+
+# ограничения, от перегрузки которых спасает деградированный режим
+RETRIEVAL_LIMITS = ("embedding", "vector_store")
+
+
+class Overloaded(Exception):
+    """
+    Вызов отклонён ограничением параллельности: очередь ожидания полна
+    (reason="queue_full") или ожидание длилось дольше queue_timeout
+    (reason="timeout").
+    """
+
+    def __init__(self, limit: str, reason: str) -> None:
+        super().__init__(f"{limit} is overloaded ({reason})")
+        self.limit = limit
+        self.reason = reason
+        self.retry_after = RETRY_AFTER
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class ConcurrencyLimit:
+    """
+    Ограничение числа одновременных вызовов с ограниченной очередью:
+
+      async with limit:
+          ...
+
+    Не больше max_concurrent вызовов выполняются одновременно, следующие
+    ждут в очереди (FIFO) до queue_timeout секунд. Если в очереди уже
+    max_queue ожидающих, вызов сразу отклоняется (Overloaded) — перегрузка
+    не превращается в бесконечно растущие задержки. max_concurrent = 0 —
+    без ограничения.
+
+    Время ожидания в очереди пишется в метрику этапа queue_<имя>.
+    Не потокобезопасен: рассчитан на использование из одного event loop
+    (в отличие от asyncio.Semaphore, не привязан к конкретному loop).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrent: int = 0,
+        max_queue: int = 0,
+        queue_timeout: float = 0.0,
+    ) -> None:
+        self.name = name
+        self.max_concurrent = max(0, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = float(queue_timeout)
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def saturated(self) -> bool:
+        """
+        Все слоты заняты и очередь полна: новый вызов будет отклонён сразу.
+        """
+        return (
+            self.max_concurrent > 0
+            and self.active >= self.max_concurrent
+            and len(self._waiters) >= self.max_queue
+        )
+
+    def check(self) -> None:
+        """
+        Отклоняет вызов заранее (Overloaded), если limit насыщен, — например,
+        до того, как клиенту отправлены заголовки потокового ответа.
+        """
+        if self.saturated:
+            self._reject("queue_full")
+
+    def _reject(self, reason: str) -> None:
+        metrics.ADMISSION_REJECTED.inc(limit=self.name, reason=reason)
+        raise Overloaded(self.name, reason)
+
+    async def acquire(self) -> None:
+        if not self.max_concurrent or (self.active < self.max_concurrent and not self._waiters):
+            self.active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._reject("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout or None)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # слот уже передан этому вызову — отдаём его следующему
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject("timeout")
+            raise
+        finally:
+            metrics.record(f"queue_{self.name}", time.perf_counter() - started)
+
+    def release(self) -> None:
+        # слот передаётся первому ожидающему, active при этом не меняется
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active = max(0, self.active - 1)
+
+    async def __aenter__(self) -> "ConcurrencyLimit":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        self.release()
+
+
+def _limit_cfg(name: str) -> Dict[str, Any]:
+    return _admission_cfg.get(name) or {}
+
+
+# общие ограничения процесса по именам (requests, embedding, vector_store, llm)
+_limits: Dict[str, ConcurrencyLimit] = {}
+
+
+def get_limit(name: str) -> ConcurrencyLimit:
+    """
+    Общее для процесса ограничение по подсекции admission.<name> конфига:
+
+      max_concurrent: 16    — одновременных вызовов (0 — без ограничения)
+      max_queue: 64         — ожидающих в очереди; остальные отклоняются сразу
+      queue_timeout: 2.0    — сколько секунд ждать в очереди (0 — без таймаута)
+    """
+    limit = _limits.get(name)
+    if limit is None:
+        limit_cfg = _limit_cfg(name)
+        limit = _limits[name] = ConcurrencyLimit(
+            name,
+            max_concurrent=limit_cfg.get("max_concurrent", 0),
+            max_queue=limit_cfg.get("max_queue", 0),
+            queue_timeout=limit_cfg.get("queue_timeout", 0.0),
+        )
+    return limit
+
+
+def check_retrieval() -> None:
+    """
+    Отклоняет поиск (Overloaded), если сервис эмбеддингов или хранилище
+    векторов насыщены (см. ConcurrencyLimit.check).
+    """
+    for name in RETRIEVAL_LIMITS:
+        get_limit(name).check()
+
+
+def pool_limits(name: str) -> httpx.Limits:
+    """
+    Пул соединений httpx для бэкенда (подсекция admission.<name>):
+
+      max_connections: 16             — по умолчанию max_concurrent (или 100)
+      max_keepalive_connections: 16   — по умолчанию max_connections
+
+    Keep-alive соединений столько же, сколько всего, чтобы после всплеска
+    нагрузки соединения не закрывались и не открывались заново.
+    """
+    limit_cfg = _limit_cfg(name)
+    max_connections = int(
+        limit_cfg.get("max_connections")
+        or limit_cfg.get("max_concurrent")
+        or DEFAULT_MAX_CONNECTIONS
+    )
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=int(limit_cfg.get("max_keepalive_connections", max_connections)),
+    )
@@ -1,92 +1,181 @@
+import time
+import asyncio
 import logging
-from typing import List, Dict
+from pathlib import Path
+from typing import Any, List, Dict, Optional, Sequence, Tuple
 
-import httpx
-from qdrant_client import QdrantClient
-
-from embedder import get_embeddings
+from admission import Overloaded, get_limit
+from context_builder import format_documents, hits_to_documents
+from embedder import aget_embeddings, get_embeddings
+from lexical_index import LexicalIndex, collection_index_dir, is_identifier, tokenize
+from metrics import QUERY_BATCH_SIZE, RERANK_FALLBACKS, span
+from query_cache import MicroBatcher, SingleFlight, TTLCache
+from reranker import reranker_from_config
+from vector_store import CollectionNotFoundError, vector_store_from_config
 
 logger = logging.getLogger("uvicorn.error")
 
-QDRANT_URL = "http://127.0.0.1:6333"
 COLLECTION_NAME = "repo_chunks"
 
+# сколько секунд помнить эмбеддинги недавних запросов (их переиспользует
+# семантический кэш ответов сервера, см. aembed_query)
+QUERY_EMBEDDING_TTL = 600.0
+
 
-def collection_exists(client: QdrantClient, name: str) -> bool:
+class CollectionState:
     """
-    Проверка существования коллекции в Qdrant.
+    Закэшированные метаданные одной коллекции и её BM25-индекс.
     """
-    try:
-        collections = client.get_collections().collections
-    except Exception:
-        return False
-    return any(c.name == name for c in collections)
+
+    def __init__(self, name: str, lexical_index_path: Path) -> None:
+        self.name = name
+        self.lexical_index_path = lexical_index_path
+        self.exists = False
+        # число точек — версия коллекции для кэша запросов
+        self.version: Optional[int] = None
+        self.vector_size: Optional[int] = None
+        self.lexical: Optional[LexicalIndex] = None
+        # версия индекса на диске (LexicalIndex.stamp): mtime meta.json и дельты
+        self.lexical_stamp: Optional[Tuple[float, Optional[float]]] = None
 
 
 class RepoSearchAgent:
     """
     Агент, который наполняет контекст фрагментами из репозитория,
-    найденными по векторному поиску в Qdrant.
+    найденными по векторному поиску в Qdrant (или во встроенном
+    локальном хранилище, см. vector_store.py).
+
+    Агент может искать сразу в нескольких коллекциях (по одной на
+    репозиторий, см. `index_repo.py --collection`): эмбеддинг запроса
+    считается один раз, поиск по коллекциям идёт параллельно, а результаты
+    сливаются по score. Набор коллекций выбирается маршрутом запроса
+    (см. `routes` и server.py).
     """
 
+    # сервер передаёт в abuild_documents маршрут запроса (заголовок или model)
+    routable = True
+
     def __init__(self, config: dict | None = None, limit: int | None = None):
         """
         config:
           limit: int
+          vector_backend: str        — qdrant | local
           qdrant_url: str
           collection_name: str
+          collections: list[str]     — коллекции для запросов без маршрута
+                                       (по умолчанию [collection_name])
+          routes: dict               — маршрут (имя модели или заголовок X-RAG-Route)
+                                       -> список коллекций
           timeout: float
+          vector_store_path: str     — каталог локального хранилища (vector_backend: local)
+          vector_dtype: str          — float32 | float16 (vector_backend: local)
+          query_cache_size: int      — сколько запросов держать в кэше результатов
+          query_cache_ttl: float     — время жизни записи кэша, секунды
+          metadata_refresh_interval: float — как часто обновлять метаданные коллекций
+          hybrid: bool               — гибридный поиск (BM25 + векторный)
+          lexical_index_path: str    — каталог BM25-индекса, который строит index_repo.py
+          rrf_k: int                 — константа reciprocal-rank fusion
+          lexical_fast_path: bool    — не считать эмбеддинг, если лексический поиск однозначен
+          lexical_fast_path_max_terms: int — максимум термов в запросе для быстрого пути
+          micro_batch: bool          — собирать эмбеддинги и поиск одновременных запросов в батчи
+          micro_batch_window_ms: float — окно сбора батча, миллисекунды
+          micro_batch_max_size: int  — батч уходит сразу, набрав столько запросов
+          rerank: str                — none | lexical | cross_encoder (см. reranker.py)
+          rerank_candidates: int     — сколько хитов первого этапа переоценивать
+          rerank_budget_ms: float    — бюджет переоценки, после него — порядок первого этапа
         """
         config = config or {}
 
         # приоритет: явный аргумент > конфиг > дефолт
         self.limit = limit if limit is not None else config.get("limit", 8)
 
-        qdrant_url = config.get("qdrant_url", QDRANT_URL)
         self.collection_name = config.get("collection_name", COLLECTION_NAME)
-        timeout = config.get("timeout", 30.0)
 
-        # prefer_grpc=False — используем HTTP-клиент
-        self.qdrant = QdrantClient(
-            url=qdrant_url,
-            prefer_grpc=False,
+        # второй этап: из хранилища берётся rerank_candidates хитов, реранкер
+        # на CPU оставляет из них limit лучших
+        self.reranker = reranker_from_config(config)
+        self.fetch_limit = (
+            max(self.limit, self.reranker.candidates) if self.reranker is not None else self.limit
         )
-        # отдельный HTTP-клиент для REST API поиска
-        self.http_client = httpx.Client(
-            base_url=qdrant_url,
-            timeout=timeout,
-            trust_env=False,
+        # BM25 даёт в RRF вдвое больше хитов, чем limit; с переранжированием
+        # кандидатов и так rerank_candidates — лишние хиты только тратят CPU
+        self.lexical_fetch_limit = max(self.limit * 2, self.fetch_limit)
+
+        # коллекции по умолчанию и маршруты "имя -> коллекции"
+        self.collections: List[str] = list(config.get("collections") or [self.collection_name])
+        self.routes: Dict[str, List[str]] = {
+            str(name): [targets] if isinstance(targets, str) else list(targets)
+            for name, targets in (config.get("routes") or {}).items()
+        }
+
+        # Qdrant (REST API) или встроенное локальное хранилище
+        self.store = vector_store_from_config(config)
+        # одновременные поиски в хранилище (секция admission.vector_store, общая для процесса)
+        self._store_limit = get_limit("vector_store")
+
+        # кэш "текст запроса -> хиты" и объединение одинаковых одновременных запросов.
+        # Записи привязаны к версиям коллекций (числу точек): после переиндексации
+        # версия меняется и старые результаты не используются.
+        self.query_cache = TTLCache(
+            maxsize=config.get("query_cache_size", 256),
+            ttl=config.get("query_cache_ttl", 300.0),
         )
+        self._search_flight = SingleFlight()
 
-    def _qdrant_search_http(
-        self,
-        collection_name: str,
-        vector: List[float],
-        limit: int,
-        with_payload: bool = True,
-    ) -> List[Dict]:
-        """
-        Поиск в Qdrant через REST API.
-        Возвращает список хитов (каждый — dict с 'payload', 'score' и т.п.).
-        """
-        url = f"/collections/{collection_name}/points/search"
-        body = {
-            "vector": vector,
-            "limit": limit,
-            "with_payload": with_payload,
+        # микро-батчинг: эмбеддинги запросов, пришедших в пределах окна, считаются
+        # одним вызовом /v1/embeddings, а их поиск в каждой коллекции — одним
+        # пакетным поиском (store.asearch_batch)
+        self.micro_batch = bool(config.get("micro_batch", True))
+        self.micro_batch_window = float(config.get("micro_batch_window_ms", 5.0)) / 1000.0
+        self.micro_batch_max_size = int(config.get("micro_batch_max_size", 32))
+        self._embed_batcher = MicroBatcher(
+            self._aembed_batch, self.micro_batch_max_size, self.micro_batch_window
+        )
+        self._search_batchers: Dict[str, MicroBatcher] = {}
+        # эмбеддинги недавних запросов: текст запроса -> вектор
+        self._query_embeddings = TTLCache(
+            maxsize=config.get("query_cache_size", 256), ttl=QUERY_EMBEDDING_TTL
+        )
+
+        # гибридный поиск: локальный BM25-индекс + векторный поиск, слияние через RRF.
+        # У каждой коллекции свой индекс (lexical_index.collection_index_dir).
+        self.hybrid = bool(config.get("hybrid", True))
+        self.lexical_index_path = Path(config.get("lexical_index_path", ".lexical_index"))
+        self.rrf_k = int(config.get("rrf_k", 60))
+        self.lexical_fast_path = bool(config.get("lexical_fast_path", True))
+        self.lexical_fast_path_max_terms = int(config.get("lexical_fast_path_max_terms", 6))
+
+        # закэшированные метаданные всех коллекций (по умолчанию и из маршрутов):
+        # обновляются фоновой задачей (см. astartup) или при 404 от поиска,
+        # а не на каждый запрос
+        names = dict.fromkeys(
+            self.collections + [c for targets in self.routes.values() for c in targets]
+        )
+        self._states: Dict[str, CollectionState] = {
+            name: CollectionState(
+                name,
+                collection_index_dir(self.lexical_index_path, name, self.collection_name),
+            )
+            for name in names
         }
-        resp = self.http_client.post(url, json=body)
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get("result", [])
+        self.metadata_refresh_interval = float(config.get("metadata_refresh_interval", 5.0))
+        self._metadata_updated_at = float("-inf")
+        # размер эмбеддингов модели (определяется в astartup)
+        self._embedding_dim: Optional[int] = None
+        self._refresh_task: Optional[asyncio.Task] = None
 
     def build_context(self, user_message: str) -> str:
         """
-        Строит текстовый контекст для LLM на основе запроса пользователя.
-        Возвращает строку (может быть пустой, если контекст не найден).
+        Строит текстовый контекст для LLM на основе запроса пользователя
+        (по коллекциям по умолчанию). Возвращает строку (может быть пустой,
+        если контекст не найден).
         """
-        # Если коллекции нет — не добавляем контекст
-        if not collection_exists(self.qdrant, self.collection_name):
+        # Если коллекций нет — не добавляем контекст
+        try:
+            names = [c for c in self.collections if self.store.info(c) is not None]
+        except Exception:
+            return ""
+        if not names:
             return ""
 
         # 1. Получаем эмбеддинг запроса
@@ -96,24 +185,442 @@ class RepoSearchAgent:
             logger.exception("Failed to get embeddings in RepoSearchAgent: %s", e)
             return ""
 
-        # 2. Ищем в Qdrant
+        # 2. Ищем в хранилище векторов
         try:
-            search_res = self._qdrant_search_http(
-                collection_name=self.collection_name,
-                vector=emb,
-                limit=self.limit,
-                with_payload=True,
-            )
+            hits = [
+                {**hit, "collection": name}
+                for name in names
+                for hit in self.store.search(name, emb, self.fetch_limit)
+            ]
         except Exception as e:
-            logger.exception("Qdrant search failed in RepoSearchAgent: %s", e)
+            logger.exception("Vector search failed in RepoSearchAgent: %s", e)
             return ""
 
+        hits = self._top_by_score(hits)
+        if self.reranker is not None:
+            hits, _ = self.reranker.rerank(user_message, hits, self.limit)
+
         # 3. Формируем текст контекста
-        context_parts: List[str] = []
-        for i, hit in enumerate(search_res, 1):
-            payload = hit.get("payload") or {}
-            text = payload.get("text", "")
-            path = payload.get("path", "unknown")
-            context_parts.append(f"[DOC {i}] file: {path}\n{text}\n")
-
-        return "\n\n".join(context_parts)
+        return format_documents(self._to_documents(hits, len(names) > 1))
+
+    async def astartup(self) -> None:
+        """
+        Вызывается сервером при старте: загружает метаданные коллекций,
+        проверяет, что размер векторов в них совпадает с моделью эмбеддингов,
+        и запускает фоновое обновление метаданных.
+
+        При несовпадении размерности бросает RuntimeError, чтобы сервер
+        не стартовал с заведомо неработающим поиском.
+        """
+        try:
+            self._embedding_dim = len((await aget_embeddings(["dimension probe"]))[0])
+        except Exception as e:
+            logger.warning(
+                "Could not determine embedding size at startup, skipping validation: %s", e
+            )
+
+        await self._arefresh_metadata()
+        mismatched = [state for state in self._states.values() if self._vector_size_mismatch(state)]
+        if mismatched:
+            raise RuntimeError(
+                "Collections "
+                + ", ".join(f"'{state.name}' (size {state.vector_size})" for state in mismatched)
+                + f" do not match the embedding model size {self._embedding_dim}. "
+                "Re-index the repositories with index_repo.py."
+            )
+        for state in self._states.values():
+            if not state.exists:
+                logger.warning(
+                    "Collection '%s' does not exist yet, RepoSearchAgent skips it",
+                    state.name,
+                )
+
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def aclose(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        await self.store.aclose()
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.metadata_refresh_interval)
+            await self._arefresh_metadata()
+
+    def _vector_size_mismatch(self, state: CollectionState) -> bool:
+        return (
+            state.exists
+            and state.vector_size is not None
+            and self._embedding_dim is not None
+            and state.vector_size != self._embedding_dim
+        )
+
+    async def _ametadata(self) -> None:
+        """
+        Гарантирует свежие метаданные коллекций. Если работает фоновое
+        обновление, запросов к хранилищу здесь не происходит.
+        """
+        if time.monotonic() - self._metadata_updated_at >= self.metadata_refresh_interval:
+            await self._arefresh_metadata()
+
+    async def _arefresh_metadata(self) -> None:
+        await self._search_flight.do("collection_metadata", self._afetch_metadata)
+
+    async def _afetch_metadata(self) -> None:
+        """
+        Читает метаданные всех коллекций (параллельно): существует ли
+        коллекция, размер векторов и число точек (версия для кэша запросов).
+        """
+        states = list(self._states.values())
+        infos = await asyncio.gather(
+            *(self.store.ainfo(state.name) for state in states), return_exceptions=True
+        )
+        for state, info in zip(states, infos):
+            if isinstance(info, Exception):
+                # хранилище недоступно — оставляем прежние метаданные
+                logger.warning(
+                    "Failed to get collection info for '%s' in RepoSearchAgent: %s",
+                    state.name,
+                    info,
+                )
+                continue
+            self._update_state(state, info)
+            await self._areload_lexical_index(state)
+        self._metadata_updated_at = time.monotonic()
+
+    def _update_state(self, state: CollectionState, info: Optional[Dict[str, Any]]) -> None:
+        exists = info is not None
+        info = info or {}
+        version = info.get("points_count")
+        vector_size = info.get("vector_size")
+        if version != state.version or exists != state.exists:
+            self.query_cache.clear()
+        if vector_size != state.vector_size and self._embedding_dim is not None:
+            if exists and vector_size is not None and vector_size != self._embedding_dim:
+                logger.error(
+                    "Collection '%s' has vectors of size %s, embedding model produces %s; "
+                    "it is not searched until the collection is re-indexed",
+                    state.name,
+                    vector_size,
+                    self._embedding_dim,
+                )
+
+        state.exists = exists
+        state.version = version
+        state.vector_size = vector_size
+
+    async def _areload_lexical_index(self, state: CollectionState) -> None:
+        """
+        Подгружает BM25-индекс коллекции, если index_repo.py записал новую версию
+        (полную сборку или дельту изменённых файлов). Индекс (с чтением дельты)
+        открывается в потоке; пока он грузится, запросы ищут по прежнему.
+        """
+        if not self.hybrid:
+            return
+        stamp = LexicalIndex.stamp(state.lexical_index_path)
+        if stamp == state.lexical_stamp:
+            return
+        lexical: Optional[LexicalIndex] = None
+        if stamp:
+            try:
+                lexical = await asyncio.to_thread(LexicalIndex.open, state.lexical_index_path)
+            except Exception as e:
+                logger.warning(
+                    "Failed to load lexical index %s: %s", state.lexical_index_path, e
+                )
+        state.lexical = lexical
+        state.lexical_stamp = stamp
+        self.query_cache.clear()
+
+    def _route(self, route: Optional[str]) -> List[str]:
+        """
+        Коллекции для маршрута запроса. Маршрут — имя из `routes` или имя
+        коллекции; можно перечислить несколько через запятую. Неизвестные
+        имена (например, обычное имя модели) игнорируются, и если не осталось
+        ни одного — ищем в коллекциях по умолчанию.
+        """
+        names: List[str] = []
+        for part in (route or "").split(","):
+            part = part.strip()
+            if part in self.routes:
+                names.extend(self.routes[part])
+            elif part in self._states:
+                names.append(part)
+        return list(dict.fromkeys(names)) or self.collections
+
+    def _active_states(self, names: Sequence[str]) -> List[CollectionState]:
+        """
+        Коллекции, в которых можно искать: существуют и совпадают по размерности.
+        """
+        return [
+            state
+            for state in (self._states[name] for name in names)
+            if state.exists and not self._vector_size_mismatch(state)
+        ]
+
+    def _lexical_is_decisive(self, lexical: LexicalIndex, query: str) -> bool:
+        """
+        Лексический поиск однозначен, если короткий запрос содержит точный
+        идентификатор (класс Puppet, ключ hiera, имя файла), который встречается
+        не более чем в limit чанках: эти чанки и есть ответ, эмбеддинг не нужен.
+        """
+        terms = set(tokenize(query))
+        if not terms or len(terms) > self.lexical_fast_path_max_terms:
+            return False
+        dfs = [lexical.df(t) for t in terms if is_identifier(t)]
+        found = [df for df in dfs if df > 0]
+        return bool(found) and min(found) <= self.limit
+
+    async def _aretrieve_points(self, collection: str, ids: List[str]) -> Dict[str, Dict]:
+        """
+        Payload точек по id (для хитов, найденных только лексическим поиском).
+        """
+        if not ids:
+            return {}
+        with span("retrieve"):
+            async with self._store_limit:
+                points = await self.store.aretrieve(collection, ids)
+        return {pid: {**point, "collection": collection} for pid, point in points.items()}
+
+    def _top_by_score(self, hits: List[Dict]) -> List[Dict]:
+        return sorted(hits, key=lambda h: h.get("score") or 0.0, reverse=True)[: self.fetch_limit]
+
+    async def _afuse(
+        self, vector_hits: List[Dict], lexical_hits: Dict[str, List[Dict]]
+    ) -> List[Dict]:
+        """
+        Reciprocal-rank fusion векторных хитов (уже слитых по score из всех
+        коллекций) и лексических хитов каждой коллекции:
+        score = сумма 1 / (rrf_k + ранг) по всем спискам. Id точек уникальны
+        только внутри коллекции, поэтому ключ — (коллекция, id).
+        """
+        fused: Dict[Tuple[str, str], float] = {}
+        ranked = [vector_hits] + [
+            [{**hit, "collection": name} for hit in hits] for name, hits in lexical_hits.items()
+        ]
+        for hits in ranked:
+            for rank, hit in enumerate(hits, 1):
+                key = (hit["collection"], str(hit["id"]))
+                fused[key] = fused.get(key, 0.0) + 1.0 / (self.rrf_k + rank)
+
+        top = sorted(fused, key=fused.get, reverse=True)[: self.fetch_limit]
+        known = {(h["collection"], str(h["id"])): h for h in vector_hits}
+        missing: Dict[str, List[str]] = {}
+        for name, pid in top:
+            if (name, pid) not in known:
+                missing.setdefault(name, []).append(pid)
+        retrieved = await asyncio.gather(
+            *(self._aretrieve_points(name, ids) for name, ids in missing.items())
+        )
+        for name, points in zip(missing, retrieved):
+            known.update(((name, pid), point) for pid, point in points.items())
+
+        return [
+            {**known[key], "score": fused[key]}
+            for key in top
+            if key in known
+        ]
+
+    async def _asearch(self, query: str, states: List[CollectionState]) -> Tuple[List[Dict], bool]:
+        """
+        Гибридный поиск по коллекциям: BM25 по локальным индексам и векторный
+        поиск, объединённые через RRF. Если коллекция одна и лексическое
+        совпадение однозначно, эмбеддинг не вычисляется.
+
+        Возвращает хиты и признак того, что ответили все коллекции (неполный
+        результат не кэшируется). Ошибки логируются; если не ответила ни одна
+        коллекция, ошибка пробрасывается.
+        """
+        with span("lexical_search"):
+            lexical_hits = await asyncio.to_thread(self._lexical_search, query, states)
+
+        if len(states) == 1 and lexical_hits and self.lexical_fast_path:
+            state = states[0]
+            hits = lexical_hits[state.name]
+            if self._lexical_is_decisive(state.lexical, query):
+                top = hits[: self.limit]
+                points = await self._aretrieve_points(state.name, [h["id"] for h in top])
+                hits = [{**points[h["id"]], "score": h["score"]} for h in top if h["id"] in points]
+                return hits, True
+
+        vector_hits, complete = await self._avector_search(query, states)
+        if lexical_hits:
+            vector_hits = await self._afuse(vector_hits, lexical_hits)
+        if self.reranker is None:
+            return vector_hits, complete
+        hits, reranked = await self._arerank(query, vector_hits)
+        return hits, complete and reranked
+
+    def _lexical_search(self, query: str, states: List[CollectionState]) -> Dict[str, List[Dict]]:
+        """
+        BM25-поиск по индексам коллекций (в пуле потоков: на больших индексах
+        это заметная работа на CPU, которая не должна блокировать event loop).
+        """
+        lexical_hits: Dict[str, List[Dict]] = {}
+        for state in states:
+            if state.lexical is not None:
+                hits = state.lexical.search(query, self.lexical_fetch_limit)
+                if hits:
+                    lexical_hits[state.name] = hits
+        return lexical_hits
+
+    async def _arerank(self, query: str, hits: List[Dict]) -> Tuple[List[Dict], bool]:
+        """
+        Переоценка кандидатов на CPU (в пуле потоков, event loop не блокируется).
+        Бюджет отсчитывается уже в потоке (см. Reranker), поиск в него не входит.
+        Если бюджет превышен, остаётся порядок первого этапа, а признак False
+        не даёт закэшировать такой результат.
+        """
+        with span("rerank"):
+            hits, reranked = await asyncio.to_thread(self.reranker.rerank, query, hits, self.limit)
+        if not reranked:
+            RERANK_FALLBACKS.inc()
+        return hits, reranked
+
+    async def _avector_search(
+        self, query: str, states: List[CollectionState]
+    ) -> Tuple[List[Dict], bool]:
+        """
+        Один эмбеддинг запроса и параллельный векторный поиск по коллекциям;
+        хиты сливаются по score (косинусная близость одной модели сравнима
+        между коллекциями). Возвращает хиты и признак, что ответили все коллекции.
+        """
+        try:
+            emb = await self.aembed_query(query)
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.exception("Failed to get embeddings in RepoSearchAgent: %s", e)
+            raise
+
+        with span("vector_search"):
+            results = await asyncio.gather(
+                *(self._avector_search_one(state.name, emb) for state in states),
+                return_exceptions=True,
+            )
+        hits: List[Dict] = []
+        errors: List[BaseException] = []
+        for state, res in zip(states, results):
+            if isinstance(res, CollectionNotFoundError):
+                # коллекцию удалили — обновим метаданные, не дожидаясь фоновой задачи
+                logger.warning("Collection '%s' not found", state.name)
+                errors.append(res)
+            elif isinstance(res, BaseException):
+                logger.error("Vector search in '%s' failed in RepoSearchAgent: %s", state.name, res)
+                errors.append(res)
+            else:
+                hits.extend({**hit, "collection": state.name} for hit in res)
+
+        if any(isinstance(e, CollectionNotFoundError) for e in errors):
+            await self._arefresh_metadata()
+        if errors and len(errors) == len(states):
+            raise errors[0]
+        return self._top_by_score(hits), not errors
+
+    async def _aembed_batch(self, texts: List[str]) -> List[Any]:
+        QUERY_BATCH_SIZE.observe(len(texts), kind="embedding")
+        return list(await aget_embeddings(texts))
+
+    async def _aembed_query(self, query: str) -> Any:
+        """
+        Эмбеддинг запроса; при micro_batch — в общем батче с одновременными
+        запросами (этап query_embedding включает ожидание окна).
+        """
+        if not self.micro_batch:
+            return (await aget_embeddings([query]))[0]
+        with span("query_embedding"):
+            return await self._embed_batcher.submit(query)
+
+    async def aembed_query(self, query: str) -> Any:
+        """
+        Эмбеддинг текста запроса. Вектор, уже посчитанный для поиска, берётся
+        из памяти — сервер использует его как ключ семантического кэша ответов.
+        """
+        key = " ".join(query.split())
+        emb = self._query_embeddings.get(key)
+        if emb is None:
+            emb = await self._aembed_query(query)
+            self._query_embeddings.set(key, emb)
+        return emb
+
+    async def _avector_search_one(self, collection: str, emb: Any) -> List[Dict]:
+        if not self.micro_batch:
+            async with self._store_limit:
+                return await self.store.asearch(collection, emb, self.fetch_limit)
+        batcher = self._search_batchers.get(collection)
+        if batcher is None:
+
+            async def search(vectors: List[Any]) -> List[List[Dict]]:
+                QUERY_BATCH_SIZE.observe(len(vectors), kind="vector_search")
+                # батч — один запрос к хранилищу и один слот ограничения
+                async with self._store_limit:
+                    return await self.store.asearch_batch(collection, vectors, self.fetch_limit)
+
+            batcher = MicroBatcher(search, self.micro_batch_max_size, self.micro_batch_window)
+            self._search_batchers[collection] = batcher
+        return await batcher.submit(emb)
+
+    async def _acached_search(self, query: str, states: List[CollectionState]) -> List[Dict]:
+        """
+        Поиск через кэш результатов: одинаковые (с точностью до пробелов) запросы
+        к неизменным коллекциям не ходят в сервис эмбеддингов и хранилище, а
+        одновременные одинаковые запросы выполняются один раз.
+        """
+        versions = tuple((state.name, state.version) for state in states)
+        cacheable = all(version is not None for _, version in versions)
+        key = (" ".join(query.split()), self.limit, versions)
+        if cacheable:
+            hits = self.query_cache.get(key)
+            if hits is not None:
+                return hits
+
+        async def search() -> List[Dict]:
+            hits, complete = await self._asearch(query, states)
+            if cacheable and complete:
+                self.query_cache.set(key, hits)
+            return hits
+
+        return await self._search_flight.do(key, search)
+
+    @staticmethod
+    def _to_documents(hits: List[Dict], qualify: bool) -> List[Dict]:
+        """
+        Хиты -> документы. При поиске в нескольких коллекциях путь дополняется
+        именем коллекции (`коллекция:путь`), чтобы одноимённые файлы разных
+        репозиториев не склеивались и были различимы в контексте.
+        """
+        docs = hits_to_documents(hits)
+        if qualify:
+            for doc, hit in zip(docs, hits):
+                doc["path"] = f"{hit['collection']}:{doc['path']}"
+        return docs
+
+    async def abuild_documents(self, user_message: str, route: Optional[str] = None) -> List[Dict]:
+        """
+        Найденные фрагменты в виде документов (путь, текст, диапазон строк, score)
+        для общей сборки контекста на сервере (см. context_builder.ContextBuilder).
+        route выбирает коллекции (см. _route).
+        """
+        await self._ametadata()
+        states = self._active_states(self._route(route))
+        if not states:
+            return []
+
+        try:
+            search_res = await self._acached_search(user_message, states)
+        except Overloaded:
+            # сервер решает, отвечать ли без контекста (деградированный режим)
+            raise
+        except Exception:
+            return []
+
+        return self._to_documents(search_res, len(states) > 1)
+
+    async def abuild_context(self, user_message: str, route: Optional[str] = None) -> str:
+        """
+        Асинхронная версия build_context: эмбеддинг и поиск выполняются
+        без блокировки event loop сервера, а существование коллекций берётся
+        из закэшированных метаданных (без лишнего запроса к хранилищу).
+        """
+        return format_documents(await self.abuild_documents(user_message, route))
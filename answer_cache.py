@@ -0,0 +1,235 @@
+import json
+import time
+import hashlib
+import itertools
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def conversation_scope(
+    messages: List[Dict[str, Any]], user_message: Dict[str, Any], route: str
+) -> str:
+    """
+    Ключ "разговора": вся история, кроме последнего вопроса пользователя, и маршрут.
+    Ответ переиспользуется только в том же разговоре (для одиночного вопроса —
+    среди всех одиночных вопросов с тем же маршрутом).
+    """
+    history = [m for m in messages if m is not user_message]
+    return _digest(json.dumps([route, history], ensure_ascii=False, sort_keys=True))
+
+
+def context_chunks(documents: Sequence[Dict[str, Any]]) -> Tuple[str, Dict[str, Dict[str, str]]]:
+    """
+    Отпечаток найденного контекста и чанки по файлам: {путь: {ключ чанка: sha256 текста}}.
+
+    Отпечаток учитывает и id чанков, и их текст: id точки определяется путём
+    и номером чанка, поэтому после переиндексации изменённого файла id
+    остаются прежними, а текст — нет. Документы без пути (контекст агентов,
+    не возвращающих документы) входят в отпечаток своим текстом.
+    """
+    chunks: Dict[str, Dict[str, str]] = {}
+    parts: List[str] = []
+    for doc in documents:
+        text_hash = _digest(doc.get("text") or "")
+        path = doc.get("path")
+        if path is None:
+            parts.append(f"\0{text_hash}")
+            continue
+        key = f"{path}#{doc.get('id') if doc.get('id') is not None else doc.get('start_line')}"
+        chunks.setdefault(path, {})[key] = text_hash
+        parts.append(f"{key}\0{text_hash}")
+    return _digest("\n".join(sorted(parts))), chunks
+
+
+def completion_text(response: Dict[str, Any]) -> str:
+    choices = response.get("choices") or [{}]
+    return ((choices[0].get("message") or {}).get("content")) or ""
+
+
+def completion_to_sse(response: Dict[str, Any]) -> List[bytes]:
+    """
+    Закэшированный ответ в виде SSE-потока (для клиентов со `stream: true`):
+    один чанк с текстом целиком, чанк с finish_reason и [DONE].
+    """
+    base = {
+        "id": response.get("id", "chatcmpl-cached"),
+        "object": "chat.completion.chunk",
+        "created": response.get("created", int(time.time())),
+        "model": response.get("model"),
+    }
+    finish = ((response.get("choices") or [{}])[0]).get("finish_reason") or "stop"
+    chunks = [
+        {
+            **base,
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {"role": "assistant", "content": completion_text(response)},
+                    "finish_reason": None,
+                }
+            ],
+        },
+        {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": finish}]},
+    ]
+    events = [f"data: {json.dumps(c, ensure_ascii=False)}\n\n".encode("utf-8") for c in chunks]
+    return events + [b"data: [DONE]\n\n"]
+
+
+class AnswerEntry:
+    def __init__(
+        self,
+        scope: str,
+        embedding: np.ndarray,
+        fingerprint: str,
+        chunks: Dict[str, Dict[str, str]],
+        response: Dict[str, Any],
+        expires: float,
+    ) -> None:
+        self.scope = scope
+        self.embedding = embedding
+        self.fingerprint = fingerprint
+        self.chunks = chunks
+        self.response = response
+        self.expires = expires
+
+
+class AnswerCache:
+    """
+    Семантический кэш ответов LLM.
+
+    Ответ переиспользуется для вопроса, эмбеддинг которого близок к
+    закэшированному (косинусная близость не ниже threshold), но только если
+    поиск по репозиторию вернул ровно тот же контекст (см. context_chunks)
+    и история разговора та же. Записи живут ttl секунд, при переполнении
+    вытесняются давно не использованные (LRU).
+
+    Переиндексация файла обнаруживается по найденным чанкам: если текст чанка
+    изменился, удаляются все записи, использовавшие этот файл (см. observe).
+
+    Не потокобезопасен: рассчитан на использование из одного event loop.
+    """
+
+    def __init__(self, maxsize: int = 1000, ttl: float = 3600.0, threshold: float = 0.95) -> None:
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self.threshold = float(threshold)
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self._ids = itertools.count()
+        self._entries: "OrderedDict[int, AnswerEntry]" = OrderedDict()
+        # путь -> id записей, использовавших файл, и последний известный текст его чанков
+        self._by_path: Dict[str, Set[int]] = {}
+        self._path_chunks: Dict[str, Dict[str, str]] = {}
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        return vec / max(float(np.linalg.norm(vec)), 1e-12)
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for path in entry.chunks:
+            ids = self._by_path.get(path)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._by_path[path]
+                    self._path_chunks.pop(path, None)
+
+    def observe(self, chunks: Dict[str, Dict[str, str]]) -> int:
+        """
+        Сверяет найденные чанки с известными: если текст чанка файла изменился
+        (файл переиндексирован), записи с этим файлом удаляются.
+        Возвращает число удалённых записей.
+        """
+        removed = 0
+        for path, file_chunks in chunks.items():
+            known = self._path_chunks.get(path)
+            if known is None:
+                continue
+            if any(
+                known.get(key, text_hash) != text_hash for key, text_hash in file_chunks.items()
+            ):
+                for entry_id in list(self._by_path.get(path, ())):
+                    self._remove(entry_id)
+                    removed += 1
+        self.invalidated += removed
+        return removed
+
+    def get(
+        self, scope: str, embedding: Sequence[float], fingerprint: str
+    ) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        for entry_id in [i for i, e in self._entries.items() if e.expires < now]:
+            self._remove(entry_id)
+
+        candidates = [
+            (entry_id, entry)
+            for entry_id, entry in self._entries.items()
+            if entry.scope == scope and entry.fingerprint == fingerprint
+        ]
+        if candidates:
+            matrix = np.stack([entry.embedding for _, entry in candidates])
+            scores = matrix @ self._normalize(embedding)
+            best = int(np.argmax(scores))
+            if float(scores[best]) >= self.threshold:
+                entry_id, entry = candidates[best]
+                self._entries.move_to_end(entry_id)
+                self.hits += 1
+                return entry.response
+        self.misses += 1
+        return None
+
+    def set(
+        self,
+        scope: str,
+        embedding: Sequence[float],
+        fingerprint: str,
+        chunks: Dict[str, Dict[str, str]],
+        response: Dict[str, Any],
+    ) -> None:
+        entry_id = next(self._ids)
+        self._entries[entry_id] = AnswerEntry(
+            scope,
+            self._normalize(embedding),
+            fingerprint,
+            chunks,
+            response,
+            time.monotonic() + self.ttl,
+        )
+        for path, file_chunks in chunks.items():
+            self._by_path.setdefault(path, set()).add(entry_id)
+            self._path_chunks.setdefault(path, {}).update(file_chunks)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def answer_cache_from_config(config: Dict[str, Any]) -> Optional[AnswerCache]:
+    """
+    AnswerCache по секции answer_cache конфига (None, если кэш выключен):
+
+      enabled: false
+      similarity_threshold: 0.95
+      ttl: 3600
+      max_entries: 1000
+    """
+    cache_cfg = config.get("answer_cache") or {}
+    if not cache_cfg.get("enabled", False):
+        return None
+    return AnswerCache(
+        maxsize=cache_cfg.get("max_entries", 1000),
+        ttl=cache_cfg.get("ttl", 3600.0),
+        threshold=cache_cfg.get("similarity_threshold", 0.95),
+    )
@@ -0,0 +1,172 @@
+import re
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import argparse
+from typing import Any, Dict, List
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# размерность векторов заглушки эмбеддингов
+DEFAULT_DIM = 256
+
+_WORD_RE = re.compile(r"[A-Za-z0-9_]+(?:(?:::|\.)[A-Za-z0-9_]+)*")
+_DOC_RE = re.compile(r"^\[DOC \d+\] file: (.+?)(?: \(lines \d+-\d+\))?$", re.MULTILINE)
+
+
+def _words(text: str) -> List[str]:
+    words: List[str] = []
+    for word in _WORD_RE.findall(text.lower()):
+        words.append(word)
+        parts = re.split(r"::|\.", word)
+        if len(parts) > 1:
+            words.extend(parts)
+    return words
+
+
+def fake_embedding(text: str, dim: int = DEFAULT_DIM) -> np.ndarray:
+    """
+    Детерминированный вектор текста: хэш каждого слова выбирает координату
+    и знак.
+    """
+    vec = np.zeros(dim, dtype=np.float32)
+    for word in _words(text):
+        h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = float(np.linalg.norm(vec))
+    if norm == 0.0:
+        vec[0] = 1.0
+        return vec
+    return vec / norm
+
+
+def context_paths(messages: List[Dict[str, Any]]) -> List[str]:
+    """
+    Пути документов из системных сообщений с контекстом, по порядку.
+    """
+    paths: List[str] = []
+    for m in messages:
+        if m.get("role") == "system" and isinstance(m.get("content"), str):
+            paths.extend(_DOC_RE.findall(m["content"]))
+    return paths
+
+
+def create_app(
+    dim: int = DEFAULT_DIM,
+    embed_latency: float = 0.0,
+    embed_latency_per_text: float = 0.0,
+    chat_latency: float = 0.0,
+) -> FastAPI:
+    """
+    Заглушки OpenAI-совместимых сервисов с настраиваемыми задержками:
+
+      POST /v1/embeddings       — детерминированные эмбеддинги (fake_embedding);
+      POST /v1/chat/completions — ответ перечисляет файлы из переданного
+                                  контекста (JSON {"context_paths": [...]}),
+                                  чтобы бенчмарк видел результат поиска.
+    """
+    app = FastAPI()
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        texts = body.get("input") or []
+        if isinstance(texts, str):
+            texts = [texts]
+        delay = embed_latency + embed_latency_per_text * len(texts)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        data = []
+        for i, text in enumerate(texts):
+            vec = fake_embedding(text, dim)
+            if body.get("encoding_format") == "base64":
+                value: Any = base64.b64encode(vec.astype("<f4").tobytes()).decode("ascii")
+            else:
+                value = vec.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": value})
+        return {"object": "list", "data": data, "model": body.get("model")}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        answer = json.dumps({"context_paths": context_paths(body.get("messages") or [])})
+        created = int(time.time())
+
+        if not body.get("stream"):
+            if chat_latency > 0:
+                await asyncio.sleep(chat_latency)
+            return JSONResponse(
+                {
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": body.get("model"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": answer},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                }
+            )
+
+        async def stream():
+            # ответ уходит несколькими чанками, задержка делится между ними
+            pieces = [answer[i : i + 16] for i in range(0, len(answer), 16)] or [""]
+            for piece in pieces:
+                if chat_latency > 0:
+                    await asyncio.sleep(chat_latency / len(pieces))
+                chunk = {
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": body.get("model"),
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+            yield b"data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fake OpenAI-compatible embedding and chat services"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM, help="Embedding size")
+    parser.add_argument(
+        "--embed-latency", type=float, default=0.0, help="Delay per embeddings request, seconds"
+    )
+    parser.add_argument(
+        "--embed-latency-per-text",
+        type=float,
+        default=0.0,
+        help="Extra delay per text in an embeddings request, seconds",
+    )
+    parser.add_argument(
+        "--chat-latency", type=float, default=0.0, help="Delay per chat completion, seconds"
+    )
+    args = parser.parse_args()
+
+    import uvicorn
+
+    uvicorn.run(
+        create_app(args.dim, args.embed_latency, args.embed_latency_per_text, args.chat_latency),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
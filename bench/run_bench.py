@@ -0,0 +1,477 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import yaml
+
+from bench.synth_repo import generate_repo
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# сколько ждать, пока поднимутся заглушки и сервер, секунды
+STARTUP_TIMEOUT = 60.0
+
+_METRIC_RE = re.compile(r"^(\w+)(?:\{([^}]*)\})? (\S+)$", re.MULTILINE)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_port(port: int, proc: subprocess.Popen, timeout: float = STARTUP_TIMEOUT) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"process {proc.args} exited with code {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"port {port} did not open in {timeout:.0f}s")
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def parse_metrics(text: str) -> Dict[Tuple[str, str], float]:
+    """
+    Текстовый формат Prometheus -> {(имя, метки): значение}.
+    """
+    return {(name, labels or ""): float(value) for name, labels, value in _METRIC_RE.findall(text)}
+
+
+def write_config(workdir: Path, fake_url: str, args: Any) -> None:
+    """
+    config.yaml бенчмарка: заглушки вместо LLM и сервиса эмбеддингов,
+    встроенное хранилище векторов (или Qdrant с --qdrant-url), без кэша
+    эмбеддингов — каждый прогон меряет реальную работу.
+    """
+    agent_cfg: Dict[str, Any] = {
+        "limit": args.limit,
+        "collection_name": "bench_chunks",
+        "vector_backend": "local",
+        "vector_store_path": str(workdir / ".vector_store"),
+        "lexical_index_path": str(workdir / ".lexical_index"),
+        "hybrid": not args.no_hybrid,
+        # без --query-cache каждый запрос проходит поиск целиком
+        "query_cache_ttl": 300.0 if args.query_cache else 0.0,
+        "micro_batch": not args.no_micro_batch,
+        "rerank": args.rerank,
+        "rerank_candidates": args.rerank_candidates,
+    }
+    if args.qdrant_url:
+        agent_cfg.update(
+            vector_backend="qdrant",
+            qdrant_url=args.qdrant_url,
+            collection_name=f"bench_chunks_{os.getpid()}",
+        )
+    config = {
+        "llm": {"api_base": fake_url, "api_key": "", "model": "bench-llm"},
+        "embedding": {
+            "api_base": fake_url,
+            "api_key": "",
+            "model": "bench-embedding",
+            "encoding_format": args.encoding_format,
+            "cache": {"enabled": False},
+        },
+        "context": {"max_tokens": args.context_tokens},
+        "agents": [
+            {
+                "name": "RepoSearchAgent",
+                "module": "agents.agent1",
+                "enabled": True,
+                "config": agent_cfg,
+            }
+        ],
+    }
+    (workdir / "config.yaml").write_text(yaml.safe_dump(config, sort_keys=False), encoding="utf-8")
+
+
+def run_indexer(workdir: Path, repo: Path, env: Dict[str, str], workers: int) -> Dict[str, float]:
+    metrics_file = workdir / "index_metrics.prom"
+    started = time.perf_counter()
+    subprocess.run(
+        [
+            sys.executable,
+            str(REPO_ROOT / "index_repo.py"),
+            str(repo),
+            "--workers",
+            str(workers),
+            "--metrics-file",
+            str(metrics_file),
+        ],
+        cwd=workdir,
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    elapsed = time.perf_counter() - started
+
+    values = parse_metrics(metrics_file.read_text(encoding="utf-8"))
+    files = values.get(("rag_index_files_total", 'status="indexed"'), 0.0)
+    chunks = values.get(("rag_index_chunks_total", ""), 0.0)
+    stats = {
+        "seconds": elapsed,
+        "files": files,
+        "chunks": chunks,
+        "files_per_s": files / elapsed,
+        "chunks_per_s": chunks / elapsed,
+    }
+    for stage in ("embedding", "upsert"):
+        count = values.get(("rag_stage_duration_seconds_count", f'stage="{stage}"'), 0.0)
+        total = values.get(("rag_stage_duration_seconds_sum", f'stage="{stage}"'), 0.0)
+        stats[f"{stage}_avg_ms"] = total / count * 1000 if count else 0.0
+    return stats
+
+
+def _context_paths(content: str) -> List[str]:
+    try:
+        paths = json.loads(content).get("context_paths", [])
+    except (ValueError, AttributeError):
+        return []
+    # чанки одного файла могут идти несколькими фрагментами
+    return list(dict.fromkeys(paths))
+
+
+async def _chat(client: httpx.AsyncClient, query: str, stream: bool) -> Tuple[float, float, str]:
+    """
+    Один запрос к серверу: (время до первого байта, полное время, ответ модели).
+    """
+    body = {"model": "bench", "stream": stream, "messages": [{"role": "user", "content": query}]}
+    started = time.perf_counter()
+    if not stream:
+        resp = await client.post("/v1/chat/completions", json=body)
+        resp.raise_for_status()
+        elapsed = time.perf_counter() - started
+        return elapsed, elapsed, resp.json()["choices"][0]["message"]["content"]
+
+    first: Optional[float] = None
+    parts: List[str] = []
+    async with client.stream("POST", "/v1/chat/completions", json=body) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if first is None:
+                first = time.perf_counter() - started
+            if not line.startswith("data: ") or line == "data: [DONE]":
+                continue
+            chunk = json.loads(line[len("data: ") :])
+            for choice in chunk.get("choices", []):
+                parts.append((choice.get("delta") or {}).get("content") or "")
+    elapsed = time.perf_counter() - started
+    return first if first is not None else elapsed, elapsed, "".join(parts)
+
+
+async def load_test(
+    server_url: str,
+    queries: List[Dict[str, str]],
+    requests: int,
+    concurrency: int,
+    stream: bool,
+) -> Dict[str, Any]:
+    """
+    requests запросов при concurrency одновременных. Запросы берутся из
+    queries по кругу; для recall@k учитывается первый ответ на каждый запрос.
+    """
+    latencies: List[float] = []
+    ttfb: List[float] = []
+    errors = 0
+    answers: Dict[int, List[str]] = {}
+    next_request = 0
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        nonlocal next_request, errors
+        while next_request < requests:
+            i = next_request
+            next_request += 1
+            q = i % len(queries)
+            try:
+                first, elapsed, content = await _chat(client, queries[q]["query"], stream)
+            except (httpx.HTTPError, ValueError, KeyError):
+                errors += 1
+                continue
+            latencies.append(elapsed)
+            ttfb.append(first)
+            answers.setdefault(q, _context_paths(content))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    started = time.perf_counter()
+    async with httpx.AsyncClient(
+        base_url=server_url, timeout=120.0, limits=limits, trust_env=False
+    ) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / wall if wall > 0 else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        "ttfb_p50_ms": percentile(ttfb, 50) * 1000,
+        "ttfb_p99_ms": percentile(ttfb, 99) * 1000,
+        "answers": answers,
+    }
+
+
+def query_batch_sizes(server_url: str) -> Dict[str, float]:
+    """
+    Средний размер микро-батча запросов по /metrics сервера (эмбеддинги и поиск).
+    """
+    resp = httpx.get(f"{server_url}/metrics", timeout=10.0, trust_env=False)
+    resp.raise_for_status()
+    values = parse_metrics(resp.text)
+    result: Dict[str, float] = {}
+    for kind in ("embedding", "vector_search"):
+        count = values.get(("rag_query_batch_size_count", f'kind="{kind}"'), 0.0)
+        total = values.get(("rag_query_batch_size_sum", f'kind="{kind}"'), 0.0)
+        if count:
+            result[f"{kind}_batch_avg"] = total / count
+    return result
+
+
+def recall_at_k(
+    queries: List[Dict[str, str]], answers: Dict[int, List[str]], ks: Sequence[int]
+) -> Dict[str, float]:
+    """
+    Доля запросов, у которых нужный файл среди первых k файлов контекста
+    (всего и по видам запросов).
+    """
+    result: Dict[str, float] = {}
+    kinds = sorted({q["kind"] for q in queries})
+    for k in ks:
+        for kind in [None] + kinds:
+            answered = [
+                (queries[i], paths)
+                for i, paths in answers.items()
+                if kind is None or queries[i]["kind"] == kind
+            ]
+            if not answered:
+                continue
+            found = sum(1 for q, paths in answered if q["path"] in paths[:k])
+            name = f"recall@{k}" if kind is None else f"recall@{k}/{kind}"
+            result[name] = found / len(answered)
+    return result
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    idx = report["index"]
+    print(
+        f"Индексация: {idx['files']:.0f} файлов, {idx['chunks']:.0f} чанков за {idx['seconds']:.2f} с "
+        f"({idx['files_per_s']:.1f} файлов/с, {idx['chunks_per_s']:.1f} чанков/с; "
+        f"эмбеддинг в среднем {idx['embedding_avg_ms']:.1f} мс, "
+        f"upsert {idx['upsert_avg_ms']:.1f} мс)"
+    )
+    chat = report["chat"]
+    print(
+        f"Чат: {chat['requests']} запросов (ошибок {chat['errors']}), "
+        f"параллельно {report['params']['concurrency']}, {chat['rps']:.1f} запросов/с; "
+        f"p50 {chat['p50_ms']:.1f} мс, p99 {chat['p99_ms']:.1f} мс, "
+        f"первый байт p50 {chat['ttfb_p50_ms']:.1f} мс"
+    )
+    if "embedding_batch_avg" in chat:
+        print(
+            f"Микро-батчи: эмбеддинги в среднем по {chat['embedding_batch_avg']:.1f} запроса, "
+            f"поиск — по {chat.get('vector_search_batch_avg', 0.0):.1f}"
+        )
+    print(
+        "Качество поиска: "
+        + ", ".join(f"{name} {value:.3f}" for name, value in report["recall"].items())
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark indexing throughput, chat latency and retrieval quality "
+        "against local stand-ins for the embedding, LLM and vector store services"
+    )
+    parser.add_argument(
+        "--modules", type=int, default=200, help="Synthetic repo size (5 files per module)"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=300, help="Chat requests to send")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent chat requests")
+    parser.add_argument(
+        "--queries", type=int, default=300, help="Labeled queries to use (random sample)"
+    )
+    parser.add_argument("--stream", action="store_true", help="Use streaming chat requests")
+    parser.add_argument("--k", default="1,3,5", help="Comma-separated k values for recall@k")
+    parser.add_argument("--limit", type=int, default=8, help="RepoSearchAgent limit")
+    parser.add_argument("--context-tokens", type=int, default=6000, help="Context token budget")
+    parser.add_argument("--no-hybrid", action="store_true", help="Vector search only (no BM25)")
+    parser.add_argument(
+        "--query-cache", action="store_true", help="Keep the agent's query cache on"
+    )
+    parser.add_argument(
+        "--no-micro-batch",
+        action="store_true",
+        help="Embed and search every query separately (no cross-request batching)",
+    )
+    parser.add_argument(
+        "--rerank",
+        default="none",
+        choices=["none", "lexical", "cross_encoder"],
+        help="Second-stage reranking in RepoSearchAgent",
+    )
+    parser.add_argument(
+        "--rerank-candidates", type=int, default=50, help="First-stage hits to rerank"
+    )
+    parser.add_argument("--encoding-format", default="float", choices=["float", "base64"])
+    parser.add_argument("--index-workers", type=int, default=4, help="index_repo.py --workers")
+    parser.add_argument(
+        "--embed-latency", type=float, default=0.01, help="Fake embeddings delay per request, s"
+    )
+    parser.add_argument(
+        "--embed-latency-per-text",
+        type=float,
+        default=0.0005,
+        help="Fake embeddings delay per text, s",
+    )
+    parser.add_argument(
+        "--chat-latency", type=float, default=0.05, help="Fake LLM delay per answer, s"
+    )
+    parser.add_argument(
+        "--qdrant-url", help="Use a real Qdrant instead of the built-in vector store"
+    )
+    parser.add_argument(
+        "--workdir", help="Keep the generated repo, indexes and logs in this directory"
+    )
+    parser.add_argument("--json", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    workdir = (
+        Path(args.workdir).resolve()
+        if args.workdir
+        else Path(tempfile.mkdtemp(prefix="rag-bench-"))
+    )
+    workdir.mkdir(parents=True, exist_ok=True)
+    repo = workdir / "repo"
+    if repo.exists():
+        shutil.rmtree(repo)
+    for name in (".vector_store", ".lexical_index"):
+        shutil.rmtree(workdir / name, ignore_errors=True)
+
+    queries = generate_repo(repo, args.modules, args.seed)
+    if args.queries < len(queries):
+        queries = random.Random(args.seed).sample(queries, args.queries)
+
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(REPO_ROOT), os.environ.get("PYTHONPATH")])),
+    }
+    fake_port, server_port = free_port(), free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    write_config(workdir, fake_url, args)
+
+    procs: List[subprocess.Popen] = []
+    logs = open(workdir / "services.log", "w", encoding="utf-8")
+    try:
+        fake = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "bench.fake_services",
+                "--port",
+                str(fake_port),
+                "--embed-latency",
+                str(args.embed_latency),
+                "--embed-latency-per-text",
+                str(args.embed_latency_per_text),
+                "--chat-latency",
+                str(args.chat_latency),
+            ],
+            cwd=workdir,
+            env=env,
+            stdout=logs,
+            stderr=subprocess.STDOUT,
+        )
+        procs.append(fake)
+        wait_port(fake_port, fake)
+
+        index_stats = run_indexer(workdir, repo, env, args.index_workers)
+
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "server:app",
+                "--host",
+                "127.0.0.1",
+                "--port",
+                str(server_port),
+                "--log-level",
+                "warning",
+            ],
+            cwd=workdir,
+            env=env,
+            stdout=logs,
+            stderr=subprocess.STDOUT,
+        )
+        procs.append(server)
+        wait_port(server_port, server)
+
+        server_url = f"http://127.0.0.1:{server_port}"
+        chat = asyncio.run(
+            load_test(server_url, queries, args.requests, args.concurrency, args.stream)
+        )
+        chat.update(query_batch_sizes(server_url))
+        ks = [int(k) for k in args.k.split(",") if k.strip()]
+        report = {
+            "params": {
+                "modules": args.modules,
+                "files": args.modules * 5,
+                "queries": len(queries),
+                "concurrency": args.concurrency,
+                "stream": args.stream,
+                "hybrid": not args.no_hybrid,
+                "micro_batch": not args.no_micro_batch,
+                "rerank": args.rerank,
+                "embed_latency": args.embed_latency,
+                "chat_latency": args.chat_latency,
+            },
+            "index": index_stats,
+            "chat": {k: v for k, v in chat.items() if k != "answers"},
+            "recall": recall_at_k(queries, chat["answers"], ks),
+        }
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        logs.close()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(
+            json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8"
+        )
+
+
+if __name__ == "__main__":
+    main()
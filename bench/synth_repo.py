@@ -0,0 +1,174 @@
+import json
+import random
+import argparse
+from pathlib import Path
+from typing import Dict, List
+
+# словари для имён модулей и текста (детерминированно перемешиваются по seed)
+_ADJECTIVES = (
+    "amber brisk cobalt dusty eager frosty gentle hollow ivory jolly keen lunar "
+    "mellow nimble opal proud quiet rustic silent tidal umber vivid woven young zesty"
+).split()
+_NOUNS = (
+    "badger cedar delta ember falcon glacier harbor iris juniper kestrel lantern "
+    "meadow nebula orchard pepper quarry raven summit thistle upland valley willow "
+    "yarrow zephyr"
+).split()
+_SERVICES = ["nginx", "postgres", "redis", "haproxy", "rabbitmq", "memcached", "kafka", "consul"]
+_FILLER = (
+    "This module is managed by the platform team. Changes must go through review. "
+    "Parameters are looked up in hiera and can be overridden per environment. "
+    "The service is restarted automatically when its configuration file changes."
+).split(". ")
+
+
+def _module_names(n_modules: int, rng: random.Random) -> List[str]:
+    names: List[str] = []
+    for i in range(n_modules):
+        names.append(f"{rng.choice(_ADJECTIVES)}_{rng.choice(_NOUNS)}_{i}")
+    return names
+
+
+def _init_pp(name: str, service: str, port: int, workers: int) -> str:
+    return (
+        f"# Class: {name}\n"
+        f"#\n"
+        f"# Installs and configures {service} for the {name} role.\n"
+        f"class {name} (\n"
+        f"  Integer $port = {port},\n"
+        f"  Integer $workers = {workers},\n"
+        f") {{\n"
+        f"  contain {name}::install\n"
+        f"  contain {name}::config\n"
+        f"  contain {name}::service\n"
+        f"\n"
+        f"  Class['{name}::install']\n"
+        f"  -> Class['{name}::config']\n"
+        f"  ~> Class['{name}::service']\n"
+        f"}}\n"
+    )
+
+
+def _config_pp(name: str, service: str) -> str:
+    return (
+        f"class {name}::config {{\n"
+        f"  file {{ '/etc/{service}/{name}.conf':\n"
+        f"    ensure  => file,\n"
+        f"    owner   => 'root',\n"
+        f"    mode    => '0644',\n"
+        f"    content => template('{name}/{service}.conf.erb'),\n"
+        f"  }}\n"
+        f"}}\n"
+    )
+
+
+def _service_pp(name: str, service: str) -> str:
+    return (
+        f"class {name}::service {{\n"
+        f"  service {{ '{service}':\n"
+        f"    ensure => running,\n"
+        f"    enable => true,\n"
+        f"  }}\n"
+        f"}}\n"
+    )
+
+
+def _hiera(name: str, port: int, workers: int, rng: random.Random) -> str:
+    lines = [
+        "---",
+        f"{name}::port: {port}",
+        f"{name}::workers: {workers}",
+        f"{name}::log_level: {rng.choice(['info', 'warn', 'debug'])}",
+        f"{name}::backup_window: '0{rng.randint(1, 5)}:00'",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def _readme(name: str, service: str, owner: str, rng: random.Random) -> str:
+    filler = " ".join(rng.sample(_FILLER, len(_FILLER)))
+    return (
+        f"# {name}\n"
+        f"\n"
+        f"Role `{name}` runs {service} for the {owner} team.\n"
+        f"\n"
+        f"{filler}\n"
+        f"\n"
+        f"## Usage\n"
+        f"\n"
+        f"```puppet\n"
+        f"include {name}\n"
+        f"```\n"
+    )
+
+
+def generate_repo(root: Path, n_modules: int, seed: int = 0) -> List[Dict[str, str]]:
+    """
+    Создаёт в root синтетический Puppet-репозиторий из n_modules модулей
+    (manifests/*.pp, README.md, hieradata/<модуль>.yaml — 5 файлов на модуль)
+    и возвращает размеченные запросы: {"query", "path", "kind"}, где path —
+    файл, который должен найтись по запросу.
+    """
+    rng = random.Random(seed)
+    root = Path(root)
+    queries: List[Dict[str, str]] = []
+
+    for name in _module_names(n_modules, rng):
+        service = rng.choice(_SERVICES)
+        owner = f"{rng.choice(_ADJECTIVES)} {rng.choice(_NOUNS)}"
+        port = rng.randint(1024, 65000)
+        workers = rng.randint(1, 64)
+
+        manifests = root / "modules" / name / "manifests"
+        manifests.mkdir(parents=True, exist_ok=True)
+        (manifests / "init.pp").write_text(_init_pp(name, service, port, workers), encoding="utf-8")
+        (manifests / "config.pp").write_text(_config_pp(name, service), encoding="utf-8")
+        (manifests / "service.pp").write_text(_service_pp(name, service), encoding="utf-8")
+        (root / "modules" / name / "README.md").write_text(
+            _readme(name, service, owner, rng), encoding="utf-8"
+        )
+        hieradata = root / "hieradata"
+        hieradata.mkdir(parents=True, exist_ok=True)
+        (hieradata / f"{name}.yaml").write_text(_hiera(name, port, workers, rng), encoding="utf-8")
+
+        queries.extend(
+            [
+                {
+                    "query": f"Which file does {name}::config manage?",
+                    "path": f"modules/{name}/manifests/config.pp",
+                    "kind": "identifier",
+                },
+                {
+                    "query": f"What is the backup window of {name}::backup_window in hiera?",
+                    "path": f"hieradata/{name}.yaml",
+                    "kind": "hiera",
+                },
+                {
+                    "query": f"Which team owns the {name} role and what does it run?",
+                    "path": f"modules/{name}/README.md",
+                    "kind": "docs",
+                },
+            ]
+        )
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic Puppet/YAML/Markdown repository"
+    )
+    parser.add_argument("root", help="Directory to create the repository in")
+    parser.add_argument("--modules", type=int, default=100, help="Number of modules (5 files each)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", help="Write labeled queries (JSONL) to this file")
+    args = parser.parse_args()
+
+    queries = generate_repo(Path(args.root), args.modules, args.seed)
+    if args.queries:
+        with open(args.queries, "w", encoding="utf-8") as f:
+            for q in queries:
+                f.write(json.dumps(q, ensure_ascii=False) + "\n")
+    print(f"Создано модулей: {args.modules}, файлов: {args.modules * 5}, запросов: {len(queries)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from tokens import DEFAULT_ENCODING, count_tokens, split_by_tokens
+
+DEFAULT_MAX_TOKENS = 512
+DEFAULT_OVERLAP_TOKENS = 64
+
+# версия алгоритма разбиения: входит в сигнатуру чанкера и в манифест индекса,
+# чтобы смена алгоритма или параметров приводила к переиндексации
+CHUNKER_VERSION = 1
+
+
+@dataclass
+class Chunk:
+    text: str
+    start_line: int  # номер первой строки в файле, с 1
+    end_line: int  # номер последней строки (включительно)
+    tokens: int
+
+
+class BoundarySplitter:
+    """
+    Базовый сплиттер: определяет строки, с которых может начинаться новая
+    смысловая секция файла (заголовок, ключ верхнего уровня, блок кода и т.п.).
+
+    Сплиттер получает строки по одной и может хранить состояние
+    (например, находимся ли мы внутри блока кода в Markdown).
+    Строки-комментарии прямо над границей переносятся в новую секцию.
+    """
+
+    comment_prefixes: Tuple[str, ...] = ()
+
+    def is_boundary(self, line: str) -> bool:
+        return False
+
+    def is_comment(self, line: str) -> bool:
+        return bool(self.comment_prefixes) and line.lstrip().startswith(self.comment_prefixes)
+
+
+class ParagraphSplitter(BoundarySplitter):
+    """
+    Обычный текст: граница — первая непустая строка после пустой.
+    """
+
+    def __init__(self) -> None:
+        self._prev_blank = False
+
+    def is_boundary(self, line: str) -> bool:
+        blank = not line.strip()
+        boundary = self._prev_blank and not blank
+        self._prev_blank = blank
+        return boundary
+
+
+class MarkdownSplitter(BoundarySplitter):
+    """
+    Markdown: граница — заголовок (`#`, `##`, ...) вне блоков кода.
+    """
+
+    _heading = re.compile(r"^#{1,6}\s")
+
+    def __init__(self) -> None:
+        self._in_fence = False
+
+    def is_boundary(self, line: str) -> bool:
+        if line.lstrip().startswith(("```", "~~~")):
+            self._in_fence = not self._in_fence
+            return False
+        return not self._in_fence and bool(self._heading.match(line))
+
+
+class YamlSplitter(BoundarySplitter):
+    """
+    YAML: граница — ключ верхнего уровня, элемент списка верхнего уровня
+    или разделитель документов `---`.
+    """
+
+    comment_prefixes = ("#",)
+
+    def is_boundary(self, line: str) -> bool:
+        return bool(line.strip()) and not line[0].isspace() and not line.startswith("#")
+
+
+class PuppetSplitter(BoundarySplitter):
+    """
+    Puppet: граница — объявление class/define/node/function
+    или начало ресурса (`file { '/etc/foo':`, `@@exported { $title:` ...).
+    """
+
+    comment_prefixes = ("#",)
+
+    _definition = re.compile(r"^\s*(class|define|node|function|plan)\s")
+    _resource = re.compile(r"^\s*@{0,2}[a-z][\w:]*\s*\{\s*(['\"$\[]|[\w:]+\s*:)")
+
+    def is_boundary(self, line: str) -> bool:
+        return bool(self._definition.match(line) or self._resource.match(line))
+
+
+class TemplateSplitter(PuppetSplitter):
+    """
+    Шаблоны ERB/EPP: как Puppet, плюс управляющие блоки шаблона
+    (`<% if ... %>`, `<% @items.each do |i| %>`, `<% $items.each |$i| { %>`).
+    """
+
+    comment_prefixes = ("#", "<%#")
+
+    _control = re.compile(r"^\s*<%-?\s*(if|unless|case)\b|^\s*<%-?.*\.each\b")
+
+    def is_boundary(self, line: str) -> bool:
+        return super().is_boundary(line) or bool(self._control.match(line))
+
+
+# расширение файла -> фабрика сплиттера; расширяется через register_splitter
+SPLITTERS: Dict[str, Callable[[], BoundarySplitter]] = {
+    ".md": MarkdownSplitter,
+    ".yaml": YamlSplitter,
+    ".yml": YamlSplitter,
+    ".pp": PuppetSplitter,
+    ".epp": TemplateSplitter,
+    ".erb": TemplateSplitter,
+    ".txt": ParagraphSplitter,
+}
+
+
+def register_splitter(suffixes: Iterable[str], factory: Callable[[], BoundarySplitter]) -> None:
+    """
+    Подключает сплиттер для указанных расширений файлов (например, {".py"}).
+    """
+    for suffix in suffixes:
+        SPLITTERS[suffix.lower()] = factory
+
+
+class Chunker:
+    """
+    Разбивает файл на чанки по токенам с учётом структуры.
+
+    Строки упаковываются в чанк, пока он помещается в max_tokens. При
+    переполнении чанк обрезается по последней структурной границе
+    (см. BoundarySplitter), так что заголовки Markdown, ключи YAML и блоки
+    Puppet не разрываются. Если одна секция сама больше max_tokens, она
+    режется по строкам с перекрытием overlap_tokens, а слишком длинная
+    строка — по токенам.
+
+    Работает потоково: строки читаются по одной, а чанки отдаются сразу,
+    как только сформированы.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = DEFAULT_MAX_TOKENS,
+        overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+        encoding: str = DEFAULT_ENCODING,
+    ) -> None:
+        self.max_tokens = max(16, int(max_tokens))
+        self.overlap_tokens = max(0, min(int(overlap_tokens), self.max_tokens // 2))
+        self.encoding = encoding
+
+    @property
+    def signature(self) -> str:
+        return f"v{CHUNKER_VERSION}:{self.encoding}:{self.max_tokens}:{self.overlap_tokens}"
+
+    def splitter_for(self, suffix: str) -> BoundarySplitter:
+        factory = SPLITTERS.get(suffix.lower(), ParagraphSplitter)
+        return factory()
+
+    def chunk_text(self, text: str, suffix: str = "") -> List[Chunk]:
+        return list(self.chunk_lines(text.splitlines(keepends=True), suffix))
+
+    def chunk_lines(self, lines: Iterable[str], suffix: str = "") -> Iterator[Chunk]:
+        splitter = self.splitter_for(suffix)
+        # буфер текущего чанка: (номер строки, строка, токены)
+        buf: List[Tuple[int, str, int]] = []
+        buf_tokens = 0
+        # индекс в buf, с которого начинается последняя секция
+        section_start = 0
+
+        for lineno, line in enumerate(lines, 1):
+            ntok = count_tokens(line, self.encoding)
+
+            if splitter.is_boundary(line):
+                section_start = len(buf)
+                # комментарии прямо над границей относятся к новой секции
+                while section_start > 0 and splitter.is_comment(buf[section_start - 1][1]):
+                    section_start -= 1
+
+            if ntok > self.max_tokens:
+                # строка сама не помещается в чанк: сбрасываем буфер и режем её по токенам
+                chunk = self._make_chunk(buf)
+                if chunk:
+                    yield chunk
+                buf, buf_tokens, section_start = [], 0, 0
+                for piece in split_by_tokens(line, self.max_tokens, self.encoding):
+                    chunk = self._make_chunk([(lineno, piece, count_tokens(piece, self.encoding))])
+                    if chunk:
+                        yield chunk
+                continue
+
+            while buf and buf_tokens + ntok > self.max_tokens:
+                if section_start > 0:
+                    # закрываем чанк по последней структурной границе
+                    head, buf = buf[:section_start], buf[section_start:]
+                    section_start = 0
+                else:
+                    # секция больше чанка: режем по строкам с перекрытием
+                    head = buf
+                    buf = self._overlap_tail(head, ntok)
+                chunk = self._make_chunk(head)
+                if chunk:
+                    yield chunk
+                buf_tokens = sum(t for _, _, t in buf)
+
+            buf.append((lineno, line, ntok))
+            buf_tokens += ntok
+
+        chunk = self._make_chunk(buf)
+        if chunk:
+            yield chunk
+
+    def _overlap_tail(self, lines: List[Tuple[int, str, int]], incoming: int) -> List[Tuple[int, str, int]]:
+        """
+        Последние строки чанка (не больше overlap_tokens), которые повторяются
+        в начале следующего, чтобы не терять контекст на разрыве секции.
+        """
+        budget = min(self.overlap_tokens, self.max_tokens - incoming)
+        tail: List[Tuple[int, str, int]] = []
+        used = 0
+        for item in reversed(lines[1:]):
+            if used + item[2] > budget:
+                break
+            tail.append(item)
+            used += item[2]
+        tail.reverse()
+        return tail
+
+    @staticmethod
+    def _make_chunk(lines: List[Tuple[int, str, int]]) -> Optional[Chunk]:
+        text = "".join(line for _, line, _ in lines)
+        if not text.strip():
+            return None
+        return Chunk(
+            text=text,
+            start_line=lines[0][0],
+            end_line=lines[-1][0],
+            tokens=sum(t for _, _, t in lines),
+        )
+
+
+def chunker_from_config(app_cfg: Dict) -> Chunker:
+    """
+    Создаёт Chunker по секции `chunking` в config.yaml.
+    """
+    chunk_cfg = app_cfg.get("chunking") or {}
+    return Chunker(
+        max_tokens=chunk_cfg.get("max_tokens", DEFAULT_MAX_TOKENS),
+        overlap_tokens=chunk_cfg.get("overlap_tokens", DEFAULT_OVERLAP_TOKENS),
+        encoding=chunk_cfg.get("encoding", DEFAULT_ENCODING),
+    )
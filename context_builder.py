@@ -0,0 +1,262 @@
+import re
+import hashlib
+from typing import Any, Dict, List, Optional, Set
+
+from tokens import DEFAULT_ENCODING, count_tokens
+
+DEFAULT_MAX_TOKENS = 6000
+
+# документы с долей общих шинглов не меньше порога считаются дубликатами
+DEFAULT_DEDUP_THRESHOLD = 0.9
+
+# меньше такого остатка бюджета документ не обрезаем, а пропускаем
+MIN_TRUNCATED_TOKENS = 64
+
+# длина шингла (в словах) для поиска почти одинаковых документов
+SHINGLE_SIZE = 5
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def hits_to_documents(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Преобразует хиты Qdrant в документы для ContextBuilder.
+    """
+    docs: List[Dict[str, Any]] = []
+    for hit in hits:
+        payload = hit.get("payload") or {}
+        docs.append(
+            {
+                "path": payload.get("path", "unknown"),
+                "text": payload.get("text", ""),
+                "start_line": payload.get("start_line"),
+                "end_line": payload.get("end_line"),
+                "score": hit.get("score"),
+                "id": hit.get("id"),
+                "chunk_index": payload.get("chunk_index"),
+            }
+        )
+    return docs
+
+
+def format_documents(docs: List[Dict[str, Any]]) -> str:
+    """
+    Текст контекста вида:
+
+      [DOC 1] file: path/to/file1 (lines 10-42)
+      <text>
+
+    Документы без пути (контекст от агентов, не возвращающих документы)
+    вставляются как есть.
+    """
+    parts: List[str] = []
+    n = 0
+    for doc in docs:
+        if doc.get("path") is None:
+            parts.append(doc["text"])
+            continue
+        n += 1
+        path = doc["path"]
+        if doc.get("start_line"):
+            path = f"{path} (lines {doc['start_line']}-{doc.get('end_line')})"
+        parts.append(f"[DOC {n}] file: {path}\n{doc['text']}\n")
+    return "\n\n".join(parts)
+
+
+def _shingles(text: str) -> Set[str]:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i : i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _has_exact_lines(doc: Dict[str, Any]) -> bool:
+    """
+    Диапазон строк документа соответствует его тексту (можно склеивать по строкам).
+    """
+    start, end = doc.get("start_line"), doc.get("end_line")
+    if not start or not end:
+        return False
+    return len(doc["text"].splitlines()) == end - start + 1
+
+
+def _is_next_piece(cur: Dict[str, Any], doc: Dict[str, Any]) -> Optional[bool]:
+    """
+    doc — другой кусок той же длинной строки, которой заканчивается cur
+    (чанкер режет строку длиннее max_tokens по токенам, и у всех кусков
+    start_line == end_line). True — следующий по порядку кусок, False —
+    не соседний, None — doc не кусок строки cur.
+    """
+    index, last = doc.get("chunk_index"), cur.get("_last_chunk")
+    if index is None or last is None or index == last:
+        return None
+    if not doc["start_line"] == doc["end_line"] == cur["end_line"]:
+        return None
+    return index == last + 1
+
+
+class ContextBuilder:
+    """
+    Собирает итоговый контекст для LLM из документов всех агентов:
+
+    - склеивает пересекающиеся и соседние чанки одного файла в один фрагмент
+      (по диапазонам строк), чтобы не повторять перекрытия и заголовки;
+    - выбрасывает почти одинаковые фрагменты (вендоренные копии, шаблоны);
+    - заполняет бюджет max_tokens (токены считаются tiktoken), начиная
+      с самых релевантных фрагментов; последний фрагмент может быть обрезан.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = DEFAULT_MAX_TOKENS,
+        dedup_threshold: float = DEFAULT_DEDUP_THRESHOLD,
+        encoding: str = DEFAULT_ENCODING,
+    ) -> None:
+        self.max_tokens = int(max_tokens)
+        self.dedup_threshold = float(dedup_threshold)
+        self.encoding = encoding
+
+    def build(self, docs: List[Dict[str, Any]]) -> str:
+        return format_documents(self.select(docs))
+
+    def select(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Склейка, дедупликация и отбор документов в пределах бюджета.
+        """
+        merged = self._merge(docs)
+        unique = self._dedup(merged)
+        return self._fit_budget(unique)
+
+    def _merge(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # порядок групп — по первому (самому релевантному) вхождению файла
+        groups: Dict[Any, List[Dict[str, Any]]] = {}
+        for i, doc in enumerate(docs):
+            key = doc.get("path")
+            if key is None or not _has_exact_lines(doc):
+                key = ("single", i)
+            groups.setdefault(key, []).append(
+                {**doc, "_rank": i, "_last_chunk": doc.get("chunk_index")}
+            )
+
+        result: List[Dict[str, Any]] = []
+        for group in groups.values():
+            if len(group) == 1:
+                result.append(group[0])
+                continue
+            group.sort(key=lambda d: (d["start_line"], d.get("chunk_index") or 0))
+            cur = group[0]
+            for doc in group[1:]:
+                piece = _is_next_piece(cur, doc)
+                if piece:
+                    cur = self._append_piece(cur, doc)
+                elif piece is None and doc["start_line"] <= cur["end_line"] + 1:
+                    cur = self._join(cur, doc)
+                else:
+                    # несмежный кусок длинной строки или разрыв между чанками
+                    result.append(cur)
+                    cur = doc
+            result.append(cur)
+
+        result.sort(key=lambda d: d["_rank"])
+        for doc in result:
+            del doc["_rank"], doc["_last_chunk"]
+        return result
+
+    @staticmethod
+    def _join(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Склеивает два фрагмента одного файла, a начинается не позже b.
+        """
+        if b["end_line"] <= a["end_line"]:
+            joined = dict(a)
+        else:
+            skip = a["end_line"] - b["start_line"] + 1
+            a_text = a["text"] if a["text"].endswith("\n") else a["text"] + "\n"
+            tail = "".join(b["text"].splitlines(keepends=True)[max(0, skip):])
+            joined = {**a, "text": a_text + tail, "end_line": b["end_line"]}
+            joined["_last_chunk"] = b["_last_chunk"]
+        return ContextBuilder._combine(joined, a, b)
+
+    @staticmethod
+    def _append_piece(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Дописывает к a следующий кусок b той же длинной строки (без перевода строки).
+        """
+        joined = {**a, "text": a["text"] + b["text"], "_last_chunk": b["_last_chunk"]}
+        return ContextBuilder._combine(joined, a, b)
+
+    @staticmethod
+    def _combine(joined: Dict[str, Any], a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+        joined["_rank"] = min(a["_rank"], b["_rank"])
+        scores = [s for s in (a.get("score"), b.get("score")) if s is not None]
+        joined["score"] = max(scores) if scores else None
+        return joined
+
+    def _dedup(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        kept: List[Dict[str, Any]] = []
+        seen_hashes: Set[str] = set()
+        kept_shingles: List[Set[str]] = []
+        for doc in docs:
+            normalized = " ".join(doc["text"].split())
+            digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+            if digest in seen_hashes:
+                continue
+            shingles = _shingles(normalized)
+            if self.dedup_threshold < 1.0 and any(
+                len(shingles & other) / max(1, len(shingles | other)) >= self.dedup_threshold
+                for other in kept_shingles
+            ):
+                continue
+            seen_hashes.add(digest)
+            kept_shingles.append(shingles)
+            kept.append(doc)
+        return kept
+
+    def _fit_budget(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        result: List[Dict[str, Any]] = []
+        remaining = self.max_tokens
+        for doc in docs:
+            cost = count_tokens(doc["text"], self.encoding)
+            if cost <= remaining:
+                result.append(doc)
+                remaining -= cost
+                continue
+            truncated = self._truncate(doc, remaining)
+            if truncated is not None:
+                result.append(truncated)
+                remaining -= count_tokens(truncated["text"], self.encoding)
+        return result
+
+    def _truncate(self, doc: Dict[str, Any], budget: int) -> Optional[Dict[str, Any]]:
+        """
+        Оставляет начало документа (целыми строками), помещающееся в budget.
+        """
+        if budget < MIN_TRUNCATED_TOKENS:
+            return None
+        lines = doc["text"].splitlines(keepends=True)
+        kept: List[str] = []
+        used = 0
+        for line in lines:
+            cost = count_tokens(line, self.encoding)
+            if used + cost > budget:
+                break
+            kept.append(line)
+            used += cost
+        if not kept:
+            return None
+        truncated = {**doc, "text": "".join(kept)}
+        if _has_exact_lines(doc):
+            truncated["end_line"] = doc["start_line"] + len(kept) - 1
+        return truncated
+
+
+def context_builder_from_config(app_cfg: Dict[str, Any]) -> ContextBuilder:
+    """
+    Создаёт ContextBuilder по секции `context` в config.yaml.
+    """
+    ctx_cfg = app_cfg.get("context") or {}
+    return ContextBuilder(
+        max_tokens=ctx_cfg.get("max_tokens", DEFAULT_MAX_TOKENS),
+        dedup_threshold=ctx_cfg.get("dedup_threshold", DEFAULT_DEDUP_THRESHOLD),
+        encoding=ctx_cfg.get("encoding", DEFAULT_ENCODING),
+    )
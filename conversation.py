@@ -0,0 +1,172 @@
+import json
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from context_builder import DEFAULT_MAX_TOKENS
+from query_cache import TTLCache
+from tokens import DEFAULT_ENCODING, count_tokens
+
+
+def user_turns(messages: List[Dict[str, Any]]) -> List[str]:
+    """
+    Текстовые сообщения пользователя по порядку.
+    """
+    return [
+        m["content"]
+        for m in messages
+        if m.get("role") == "user" and isinstance(m.get("content"), str) and m["content"]
+    ]
+
+
+def _doc_key(doc: Dict[str, Any]) -> Tuple[Any, ...]:
+    if doc.get("id") is not None:
+        return (doc["path"], doc["id"])
+    return (
+        doc["path"],
+        doc.get("start_line"),
+        hashlib.sha1(doc["text"].encode("utf-8")).hexdigest(),
+    )
+
+
+class ConversationContext:
+    """
+    Поиск с учётом разговора:
+
+    - документы, найденные на прошлых ходах, хранятся в коротко живущем кэше
+      по хэшу префикса разговора (реплик пользователя до текущей) и снова
+      попадают в контекст, а поиск выполняется один раз — для нового хода и
+      только по текущей реплике (тема разговора уже есть в перенесённых
+      документах, а одинаковые реплики попадают в кэш результатов поиска);
+    - если перенесённых документов нет (первый ход или запись истекла), запрос
+      строится из последних query_turns реплик пользователя (текущая — последней),
+      чтобы уточнения вида "а в другом модуле?" искались вместе с темой разговора.
+
+    Документы прошлых ходов идут в контексте первыми и в прежнем порядке, поэтому
+    начало промпта от хода к ходу не меняется и KV-кэш префиксов LLM-сервера
+    срабатывает. Переносится не больше carry_tokens токенов документов, и
+    не больше, чем остаётся в бюджете контекста (context_tokens) после
+    документов нового хода: при переполнении отбрасываются документы самых
+    старых ходов.
+
+    Не потокобезопасен: рассчитан на использование из одного event loop.
+    """
+
+    def __init__(
+        self,
+        query_turns: int = 3,
+        max_query_chars: int = 2000,
+        carry_tokens: int = 3000,
+        ttl: float = 600.0,
+        max_conversations: int = 1000,
+        encoding: str = DEFAULT_ENCODING,
+        context_tokens: int = DEFAULT_MAX_TOKENS,
+    ) -> None:
+        self.query_turns = max(1, int(query_turns))
+        self.max_query_chars = max(1, int(max_query_chars))
+        self.carry_tokens = max(0, int(carry_tokens))
+        self.context_tokens = max(0, int(context_tokens))
+        self.encoding = encoding
+        self._cache = TTLCache(maxsize=max_conversations, ttl=ttl)
+
+    @staticmethod
+    def _key(turns: List[str], route: str) -> str:
+        data = json.dumps([route, turns], ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def search_query(self, turns: List[str], prior: List[Dict[str, Any]]) -> str:
+        """
+        Запрос для поиска: текущая реплика, если есть документы прошлых ходов
+        (prior), иначе последние реплики пользователя через перевод строки.
+        Если он длиннее max_query_chars, обрезается начало (старые реплики).
+        """
+        query = turns[-1] if prior else "\n".join(turns[-self.query_turns :])
+        return query[-self.max_query_chars :]
+
+    def prior_documents(self, turns: List[str], route: str) -> List[Dict[str, Any]]:
+        """
+        Документы прошлых ходов разговора (turns — все реплики пользователя,
+        включая текущую); пустой список, если разговор новый или запись истекла.
+        """
+        if len(turns) < 2:
+            return []
+        return list(self._cache.get(self._key(turns[:-1], route)) or [])
+
+    def merge(
+        self, prior: List[Dict[str, Any]], documents: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Документы прошлых ходов, затем новые документы, которых среди них нет.
+        Бюджет контекста сначала отдаётся новым документам: из документов
+        прошлых ходов остаются самые новые, помещающиеся в остаток.
+        """
+        found = {_doc_key(doc) for doc in documents if doc.get("path") is not None}
+        budget = self.context_tokens - sum(
+            count_tokens(doc["text"], self.encoding) for doc in documents
+        )
+        kept: List[Dict[str, Any]] = []
+        for doc in reversed(prior):
+            key = _doc_key(doc)
+            if key not in found:
+                cost = count_tokens(doc["text"], self.encoding)
+                if cost > budget:
+                    break
+                budget -= cost
+            # документ, найденный и на этом ходу, уже учтён в бюджете
+            kept.append(doc)
+        kept.reverse()
+
+        seen = {_doc_key(doc) for doc in kept}
+        merged = kept
+        for doc in documents:
+            if doc.get("path") is None:
+                merged.append(doc)
+                continue
+            key = _doc_key(doc)
+            if key not in seen:
+                seen.add(key)
+                merged.append(doc)
+        return merged
+
+    def remember(self, turns: List[str], route: str, documents: List[Dict[str, Any]]) -> None:
+        """
+        Запоминает документы хода для следующего: только документы с путём
+        и не больше carry_tokens токенов (самые новые).
+        """
+        carried: List[Dict[str, Any]] = []
+        budget = self.carry_tokens
+        for doc in reversed([d for d in documents if d.get("path") is not None]):
+            cost = count_tokens(doc["text"], self.encoding)
+            if cost > budget:
+                break
+            carried.append(doc)
+            budget -= cost
+        carried.reverse()
+        self._cache.set(self._key(turns, route), carried)
+
+
+def conversation_from_config(config: Dict[str, Any]) -> Optional[ConversationContext]:
+    """
+    ConversationContext по секции conversation конфига (None, если режим выключен):
+
+      enabled: false
+      query_turns: 3
+      max_query_chars: 2000
+      carry_tokens: 3000     — по умолчанию половина context.max_tokens
+      ttl: 600
+      max_conversations: 1000
+    """
+    conv_cfg = config.get("conversation") or {}
+    if not conv_cfg.get("enabled", False):
+        return None
+    context_cfg = config.get("context") or {}
+    return ConversationContext(
+        query_turns=conv_cfg.get("query_turns", 3),
+        max_query_chars=conv_cfg.get("max_query_chars", 2000),
+        carry_tokens=conv_cfg.get(
+            "carry_tokens", int(context_cfg.get("max_tokens", DEFAULT_MAX_TOKENS)) // 2
+        ),
+        ttl=conv_cfg.get("ttl", 600.0),
+        max_conversations=conv_cfg.get("max_conversations", 1000),
+        encoding=context_cfg.get("encoding", DEFAULT_ENCODING),
+        context_tokens=context_cfg.get("max_tokens", DEFAULT_MAX_TOKENS),
+    )
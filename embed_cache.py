@@ -0,0 +1,163 @@
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# сколько записей в кэше по умолчанию (≈ 4 КБ на вектор размерности 1000)
+DEFAULT_MAX_ENTRIES = 200_000
+
+# при переполнении удаляем чуть больше, чем нужно, чтобы не чистить на каждой вставке
+EVICT_SLACK = 0.05
+
+# ограничение SQLite на число параметров в одном запросе
+_SQL_BATCH = 500
+
+
+def cache_key(model: str, text: str) -> bytes:
+    """
+    Ключ кэша: sha256 от имени модели и текста.
+    """
+    h = hashlib.sha256()
+    h.update(model.encode("utf-8"))
+    h.update(b"\0")
+    h.update(text.encode("utf-8"))
+    return h.digest()
+
+
+class EmbeddingCache:
+    """
+    Персистентный кэш эмбеддингов на SQLite.
+
+    Ключ — (модель эмбеддингов, sha256 текста), значение — вектор float32.
+    Кэш общий для index_repo.py и server.py: оба процесса открывают один файл
+    в режиме WAL. Размер ограничен max_entries, при переполнении удаляются
+    записи, которые дольше всего не использовались (LRU по времени обращения).
+    """
+
+    def __init__(self, path: str | Path, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        self.path = Path(path)
+        self.max_entries = max(1, int(max_entries))
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.path),
+            timeout=30.0,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key BLOB PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)"
+        )
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """
+        Возвращает векторы (float32) в порядке texts; None — промах.
+        """
+        keys = [cache_key(model, t) for t in texts]
+        found: Dict[bytes, np.ndarray] = {}
+        now = time.time()
+
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            for i in range(0, len(unique), _SQL_BATCH):
+                part = unique[i : i + _SQL_BATCH]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({marks})",
+                    part,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+
+            result = [found.get(key) for key in keys]
+            hits = sum(1 for v in result if v is not None)
+            self.hits += hits
+            self.misses += len(result) - hits
+
+        return result
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        now = time.time()
+        rows = [
+            (cache_key(model, t), np.asarray(v, dtype=np.float32).tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        if not rows:
+            return
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    rows,
+                )
+                self._count += self._conn.total_changes - before
+                if self._count > self.max_entries:
+                    self._evict()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self) -> None:
+        # вызывается под self._lock внутри транзакции
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._count - int(self.max_entries * (1 - EVICT_SLACK))
+        if excess <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            " SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self._count -= excess
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_cache(emb_cfg: Dict[str, Any]) -> Optional[EmbeddingCache]:
+    """
+    Создаёт кэш по секции embedding.cache конфига; None, если кэш не настроен
+    или выключен (enabled: false).
+    """
+    cache_cfg = emb_cfg.get("cache") or {}
+    if not cache_cfg or not cache_cfg.get("enabled", True):
+        return None
+    return EmbeddingCache(
+        path=cache_cfg.get("path", ".embedding_cache.sqlite"),
+        max_entries=cache_cfg.get("max_entries", DEFAULT_MAX_ENTRIES),
+    )
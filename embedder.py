@@ -1,30 +1,399 @@
+import re
+import time
+import base64
+import random
+import asyncio
+import threading
+
 import httpx
+import numpy as np
+
+import metrics
+from admission import get_limit, pool_limits
 from models_loader import load_app_config
+from embed_cache import open_cache
+from metrics import span
+from tokens import CHARS_PER_TOKEN
 
 _cfg = load_app_config()
 _emb_cfg = _cfg["embedding"]
 
+_headers = {"Authorization": f"Bearer {_emb_cfg['api_key']}"} if _emb_cfg["api_key"] else {}
+
+# таймаут одного запроса к сервису эмбеддингов, секунды
+REQUEST_TIMEOUT = float(_emb_cfg.get("timeout", 300.0))
+
 _client = httpx.Client(
     base_url=_emb_cfg["api_base"],
-    headers={"Authorization": f"Bearer {_emb_cfg['api_key']}"} if _emb_cfg["api_key"] else {},
-    timeout=300.0,  # 5 минут
+    headers=_headers,
+    timeout=REQUEST_TIMEOUT,
+    limits=pool_limits("embedding"),
     trust_env=False,   # <─ не читать HTTP(S)_PROXY, NO_PROXY и т.п.
 )
 
+# асинхронный клиент для сервера: не блокирует event loop во время запроса
+_async_client = httpx.AsyncClient(
+    base_url=_emb_cfg["api_base"],
+    headers=_headers,
+    timeout=REQUEST_TIMEOUT,
+    limits=pool_limits("embedding"),
+    trust_env=False,
+)
+
+# одновременные запросы сервера к сервису эмбеддингов (секция admission.embedding)
+_async_limit = get_limit("embedding")
+
+# повторы при временных ошибках (сеть, таймаут, 429, 5xx): экспоненциальная
+# задержка retry_backoff * 2^попытка со случайным разбросом, не больше retry_backoff_max
+MAX_RETRIES = int(_emb_cfg.get("max_retries", 5))
+RETRY_BACKOFF = float(_emb_cfg.get("retry_backoff", 0.5))
+RETRY_BACKOFF_MAX = float(_emb_cfg.get("retry_backoff_max", 30.0))
+
+# коды ответа, после которых запрос стоит повторить
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# ответ 400 с таким текстом — батч длиннее, чем модель принимает за раз
+_TOO_LARGE_RE = re.compile(
+    r"context.length|too (?:long|large)|maximum.{0,40}tokens|too many tokens|exceeds", re.I
+)
+
 EMBEDDING_MODEL = _emb_cfg["model"]
 
+# float — векторы приходят списками чисел в JSON; base64 — little-endian float32
+# в base64 (в несколько раз меньше трафика, без разбора чисел из JSON)
+ENCODING_FORMAT = _emb_cfg.get("encoding_format", "float")
+
+# персистентный кэш эмбеддингов (None, если не настроен в config.yaml)
+embedding_cache = open_cache(_emb_cfg)
 
-def get_embeddings(texts):
+
+def _request_body(texts):
+    body = {"model": EMBEDDING_MODEL, "input": texts}
+    if ENCODING_FORMAT != "float":
+        body["encoding_format"] = ENCODING_FORMAT
+    return body
+
+
+def _decode_embedding(value):
+    if isinstance(value, str):
+        return np.frombuffer(base64.b64decode(value), dtype="<f4")
+    # сервис мог проигнорировать encoding_format и вернуть список чисел
+    return np.asarray(value, dtype=np.float32)
+
+
+def _parse_embeddings(data, expected):
+    # ожидается формат openai embeddings; результат — матрица float32 (n, dim)
+    items = sorted(data["data"], key=lambda item: item.get("index", 0))
+    if len(items) != expected:
+        raise ValueError(
+            f"embedding service returned {len(items)} vectors for {expected} texts"
+        )
+    return np.stack([_decode_embedding(item["embedding"]) for item in items]).astype(
+        np.float32, copy=False
+    )
+
+
+class BatchTooLargeError(Exception):
     """
-    texts: list[str]
-    return: list[list[float]]
+    Сервис отклонил батч как слишком большой (413 или превышение контекста).
+    """
+
+
+class AdaptiveBatchLimit:
     """
-    resp = _client.post(
-        "/v1/embeddings",
-        json={"model": EMBEDDING_MODEL, "input": texts},
+    Размер батча эмбеддингов в токенах, подстраиваемый по принципу AIMD:
+
+    - быстрый успешный запрос почти полного батча увеличивает лимит на step_tokens;
+    - запрос дольше target_latency уменьшает лимит в 1.5 раза;
+    - ошибка (таймаут, 429, 5xx) уменьшает лимит вдвое;
+    - отказ "слишком большой батч" — вдвое от размера отклонённого батча.
+
+    Так индексатор нагружает сервис эмбеддингов почти до предела, но отступает,
+    как только тот начинает не справляться. Потокобезопасен.
+    """
+
+    def __init__(
+        self,
+        initial_tokens: int = 4096,
+        min_tokens: int = 256,
+        max_tokens: int = 65536,
+        max_items: int = 256,
+        target_latency: float = 5.0,
+        step_tokens: int = 512,
+    ) -> None:
+        self.min_tokens = max(1, int(min_tokens))
+        self.max_tokens = max(self.min_tokens, int(max_tokens))
+        self.max_items = max(1, int(max_items))
+        self.target_latency = float(target_latency)
+        self.step_tokens = max(1, int(step_tokens))
+        self._tokens = float(min(self.max_tokens, max(self.min_tokens, int(initial_tokens))))
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self) -> int:
+        return int(self._tokens)
+
+    def _set(self, value: float) -> None:
+        self._tokens = min(float(self.max_tokens), max(float(self.min_tokens), value))
+
+    def on_success(self, tokens: int, latency: float) -> None:
+        with self._lock:
+            if latency > self.target_latency:
+                self._set(self._tokens / 1.5)
+            elif tokens >= self._tokens / 2:
+                # маленькие батчи (хвосты файлов) ничего не говорят о пределе сервиса
+                self._set(self._tokens + self.step_tokens)
+
+    def on_error(self) -> None:
+        with self._lock:
+            self._set(self._tokens / 2)
+
+    def on_too_large(self, tokens: int) -> None:
+        with self._lock:
+            self._set(min(self._tokens, tokens) / 2)
+
+
+def batch_limit_from_config(emb_cfg):
+    """
+    AdaptiveBatchLimit по секции embedding.batch конфига.
+    """
+    batch_cfg = emb_cfg.get("batch") or {}
+    return AdaptiveBatchLimit(
+        initial_tokens=batch_cfg.get("initial_tokens", 4096),
+        min_tokens=batch_cfg.get("min_tokens", 256),
+        max_tokens=batch_cfg.get("max_tokens", 65536),
+        max_items=batch_cfg.get("max_items", 256),
+        target_latency=batch_cfg.get("target_latency", 5.0),
+        step_tokens=batch_cfg.get("step_tokens", 512),
     )
+
+
+class EmbeddingStats:
+    """
+    Счётчики запросов к сервису эмбеддингов (для отчёта индексатора).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.texts = 0
+        self.tokens = 0
+        self.retries = 0
+        self.splits = 0
+        self.seconds = 0.0
+
+    def add(self, **values) -> None:
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "texts": self.texts,
+                "tokens": self.tokens,
+                "retries": self.retries,
+                "splits": self.splits,
+                "seconds": self.seconds,
+            }
+
+
+# текущий размер батча индексатора и статистика запросов этого процесса
+batch_limit = batch_limit_from_config(_emb_cfg)
+embedding_stats = EmbeddingStats()
+
+
+def estimate_tokens(texts):
+    return sum((len(t) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN for t in texts)
+
+
+def _retry_delay(attempt, retry_after=None):
+    """
+    Экспоненциальная задержка с полным случайным разбросом (full jitter);
+    Retry-After сервиса соблюдается, но не дольше RETRY_BACKOFF_MAX.
+    """
+    delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))
+    if retry_after:
+        try:
+            delay = max(delay, min(RETRY_BACKOFF_MAX, float(retry_after)))
+        except ValueError:
+            pass
+    return delay
+
+
+def _check_response(resp, n_texts):
+    """
+    Разбирает ответ сервиса: матрица векторов, BatchTooLargeError для
+    слишком большого батча, None — если запрос стоит повторить.
+    """
+    if resp.status_code == 413 or (resp.status_code == 400 and _TOO_LARGE_RE.search(resp.text)):
+        raise BatchTooLargeError(
+            f"embedding service rejected a batch of {n_texts} texts: {resp.status_code}"
+        )
+    if resp.status_code in RETRY_STATUSES:
+        return None
     resp.raise_for_status()
-    data = resp.json()
-    # ожидается формат openai embeddings
-    embs = [item["embedding"] for item in data["data"]]
-    return embs
+    return _parse_embeddings(resp.json(), n_texts)
+
+
+def _status_error(resp):
+    return httpx.HTTPStatusError(
+        f"embedding service returned {resp.status_code}", request=resp.request, response=resp
+    )
+
+
+def _on_retry(attempt, error):
+    if attempt >= MAX_RETRIES:
+        raise error
+    batch_limit.on_error()
+    embedding_stats.add(retries=1)
+    metrics.EMBEDDING_RETRIES.inc()
+
+
+def _post_embeddings(texts):
+    """
+    POST /v1/embeddings с повторами при временных ошибках.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        retry_after = None
+        try:
+            resp = _client.post("/v1/embeddings", json=_request_body(texts))
+            result = _check_response(resp, len(texts))
+            if result is not None:
+                return result
+            retry_after = resp.headers.get("Retry-After")
+            error = _status_error(resp)
+        except httpx.TransportError as e:
+            error = e
+        _on_retry(attempt, error)
+        time.sleep(_retry_delay(attempt, retry_after))
+
+
+async def _apost_embeddings(texts):
+    for attempt in range(MAX_RETRIES + 1):
+        retry_after = None
+        try:
+            # слот занимается на одну попытку, а не на время паузы между повторами
+            async with _async_limit:
+                resp = await _async_client.post("/v1/embeddings", json=_request_body(texts))
+            result = _check_response(resp, len(texts))
+            if result is not None:
+                return result
+            retry_after = resp.headers.get("Retry-After")
+            error = _status_error(resp)
+        except httpx.TransportError as e:
+            error = e
+        _on_retry(attempt, error)
+        await asyncio.sleep(_retry_delay(attempt, retry_after))
+
+
+def _split_too_large(texts, e):
+    """
+    Батч отклонён как слишком большой: уменьшаем лимит и делим батч пополам.
+    Один текст делить некуда — ошибка пробрасывается.
+    """
+    if len(texts) == 1:
+        raise e
+    batch_limit.on_too_large(estimate_tokens(texts))
+    embedding_stats.add(splits=1)
+    metrics.EMBEDDING_SPLITS.inc()
+    mid = len(texts) // 2
+    return texts[:mid], texts[mid:]
+
+
+def _fetch(texts):
+    try:
+        return _post_embeddings(texts)
+    except BatchTooLargeError as e:
+        left, right = _split_too_large(texts, e)
+        return np.concatenate([_fetch(left), _fetch(right)])
+
+
+async def _afetch(texts):
+    try:
+        return await _apost_embeddings(texts)
+    except BatchTooLargeError as e:
+        left, right = _split_too_large(texts, e)
+        return np.concatenate([await _afetch(left), await _afetch(right)])
+
+
+def _record(texts, tokens, started):
+    elapsed = time.perf_counter() - started
+    tokens = tokens if tokens is not None else estimate_tokens(texts)
+    embedding_stats.add(requests=1, texts=len(texts), tokens=tokens, seconds=elapsed)
+    metrics.EMBEDDING_TEXTS.inc(len(texts))
+    metrics.EMBEDDING_TOKENS.inc(tokens)
+    batch_limit.on_success(tokens, elapsed)
+
+
+def _lookup_cache(texts):
+    """
+    Возвращает (векторы из кэша или None, уникальные тексты-промахи).
+    """
+    if embedding_cache is None:
+        return [None] * len(texts), list(dict.fromkeys(texts))
+    cached = embedding_cache.get_many(EMBEDDING_MODEL, texts)
+    misses = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+    return cached, misses
+
+
+def _merge_results(texts, cached, misses, fetched):
+    """
+    Сохраняет новые векторы в кэш и собирает результат в порядке texts
+    в одну непрерывную матрицу float32 (n, dim).
+    """
+    if embedding_cache is not None and misses:
+        embedding_cache.put_many(EMBEDDING_MODEL, misses, fetched)
+    if not misses:
+        return np.stack(cached) if cached else np.empty((0, 0), dtype=np.float32)
+    row_of = {t: i for i, t in enumerate(misses)}
+    result = np.empty((len(texts), fetched.shape[1]), dtype=np.float32)
+    for i, (t, v) in enumerate(zip(texts, cached)):
+        result[i] = v if v is not None else fetched[row_of[t]]
+    return result
+
+
+def get_embeddings(texts, tokens=None):
+    """
+    texts: list[str]
+    tokens: число токенов в texts, если известно (для подстройки batch_limit)
+    return: np.ndarray float32 формы (len(texts), dim)
+
+    В сервис эмбеддингов уходят только тексты, которых нет в кэше
+    (одинаковые тексты внутри батча отправляются один раз). Временные ошибки
+    повторяются с экспоненциальной задержкой, слишком большой батч делится
+    пополам.
+    """
+    with span("embedding"):
+        cached, misses = _lookup_cache(texts)
+        fetched = None
+        if misses:
+            started = time.perf_counter()
+            fetched = _fetch(misses)
+            _record(misses, tokens if len(misses) == len(texts) else None, started)
+        return _merge_results(texts, cached, misses, fetched)
+
+
+async def aget_embeddings(texts):
+    """
+    Асинхронный вариант get_embeddings для использования внутри event loop.
+
+    texts: list[str]
+    return: np.ndarray float32 формы (len(texts), dim)
+    """
+    with span("embedding"):
+        # чтение и запись кэша SQLite — блокирующий ввод-вывод, его выполняем
+        # в пуле потоков, чтобы не останавливать event loop
+        if embedding_cache is None:
+            cached, misses = _lookup_cache(texts)
+        else:
+            cached, misses = await asyncio.to_thread(_lookup_cache, texts)
+        fetched = None
+        if misses:
+            started = time.perf_counter()
+            fetched = await _afetch(misses)
+            _record(misses, None, started)
+        if embedding_cache is None:
+            return _merge_results(texts, cached, misses, fetched)
+        return await asyncio.to_thread(_merge_results, texts, cached, misses, fetched)
@@ -1,208 +1,1280 @@
 import os
-from typing import List, Set
+import json
+import uuid
+import time
+import queue
+import stat
+import shutil
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from pathlib import Path
 
-from qdrant_client import QdrantClient
-from qdrant_client.http import models as qmodels
+import numpy as np
 
-from embedder import get_embeddings
+import metrics
+from chunker import Chunk, Chunker, chunker_from_config
+from embedder import batch_limit, embedding_cache, embedding_stats, get_embeddings
+from lexical_index import (
+    build_lexical_index,
+    collection_index_dir,
+    indexed_docs,
+    update_lexical_index,
+)
 from models_loader import load_app_config
+from scanner import (
+    DEFAULT_SCAN_WORKERS,
+    GitChanges,
+    GitScanError,
+    IgnoreRules,
+    TreeScanner,
+    git_changes,
+    is_hidden,
+)
+from vector_store import VectorStore, vector_store_from_config
+from watcher import DEFAULT_DEBOUNCE, DEFAULT_POLL_INTERVAL, watch_changes
 
 _cfg = load_app_config()
 _agents_cfg = {a["name"]: a for a in _cfg.get("agents", [])}
 _repo_agent_cfg = _agents_cfg.get("RepoSearchAgent", {}).get("config", {})
 
-QDRANT_URL = _repo_agent_cfg.get("qdrant_url", "http://127.0.0.1:6333")
 COLLECTION_NAME = _repo_agent_cfg.get("collection_name", "repo_chunks")
 
-# простое разбиение на chunk'и по символам
-CHUNK_SIZE = 1500
-CHUNK_OVERLAP = 200
+# локальный BM25-индекс по чанкам для гибридного поиска в RepoSearchAgent
+LEXICAL_INDEX_PATH = _repo_agent_cfg.get("lexical_index_path", ".lexical_index")
+
+# разбиение на чанки по токенам с учётом структуры файла (секция chunking в config.yaml)
+CHUNKER = chunker_from_config(_cfg)
+
+# чанк в компактном виде для передачи из процесса-воркера: текст, строки начала и конца, токены
+ChunkRecord = Tuple[str, int, int, int]
 
 ALLOWED_EXT = {".pp", ".yaml", ".yml", ".erb", ".epp", ".md", ".txt"}
 
-# размер батча для запросов к сервису эмбеддингов
-EMBEDDING_BATCH_SIZE = 16
+# лексический индекс обновляется дельтой (только изменённые файлы), пока в ней
+# не больше max(LEXICAL_DELTA_MIN_DOCS, LEXICAL_DELTA_MAX_RATIO * документов индекса)
+# чанков; иначе — полная пересборка по всей коллекции
+LEXICAL_DELTA_MIN_DOCS = 500
+LEXICAL_DELTA_MAX_RATIO = 0.1
+
+# сколько точек копим перед upsert в хранилище векторов
+UPSERT_BATCH_SIZE = 500
+
+# upsert выполняется и раньше, если тексты в буфере заняли столько байт
+UPSERT_MAX_BYTES = 32 * 1024 * 1024
+
+# ограничения на файлы (секция indexing в config.yaml): слишком большие,
+# бинарные и минифицированные файлы не индексируются
+_index_cfg = _cfg.get("indexing") or {}
+MAX_FILE_SIZE = int(_index_cfg.get("max_file_size", 20 * 1024 * 1024))
+MAX_AVG_LINE_LENGTH = int(_index_cfg.get("max_avg_line_length", 500))
+
+# файлы читаются блоками такого размера (для sha256 и проверки на бинарность)
+READ_BLOCK_SIZE = 1024 * 1024
+
+# ограничение частоты запросов к сервису эмбеддингов (запросов в секунду, None — без ограничения)
+MAX_EMBEDDING_RPS = _index_cfg.get("max_embedding_rps")
+
+# в режиме --watch изменения обрабатываются порциями не больше стольких файлов
+WATCH_MAX_BATCH_FILES = 1000
 
-# файл, в который пишем успешно проиндексированные файлы
+# число параллельных воркеров эмбеддингов и ёмкость очередей между стадиями
+DEFAULT_WORKERS = 4
+DEFAULT_INFLIGHT = 8
+
+# число процессов, режущих файлы на чанки (0 — чанки режет поток конвейера)
+DEFAULT_PROCESSES = int(_index_cfg.get("processes", 0))
+
+# сколько файлов на процесс отдаётся в разбиение наперёд
+PROCESS_PREFETCH = 4
+
+# манифест проиндексированных файлов: путь -> mtime, размер, sha256, число чанков
+# (для коллекции, отличной от COLLECTION_NAME, — .index_manifest.<коллекция>.jsonl)
+MANIFEST_FILENAME = ".index_manifest.jsonl"
+
+# старый лог проиндексированных файлов (до появления манифеста)
 INDEXED_LOG_FILENAME = ".indexed_files.log"
 
+# сколько путей удаляем из хранилища одним запросом
+DELETE_BATCH_SIZE = 256
 
-def iter_files(repo_path: Path) -> List[Path]:
-    for root, dirs, files in os.walk(repo_path):
-        # не заходить в директории, имя которых начинается с точкой
-        dirs[:] = [d for d in dirs if not d.startswith(".")]
+# пространство имён для детерминированных id точек
+POINT_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "dirtorag/repo_chunks")
 
-        for fname in files:
-            # при этом сами файлы, начинающиеся с точки, мы тоже не индексируем
-            if fname.startswith("."):
-                continue
-            p = Path(root) / fname
-            if p.suffix.lower() in ALLOWED_EXT:
-                yield p
-
-
-def chunk_text(text: str):
-    chunks = []
-    start = 0
-    n = len(text)
-    while start < n:
-        end = min(start + CHUNK_SIZE, n)
-        chunk = text[start:end]
-        chunks.append(chunk)
-        if end == n:
-            break
-        start = end - CHUNK_OVERLAP
-    return chunks
-
-
-def load_indexed_files(log_path: Path) -> Set[str]:
-    """
-    Читает лог уже проиндексированных файлов.
-    Возвращает множество относительных путей (строки).
-    """
-    if not log_path.exists():
-        return set()
-    indexed: Set[str] = set()
-    with log_path.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            indexed.add(line)
-    return indexed
 
+def manifest_filename(collection: str) -> str:
+    """
+    Имя файла манифеста: у каждой коллекции свой, чтобы один каталог можно
+    было индексировать в несколько коллекций.
+    """
+    if collection == COLLECTION_NAME:
+        return MANIFEST_FILENAME
+    return f".index_manifest.{collection}.jsonl"
 
-def append_indexed_file(log_path: Path, rel_path: str) -> None:
+
+def iter_files(repo_path: Path) -> Iterator[Path]:
+    # скрытые каталоги и файлы (с точки в начале имени) не индексируем
+    for scanned in TreeScanner(repo_path, ALLOWED_EXT).scan():
+        yield scanned.path
+
+
+def is_indexable(rel_path: str) -> bool:
+    return Path(rel_path).suffix.lower() in ALLOWED_EXT and not is_hidden(rel_path)
+
+
+def sniff_file(fpath: Path, st: os.stat_result) -> Tuple[Optional[str], Optional[str]]:
     """
-    Добавляет один относительный путь файла в лог.
+    Потоково (блоками READ_BLOCK_SIZE) проверяет файл и считает его sha256.
+    Возвращает (sha256, None) или (None, причина пропуска).
     """
-    with log_path.open("a", encoding="utf-8") as f:
-        f.write(rel_path + "\n")
+    if st.st_size > MAX_FILE_SIZE:
+        return None, "too large"
 
+    h = hashlib.sha256()
+    with fpath.open("rb") as f:
+        head = f.read(READ_BLOCK_SIZE)
+        if b"\0" in head:
+            return None, "binary"
+        # минифицированный или сгенерированный файл: очень длинные строки
+        if len(head) / (head.count(b"\n") + 1) > MAX_AVG_LINE_LENGTH:
+            return None, "minified"
+        h.update(head)
+        for block in iter(lambda: f.read(READ_BLOCK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest(), None
 
-def main():
-    import argparse
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("repo_path", help="Path to local git repo")
-    args = parser.parse_args()
+def iter_file_chunks(fpath: Path, suffix: str, chunker: Chunker) -> Iterator[Chunk]:
+    """
+    Потоково читает файл и режет его на чанки (файл открывается при первом next).
+    """
+    # newline=None: \r\n и \r читаются как \n
+    with fpath.open("r", encoding="utf-8", errors="ignore", newline=None) as f:
+        yield from chunker.chunk_lines(f, suffix)
 
-    repo_path = Path(args.repo_path).resolve()
-    log_path = repo_path / INDEXED_LOG_FILENAME
 
-    # загружаем список уже проиндексированных файлов
-    indexed_files_set = load_indexed_files(log_path)
+# Chunker процесса-воркера (передаётся инициализатором пула)
+_process_chunker: Optional[Chunker] = None
 
-    # Используем тот же режим, что и в rag_proxy.py: HTTP, без gRPC
-    client = QdrantClient(
-        url=QDRANT_URL,
-        prefer_grpc=False,
-    )
 
-    # создаём коллекцию, если нет
-    existing_collections = [c.name for c in client.get_collections().collections]
-    if COLLECTION_NAME not in existing_collections:
-        # размер вектора возьмём после первого вызова get_embeddings
-        # поэтому сначала получим фиктивный embedding
-        dim = len(get_embeddings(["test"])[0])
-        client.recreate_collection(
-            collection_name=COLLECTION_NAME,
-            vectors_config=qmodels.VectorParams(
-                size=dim,
-                distance=qmodels.Distance.COSINE,
-            ),
+def _init_chunk_process(chunker: Chunker) -> None:
+    global _process_chunker
+    _process_chunker = chunker
+
+
+def chunk_file_records(fpath: str, suffix: str) -> List[ChunkRecord]:
+    """
+    Разбиение файла в процессе-воркере: чанки возвращаются кортежами,
+    которые дёшево передавать между процессами.
+    """
+    return [
+        (chunk.text, chunk.start_line, chunk.end_line, chunk.tokens)
+        for chunk in iter_file_chunks(Path(fpath), suffix, _process_chunker)
+    ]
+
+
+def point_id(rel_path: str, chunk_index: int) -> str:
+    """
+    Детерминированный id точки: UUID от пути файла и номера чанка.
+    Повторная индексация того же файла перезаписывает те же точки.
+    """
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{rel_path}#{chunk_index}"))
+
+
+class IndexManifest:
+    """
+    Манифест проиндексированных файлов.
+
+    Хранится как append-only JSONL: каждая строка — запись о файле
+    (`path`, `mtime_ns`, `size`, `sha256`, `chunks`, `chunker`) или пометка
+    об удалении (`path`, `deleted: true`). При чтении побеждает последняя запись,
+    поэтому прерванный запуск не теряет уже записанный прогресс. В конце запуска
+    файл переписывается компактно (compact).
+
+    Записи, сделанные с другими параметрами чанкера (signature), считаются
+    устаревшими: такие файлы индексируются заново.
+
+    Строки вида `{"meta": {...}}` хранят сведения о запуске в целом
+    (например, последний проиндексированный коммит для режима --git).
+    """
+
+    def __init__(self, path: Path, signature: str = "") -> None:
+        self.path = path
+        self.signature = signature
+        self._lock = threading.Lock()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.meta: Dict[str, Any] = {}
+
+        if path.exists():
+            with path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # недописанная строка после аварийного завершения
+                        continue
+                    if "meta" in rec:
+                        self.meta.update(rec["meta"])
+                    elif rec.get("deleted"):
+                        self.entries.pop(rec["path"], None)
+                    else:
+                        self.entries[rec["path"]] = rec
+
+    def get(self, rel_path: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get(rel_path)
+
+    def is_unchanged(self, rel_path: str, st: os.stat_result) -> bool:
+        """
+        Быстрая проверка по mtime и размеру, без чтения файла.
+        """
+        entry = self.entries.get(rel_path)
+        return (
+            entry is not None
+            and entry.get("chunker") == self.signature
+            and entry.get("mtime_ns") == st.st_mtime_ns
+            and entry.get("size") == st.st_size
         )
 
-    # сначала посчитаем общее количество файлов для индексации
-    all_files = list(iter_files(repo_path))
-    total_files = len(all_files)
-    if total_files == 0:
-        print("Нет файлов для индексации")
-        return
+    def has_content(self, rel_path: str, sha256: str) -> bool:
+        """
+        Проиндексирован ли файл с таким содержимым текущим чанкером.
+        """
+        entry = self.entries.get(rel_path)
+        return (
+            entry is not None
+            and entry.get("chunker") == self.signature
+            and entry.get("sha256") == sha256
+        )
 
-    points = []
-    point_id = 1
-    indexed_files = 0  # счётчик успешно проиндексированных файлов (в этом запуске)
-    last_progress = -1  # чтобы не спамить одинаковыми значениями
+    def record(self, rel_path: str, entry: Dict[str, Any]) -> None:
+        rec = {"path": rel_path, **entry, "chunker": self.signature}
+        with self._lock:
+            self.entries[rel_path] = rec
+            self._append(rec)
 
-    for fpath in all_files:
-        rel_path = str(fpath.relative_to(repo_path))
+    def remove(self, rel_path: str) -> None:
+        with self._lock:
+            self.entries.pop(rel_path, None)
+            self._append({"path": rel_path, "deleted": True})
 
-        # пропускаем файлы, которые уже были успешно проиндексированы ранее
-        if rel_path in indexed_files_set:
-            continue
+    def set_meta(self, **values: Any) -> None:
+        with self._lock:
+            self.meta.update(values)
+            self._append({"meta": values})
+
+    def reset(self) -> None:
+        """
+        Забывает все файлы и сведения о запусках (коллекция создана заново).
+        """
+        with self._lock:
+            self.entries.clear()
+            self.meta.clear()
+        self.compact()
+
+    def _append(self, rec: Dict[str, Any]) -> None:
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+    def compact(self) -> None:
+        """
+        Переписывает манифест, оставляя по одной записи на файл.
+        """
+        with self._lock:
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with tmp_path.open("w", encoding="utf-8") as f:
+                if self.meta:
+                    f.write(json.dumps({"meta": self.meta}, ensure_ascii=False) + "\n")
+                for rec in self.entries.values():
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+
+
+class RateLimiter:
+    """
+    Ограничение частоты запросов (token bucket), общее для всех потоков:
+    не больше rate запросов в секунду в среднем и не больше burst подряд.
+    """
 
+    def __init__(self, rate: float, burst: Optional[int] = None) -> None:
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1, int(rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# маркер конца потока в очередях конвейера
+_STOP = object()
+
+# батч, готовый к записи: пути файлов, id точек, матрица векторов (n, dim), payload
+Block = Tuple[List[str], List[str], np.ndarray, List[Dict[str, Any]]]
+
+
+class IndexPipeline:
+    """
+    Конвейер индексации из нескольких стадий, связанных ограниченными очередями:
+
+      reader   — потоково считает sha256 файлов и сверяет его с манифестом,
+                 пропуская слишком большие, бинарные и минифицированные файлы;
+      chunker  — читает файл построчно, режет его на чанки и набирает батчи
+                 эмбеддингов по суммарному числу токенов (embedder.batch_limit
+                 подстраивает его под задержки и ошибки сервиса), не разрывая
+                 их на границах файлов; при processes > 0 файлы режут на
+                 чанки процессы-воркеры (ProcessPoolExecutor), а батчи
+                 по-прежнему набираются здесь, в порядке чтения файлов;
+      embedder — `workers` потоков параллельно вызывают get_embeddings;
+      upserter — в фоне пишет точки в хранилище векторов и обновляет манифест.
+
+    Ни текст файла, ни список его чанков целиком в памяти не держатся: чанки
+    уходят в батчи по мере чтения, а память ограничена ёмкостью очередей,
+    размером батчей и буфером upsert (UPSERT_BATCH_SIZE точек / UPSERT_MAX_BYTES).
+    В режиме processes воркер возвращает чанки файла списком, поэтому в памяти
+    одновременно находятся чанки не больше processes * PROCESS_PREFETCH файлов.
+
+    Батчи могут завершаться в произвольном порядке, поэтому для каждого файла
+    считаем, сколько его чанков ещё не записано в хранилище. Файл попадает в манифест
+    (и в прогресс) только когда записаны все его чанки и ни один батч с ним
+    не упал. Для изменённых файлов после записи удаляются устаревшие точки
+    (чанки, которых больше нет).
+    """
+
+    def __init__(
+        self,
+        store: VectorStore,
+        manifest: IndexManifest,
+        total_files: int,
+        workers: int = DEFAULT_WORKERS,
+        inflight: int = DEFAULT_INFLIGHT,
+        upsert_batch_size: int = UPSERT_BATCH_SIZE,
+        rate_limiter: Optional[RateLimiter] = None,
+        collection: str = COLLECTION_NAME,
+        processes: int = DEFAULT_PROCESSES,
+        lexical_limit: int = 0,
+    ) -> None:
+        self.store = store
+        self.collection = collection
+        self.rate_limiter = rate_limiter
+        self.manifest = manifest
+        self.total_files = total_files
+        self.workers = max(1, workers)
+        self.processes = max(0, processes)
+        self.upsert_batch_size = upsert_batch_size
+
+        inflight = max(1, inflight)
+        self._read_q: queue.Queue = queue.Queue(maxsize=inflight)
+        self._embed_q: queue.Queue = queue.Queue(maxsize=inflight)
+        self._upsert_q: queue.Queue = queue.Queue(maxsize=inflight)
+
+        self._lock = threading.Lock()
+        # rel_path -> {"pending": чанков ещё не в хранилище, "entry": запись манифеста,
+        #              "replace": были ли у файла точки раньше,
+        #              "chunked": файл дочитан до конца (entry["chunks"] известно)}
+        self._files: Dict[str, Dict[str, Any]] = {}
+        # файлы, у которых хотя бы один батч не удалось обработать
+        self._failed: Set[str] = set()
+        # батч эмбеддингов, который набирает стадия chunker, и его размер в токенах
+        self._batch: List[Tuple[str, int, Chunk]] = []
+        self._batch_tokens = 0
+
+        self.indexed_files = 0
+        self.unchanged_files = 0
+        self.failed_files = 0
+        # пропущенные файлы (слишком большие, бинарные, минифицированные)
+        self.skipped: List[Tuple[str, str]] = []
+        # записано чанков, время работы конвейера и задержки стадий:
+        # стадия -> [число вызовов, сумма секунд, максимум секунд]
+        self.written_chunks = 0
+        self.elapsed = 0.0
+        self.latency: Dict[str, List[float]] = {"embed": [0, 0.0, 0.0], "upsert": [0, 0.0, 0.0]}
+        # запросы к сервису эмбеддингов за этот прогон (разница EmbeddingStats.snapshot)
+        self.embedding: Dict[str, float] = {}
+        # проиндексированные файлы и их записанные чанки для дельты лексического
+        # индекса: путь -> [(номер чанка, id точки, текст)]; не больше lexical_limit
+        # чанков, при переполнении (или lexical_limit = 0) — None
+        self.indexed_paths: List[str] = []
+        self._lexical_limit = lexical_limit
+        self._lexical_chunks: Optional[Dict[str, List[Tuple[int, str, str]]]] = (
+            {} if lexical_limit > 0 else None
+        )
+        self._lexical_count = 0
+        self._done_files = 0
+        self._last_progress = -1
+        self._upsert_error: Exception | None = None
+        self._reader_error: Exception | None = None
+        self._chunker_error: Exception | None = None
+        # chunker получил _STOP от reader (очередь чтения больше не пополняется)
+        self._read_done = False
+
+    # --- стадии ---
+
+    def _reader(self, files: Iterable[Tuple[Path, str, bool, os.stat_result]]) -> None:
         try:
-            text = fpath.read_text(encoding="utf-8", errors="ignore")
-        except Exception:
-            # не удалось прочитать файл — просто пропускаем
-            continue
+            self._read_files(files)
+        except Exception as e:
+            # остальные стадии дорабатывают то, что уже прочитано; run() поднимет ошибку
+            print(f"Ошибка чтения файлов: {e}")
+            self._reader_error = e
+        finally:
+            self._read_q.put(_STOP)
 
-        chunks = chunk_text(text)
-        if not chunks:
-            # нечего индексировать
-            append_indexed_file(log_path, rel_path)
-            indexed_files += 1
-            continue
+    def _read_files(self, files: Iterable[Tuple[Path, str, bool, os.stat_result]]) -> None:
+        for fpath, rel_path, replace, st in files:
+            try:
+                sha256, skip_reason = sniff_file(fpath, st)
+            except Exception:
+                # файл удалён или недоступен после обхода каталога — пропускаем
+                # его, как слишком большой или бинарный
+                sha256, skip_reason = None, "unreadable"
 
-        # получаем эмбеддинги по батчам
-        all_embs = []
-        for i in range(0, len(chunks), EMBEDDING_BATCH_SIZE):
-            batch_chunks = chunks[i : i + EMBEDDING_BATCH_SIZE]
-            batch_embs = get_embeddings(batch_chunks)
-            # на всякий случай обрежем до минимальной длины
-            min_len = min(len(batch_chunks), len(batch_embs))
-            all_embs.extend(batch_embs[:min_len])
-
-        # если по итогу эмбеддингов меньше, чем чанков, обрежем список чанков
-        if len(all_embs) < len(chunks):
-            chunks = chunks[: len(all_embs)]
-
-        # если вообще не получили эмбеддингов — считаем, что файл не проиндексирован
-        if not all_embs:
-            continue
+            if skip_reason is not None:
+                with self._lock:
+                    self.skipped.append((rel_path, skip_reason))
+                    self._report_progress()
+                continue
 
-        for chunk, emb in zip(chunks, all_embs):
-            meta = {
-                "path": rel_path,
+            entry = {
+                "mtime_ns": st.st_mtime_ns,
+                "size": st.st_size,
+                "sha256": sha256,
             }
-            points.append(
-                qmodels.PointStruct(
-                    id=point_id,
-                    vector=emb,
-                    payload={"text": chunk, **meta},
+            if self.manifest.has_content(rel_path, entry["sha256"]):
+                # изменился только mtime — содержимое то же, эмбеддинги не нужны
+                prev = self.manifest.get(rel_path)
+                self.manifest.record(rel_path, {**entry, "chunks": prev.get("chunks", 0)})
+                with self._lock:
+                    self.unchanged_files += 1
+                    self._report_progress()
+                continue
+
+            self._read_q.put((fpath, rel_path, entry, replace))
+
+    def _read_items(self) -> Iterator[Tuple[Path, str, Dict[str, Any], bool]]:
+        while not self._read_done:
+            item = self._read_q.get()
+            if item is _STOP:
+                self._read_done = True
+                break
+            yield item
+
+    def _chunker(self) -> None:
+        try:
+            if self.processes:
+                self._chunk_in_processes()
+            else:
+                for fpath, rel_path, entry, replace in self._read_items():
+                    chunks = iter_file_chunks(fpath, Path(rel_path).suffix, CHUNKER)
+                    self._batch_file(rel_path, entry, replace, chunks)
+        except Exception as e:
+            # например, не запустился пул процессов; run() поднимет ошибку, а
+            # reader не должен зависнуть на полной очереди — дочитываем её
+            print(f"Ошибка разбиения файлов на чанки: {e}")
+            self._chunker_error = e
+            for _ in self._read_items():
+                pass
+        finally:
+            # уже собранные батчи уходят в эмбеддинг, воркеры всегда получают _STOP
+            if self._batch:
+                self._embed_q.put(self._batch)
+            for _ in range(self.workers):
+                self._embed_q.put(_STOP)
+
+    def _chunk_in_processes(self) -> None:
+        # файлы отдаются процессам наперёд, а результаты забираются в порядке
+        # чтения, поэтому батчи и номера чанков те же, что и без процессов;
+        # эмбеддинги, запись в хранилище и манифест остаются в этом процессе
+        window = self.processes * PROCESS_PREFETCH
+        submitted: deque = deque()
+
+        def take() -> None:
+            rel_path, entry, replace, future = submitted.popleft()
+            # генератор: ошибка воркера поднимется внутри _batch_file
+            chunks = (Chunk(*record) for record in future.result())
+            self._batch_file(rel_path, entry, replace, chunks)
+
+        with ProcessPoolExecutor(
+            max_workers=self.processes,
+            initializer=_init_chunk_process,
+            initargs=(CHUNKER,),
+        ) as pool:
+            for fpath, rel_path, entry, replace in self._read_items():
+                future = pool.submit(chunk_file_records, str(fpath), Path(rel_path).suffix)
+                submitted.append((rel_path, entry, replace, future))
+                if len(submitted) >= window:
+                    take()
+            while submitted:
+                take()
+
+    def _batch_file(
+        self, rel_path: str, entry: Dict[str, Any], replace: bool, chunks: Iterator[Chunk]
+    ) -> None:
+        """
+        Раскладывает чанки файла по батчам эмбеддингов и ведёт учёт файла.
+        """
+        state = {"pending": 0, "entry": entry, "replace": replace, "chunked": False}
+        with self._lock:
+            self._files[rel_path] = state
+
+        n_chunks = 0
+        try:
+            # на один чанк вперёд, чтобы знать, какой из них последний
+            chunk = next(chunks, None)
+            while chunk is not None:
+                following = next(chunks, None)
+                with self._lock:
+                    state["pending"] += 1
+                    if following is None:
+                        # все чанки посчитаны до того, как последний уйдёт в батч
+                        entry["chunks"] = n_chunks + 1
+                        state["chunked"] = True
+                # лимит читается заново для каждого батча: он меняется по
+                # мере того, как воркеры получают ответы сервиса
+                if self._batch and self._batch_tokens + chunk.tokens > batch_limit.tokens:
+                    self._embed_q.put(self._batch)
+                    self._batch, self._batch_tokens = [], 0
+                self._batch.append((rel_path, n_chunks, chunk))
+                self._batch_tokens += chunk.tokens
+                n_chunks += 1
+                if len(self._batch) >= batch_limit.max_items:
+                    self._embed_q.put(self._batch)
+                    self._batch, self._batch_tokens = [], 0
+                chunk = following
+        except Exception as e:
+            print(f"Ошибка чтения файла {rel_path}: {e}")
+            with self._lock:
+                self._failed.add(rel_path)
+                done = state["pending"] == 0
+                state["chunked"] = True
+            if done:
+                self._upsert_q.put(([], [rel_path]))
+            return
+
+        if n_chunks == 0:
+            # нечего индексировать — файл сразу считается готовым
+            entry["chunks"] = 0
+            state["chunked"] = True
+            self._upsert_q.put(([], [rel_path]))
+
+    def _embed_worker(self) -> None:
+        while True:
+            batch = self._embed_q.get()
+            if batch is _STOP:
+                break
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            started = time.perf_counter()
+            try:
+                embs = get_embeddings(
+                    [chunk.text for _, _, chunk in batch],
+                    tokens=sum(chunk.tokens for _, _, chunk in batch),
                 )
+                self._observe("embed", time.perf_counter() - started)
+                if len(embs) != len(batch):
+                    raise ValueError(
+                        f"embedding service returned {len(embs)} vectors for {len(batch)} texts"
+                    )
+            except Exception as e:
+                print(f"Ошибка получения эмбеддингов: {e}")
+                self._upsert_q.put((None, batch))
+                continue
+
+            # векторы батча остаются одной матрицей float32, без списков float
+            block = (
+                [rel_path for rel_path, _, _ in batch],
+                [point_id(rel_path, idx) for rel_path, idx, _ in batch],
+                embs,
+                [
+                    {
+                        "text": chunk.text,
+                        "path": rel_path,
+                        "chunk_index": idx,
+                        "start_line": chunk.start_line,
+                        "end_line": chunk.end_line,
+                        "tokens": chunk.tokens,
+                    }
+                    for rel_path, idx, chunk in batch
+                ],
+            )
+            self._upsert_q.put((block, None))
+        self._upsert_q.put(_STOP)
+
+    def _upserter(self) -> None:
+        # блоки (пути, id точек, матрица векторов, payload) от воркеров
+        buffer: List[Block] = []
+        buffered = 0
+        buffered_bytes = 0
+        stopped_workers = 0
+
+        while stopped_workers < self.workers:
+            item = self._upsert_q.get()
+            if item is _STOP:
+                stopped_workers += 1
+                continue
+
+            block, other = item
+            if block is None:
+                # батч эмбеддингов упал: все его файлы помечаем как неудачные
+                self._release([rel_path for rel_path, _, _ in other], failed=True)
+            elif not block:
+                # пустой файл
+                self._release(other, failed=False)
+            else:
+                buffer.append(block)
+                buffered += len(block[0])
+                buffered_bytes += block[2].nbytes + sum(len(p["text"]) for p in block[3])
+                if buffered >= self.upsert_batch_size or buffered_bytes >= UPSERT_MAX_BYTES:
+                    self._flush(buffer)
+                    buffer, buffered, buffered_bytes = [], 0, 0
+
+        if buffer:
+            self._flush(buffer)
+
+    # --- учёт файлов ---
+
+    def _flush(self, buffer: List[Block]) -> None:
+        rel_paths = [rel_path for block in buffer for rel_path in block[0]]
+        started = time.perf_counter()
+        try:
+            self.store.upsert(
+                self.collection,
+                ids=[pid for block in buffer for pid in block[1]],
+                vectors=np.concatenate([block[2] for block in buffer]),
+                payloads=[payload for block in buffer for payload in block[3]],
             )
-            point_id += 1
+        except Exception as e:
+            print(f"Ошибка записи в хранилище векторов: {e}")
+            if self._upsert_error is None:
+                self._upsert_error = e
+            self._release(rel_paths, failed=True)
+            return
 
-        # файл успешно проиндексирован — записываем в лог
-        append_indexed_file(log_path, rel_path)
-        indexed_files_set.add(rel_path)
-        indexed_files += 1
+        elapsed = time.perf_counter() - started
+        self._observe("upsert", elapsed)
+        metrics.record("upsert", elapsed)
+        metrics.INDEX_CHUNKS.inc(len(rel_paths))
+        with self._lock:
+            self.written_chunks += len(rel_paths)
+        self._collect_lexical(buffer)
+        self._release(rel_paths, failed=False)
 
-        # считаем прогресс в процентах и выводим только при изменении
-        progress = int(indexed_files * 100 / total_files)
-        if progress != last_progress:
+    def _collect_lexical(self, buffer: List[Block]) -> None:
+        # вызывается только из потока upserter
+        if self._lexical_chunks is None:
+            return
+        for _, ids, _, payloads in buffer:
+            for pid, payload in zip(ids, payloads):
+                self._lexical_chunks.setdefault(payload["path"], []).append(
+                    (payload["chunk_index"], pid, payload["text"])
+                )
+            self._lexical_count += len(ids)
+        if self._lexical_count > self._lexical_limit:
+            self._lexical_chunks = None
+
+    def lexical_changes(self) -> Optional[Dict[str, List[Tuple[str, str]]]]:
+        """
+        Документы проиндексированных файлов для дельты лексического индекса
+        (путь -> [(id точки, текст)] по порядку чанков) или None, если их
+        слишком много и индекс нужно пересобрать целиком.
+        """
+        if self._lexical_chunks is None:
+            return None
+        return {
+            rel_path: [
+                (pid, text) for _, pid, text in sorted(self._lexical_chunks.get(rel_path, []))
+            ]
+            for rel_path in self.indexed_paths
+        }
+
+    def _observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            stats = self.latency[stage]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def _release(self, rel_paths: List[str], failed: bool) -> None:
+        """
+        Отмечает обработку чанков (по одному на элемент rel_paths) и
+        завершает файлы, у которых не осталось необработанных чанков.
+        """
+        finished: List[Tuple[str, Dict[str, Any]]] = []
+        with self._lock:
+            for rel_path in rel_paths:
+                state = self._files[rel_path]
+                if failed:
+                    self._failed.add(rel_path)
+                # у пустого файла pending уже 0
+                state["pending"] = max(0, state["pending"] - 1)
+                if state["pending"] == 0 and state["chunked"]:
+                    del self._files[rel_path]
+                    if rel_path in self._failed:
+                        self._failed.discard(rel_path)
+                        self.failed_files += 1
+                        self._report_progress()
+                    else:
+                        finished.append((rel_path, state))
+
+        for rel_path, state in finished:
+            self._finish_file(rel_path, state)
+
+    def _finish_file(self, rel_path: str, state: Dict[str, Any]) -> None:
+        # вызывается только из потока upserter, поэтому запросы к хранилищу идут последовательно
+        entry = state["entry"]
+        if state["replace"]:
+            # удаляем точки файла, которых нет среди только что записанных
+            keep_ids = [point_id(rel_path, i) for i in range(entry["chunks"])]
+            try:
+                self.store.delete_stale(self.collection, rel_path, keep_ids)
+            except Exception as e:
+                print(f"Ошибка удаления устаревших чанков {rel_path}: {e}")
+                with self._lock:
+                    self.failed_files += 1
+                    self._report_progress()
+                return
+
+        self.manifest.record(rel_path, entry)
+        with self._lock:
+            self.indexed_files += 1
+            self.indexed_paths.append(rel_path)
+            self._report_progress()
+
+    def _report_progress(self) -> None:
+        # вызывается под self._lock
+        self._done_files += 1
+        progress = int(self._done_files * 100 / self.total_files)
+        if progress != self._last_progress:
             print(
                 f"Прогресс индексации: {progress}% "
-                f"({indexed_files}/{total_files} файлов)"
+                f"({self._done_files}/{self.total_files} файлов)"
             )
-            last_progress = progress
+            self._last_progress = progress
+
+    def run(self, files: Iterable[Tuple[Path, str, bool, os.stat_result]]) -> int:
+        """
+        Прогоняет файлы через конвейер. Элемент files — (абсолютный путь,
+        относительный путь, были ли у файла точки в хранилище, stat файла).
+        Возвращает число проиндексированных (заново эмбеддированных) файлов.
+        """
+        threads = [
+            threading.Thread(target=self._reader, args=(files,), name="index-reader"),
+            threading.Thread(target=self._chunker, name="index-chunker"),
+            threading.Thread(target=self._upserter, name="index-upserter"),
+        ]
+        threads += [
+            threading.Thread(target=self._embed_worker, name=f"index-embed-{i}")
+            for i in range(self.workers)
+        ]
+        embedding_before = embedding_stats.snapshot()
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.elapsed = time.perf_counter() - started
+        self.embedding = {
+            name: value - embedding_before[name]
+            for name, value in embedding_stats.snapshot().items()
+        }
+
+        for status, count in (
+            ("indexed", self.indexed_files),
+            ("unchanged", self.unchanged_files),
+            ("skipped", len(self.skipped)),
+            ("failed", self.failed_files),
+        ):
+            metrics.INDEX_FILES.inc(count, status=status)
+
+        if self._reader_error is not None:
+            raise self._reader_error
+        if self._chunker_error is not None:
+            raise self._chunker_error
+        if self._upsert_error is not None:
+            raise self._upsert_error
+        return self.indexed_files
+
+
+def purge_files(
+    store: VectorStore,
+    manifest: IndexManifest,
+    rel_paths: List[str],
+    collection: str = COLLECTION_NAME,
+) -> None:
+    """
+    Удаляет из коллекции все точки перечисленных файлов и убирает их из манифеста.
+    """
+    for i in range(0, len(rel_paths), DELETE_BATCH_SIZE):
+        batch = rel_paths[i : i + DELETE_BATCH_SIZE]
+        store.delete_paths(collection, batch)
+        for rel_path in batch:
+            manifest.remove(rel_path)
 
-        # по батчам, чтобы не жечь память
-        if len(points) >= 500:
-            client.upsert(
-                collection_name=COLLECTION_NAME,
-                points=points,
+
+def rebuild_lexical_index(
+    store: VectorStore, index_dir: Path, collection: str = COLLECTION_NAME
+) -> int:
+    """
+    Перестраивает лексический индекс по всем чанкам коллекции
+    (читаются только payload, без векторов). Возвращает число чанков.
+    """
+    records = (
+        (pid, payload.get("path", ""), payload.get("text", ""))
+        for pid, payload in store.scroll_payloads(collection)
+    )
+    return build_lexical_index(records, index_dir)
+
+
+def lexical_delta_limit(index_dir: Path) -> int:
+    """
+    Сколько чанков можно держать в дельте лексического индекса (0 — индекса
+    ещё нет, нужна полная сборка).
+    """
+    n_docs = indexed_docs(index_dir)
+    if n_docs is None:
+        return 0
+    return max(LEXICAL_DELTA_MIN_DOCS, int(n_docs * LEXICAL_DELTA_MAX_RATIO))
+
+
+def refresh_lexical_index(
+    store: VectorStore,
+    index_dir: Path,
+    collection: str,
+    changes: Optional[Dict[str, List[Tuple[str, str]]]],
+) -> None:
+    """
+    Обновляет лексический индекс после индексации: дельтой по изменённым
+    файлам (changes: путь -> [(id точки, текст)], пустой список — файл
+    удалён) или, если индекса ещё нет, изменений слишком много (changes is
+    None) или дельта переросла lexical_delta_limit, полной пересборкой.
+    """
+    limit = lexical_delta_limit(index_dir)
+    if changes is not None and limit > 0:
+        n_delta = update_lexical_index(index_dir, changes)
+        if n_delta <= limit:
+            print(
+                f"Лексический индекс обновлён: файлов {len(changes)}, "
+                f"чанков в дельте {n_delta} ({index_dir})"
             )
-            points = []
+            return
+    n_chunks = rebuild_lexical_index(store, index_dir, collection)
+    print(f"Лексический индекс перестроен: {n_chunks} чанков в {index_dir}")
+
+
+def merge_lexical_changes(
+    changes: Optional[Dict[str, List[Tuple[str, str]]]],
+    pipeline: IndexPipeline,
+    dropped: List[str],
+) -> Optional[Dict[str, List[Tuple[str, str]]]]:
+    """
+    Добавляет к изменениям для лексического индекса файлы, проиндексированные
+    и убранные конвейером. None — изменений слишком много для дельты.
+    """
+    indexed = pipeline.lexical_changes()
+    if changes is None or indexed is None:
+        return None
+    changes.update(indexed)
+    changes.update((rel_path, []) for rel_path in dropped)
+    return changes
+
+
+def find_candidates(
+    repo_path: Path,
+    manifest: IndexManifest,
+    legacy: bool,
+    git: Optional[GitChanges],
+    scan_workers: int = DEFAULT_SCAN_WORKERS,
+    gitignore: bool = True,
+) -> Tuple[List[Tuple[Path, str, bool, os.stat_result]], Set[str]]:
+    """
+    Новые и изменённые (по mtime/размеру) файлы и множество всех файлов дерева.
+
+    С git (режим --git) дерево не обходится: список файлов берётся из
+    git ls-files, а stat делается только для изменившихся файлов.
+    Иначе — параллельный обход каталогов (scanner.TreeScanner).
+    """
+    candidates: List[Tuple[Path, str, bool, os.stat_result]] = []
+
+    def consider(fpath: Path, rel_path: str, st: os.stat_result) -> None:
+        if not manifest.is_unchanged(rel_path, st):
+            candidates.append((fpath, rel_path, legacy or manifest.get(rel_path) is not None, st))
+
+    if git is not None:
+        seen = {rel_path for rel_path in git.files if is_indexable(rel_path)}
+        # файлы, незакоммиченные в прошлый раз, могли с тех пор вернуться к версии из git
+        changed = git.changed | set(manifest.meta.get("git_dirty", []))
+        for rel_path in sorted(changed & seen):
+            fpath = repo_path / rel_path
+            try:
+                st = fpath.stat()
+            except OSError:
+                seen.discard(rel_path)
+                continue
+            consider(fpath, rel_path, st)
+        return candidates, seen
+
+    seen = set()
+    scanner = TreeScanner(repo_path, ALLOWED_EXT, workers=scan_workers, gitignore=gitignore)
+    for scanned in scanner.scan():
+        seen.add(scanned.rel_path)
+        consider(scanned.path, scanned.rel_path, scanned.stat)
+    return candidates, seen
+
+
+def index_candidates(
+    store: VectorStore,
+    manifest: IndexManifest,
+    candidates: List[Tuple[Path, str, bool, os.stat_result]],
+    legacy: bool,
+    workers: int = DEFAULT_WORKERS,
+    inflight: int = DEFAULT_INFLIGHT,
+    rate_limiter: Optional[RateLimiter] = None,
+    collection: str = COLLECTION_NAME,
+    processes: int = DEFAULT_PROCESSES,
+    lexical_limit: int = 0,
+) -> Tuple[IndexPipeline, List[str]]:
+    """
+    Индексирует файлы-кандидаты и убирает из коллекции файлы, которые
+    конвейер пропустил (стали слишком большими, бинарными или
+    минифицированными). Возвращает конвейер (со статистикой) и список
+    убранных файлов.
+    """
+    pipeline = IndexPipeline(
+        store,
+        manifest,
+        total_files=len(candidates),
+        workers=workers,
+        inflight=inflight,
+        rate_limiter=rate_limiter,
+        collection=collection,
+        processes=processes,
+        lexical_limit=lexical_limit,
+    )
+    pipeline.run(candidates)
+    dropped = [
+        rel_path
+        for rel_path, _ in pipeline.skipped
+        if legacy or manifest.get(rel_path) is not None
+    ]
+    if dropped:
+        purge_files(store, manifest, dropped, collection)
+    return pipeline, dropped
 
-    if points:
-        client.upsert(
-            collection_name=COLLECTION_NAME,
-            points=points,
+
+def print_report(pipeline: IndexPipeline) -> None:
+    if pipeline.elapsed > 0:
+        done = pipeline.indexed_files + pipeline.unchanged_files
+        print(
+            f"Скорость индексации: {done / pipeline.elapsed:.1f} файлов/с, "
+            f"{pipeline.written_chunks / pipeline.elapsed:.1f} чанков/с "
+            f"(за {pipeline.elapsed:.1f} с)"
+        )
+    for stage, title in (("embed", "Эмбеддинги"), ("upsert", "Запись в хранилище")):
+        calls, total, longest = pipeline.latency[stage]
+        if calls:
+            print(
+                f"{title}: {calls} запросов, в среднем {total / calls * 1000:.0f} мс, "
+                f"максимум {longest * 1000:.0f} мс"
+            )
+    emb = pipeline.embedding
+    if emb.get("requests") and pipeline.elapsed > 0:
+        print(
+            f"Сервис эмбеддингов: {emb['texts'] / pipeline.elapsed:.1f} текстов/с, "
+            f"{emb['tokens'] / pipeline.elapsed:.0f} токенов/с, повторов {emb['retries']}, "
+            f"разбиений батча {emb['splits']}, размер батча сейчас {batch_limit.tokens} токенов"
         )
+    if pipeline.failed_files:
+        print(f"Не удалось проиндексировать файлов: {pipeline.failed_files}")
+    if pipeline.unchanged_files:
+        print(f"Файлов без изменений содержимого: {pipeline.unchanged_files}")
+    if pipeline.skipped:
+        reasons: Dict[str, int] = {}
+        for _, reason in pipeline.skipped:
+            reasons[reason] = reasons.get(reason, 0) + 1
+        print(
+            "Пропущено файлов: "
+            + ", ".join(f"{reason} — {count}" for reason, count in sorted(reasons.items()))
+        )
+    if embedding_cache is not None:
+        stats = embedding_cache.stats()
+        print(
+            f"Кэш эмбеддингов: попаданий {stats['hits']}, промахов {stats['misses']}, "
+            f"записей {stats['entries']}"
+        )
+
+
+def write_metrics_file(path: Optional[str]) -> None:
+    """
+    Записывает метрики индексатора (формат Prometheus) в файл — например,
+    для textfile collector у node_exporter. Запись атомарная.
+    """
+    if not path:
+        return
+    tmp_path = Path(path).with_name(Path(path).name + ".tmp")
+    tmp_path.write_text(metrics.REGISTRY.render(), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def changed_candidates(
+    repo_path: Path,
+    manifest: IndexManifest,
+    rel_paths: Iterable[str],
+    gitignore: bool = True,
+) -> Tuple[List[Tuple[Path, str, bool, os.stat_result]], List[str]]:
+    """
+    Разбирает пути из событий ФС: возвращает файлы для индексации и
+    проиндексированные ранее файлы, которые нужно удалить (файл или каталог
+    удалён, переименован или теперь исключён .gitignore). Для появившихся
+    каталогов (например, после переименования) обходится их содержимое.
+    """
+    rules = IgnoreRules(repo_path) if gitignore else None
+    candidates: Dict[str, Tuple[Path, str, bool, os.stat_result]] = {}
+    removed: Set[str] = set()
+
+    def consider(fpath: Path, rel_path: str, st: os.stat_result) -> None:
+        if not manifest.is_unchanged(rel_path, st):
+            candidates[rel_path] = (fpath, rel_path, manifest.get(rel_path) is not None, st)
+
+    for rel_path in rel_paths:
+        fpath = repo_path / rel_path
+        try:
+            st: Optional[os.stat_result] = fpath.stat()
+        except OSError:
+            st = None
+        is_dir = st is not None and stat.S_ISDIR(st.st_mode)
+        excluded = is_hidden(rel_path) or (rules is not None and rules.ignored(rel_path, is_dir))
+
+        if st is None or excluded:
+            # удалённый или исключённый путь: файл или каталог целиком
+            prefix = rel_path + "/"
+            removed.update(p for p in manifest.entries if p == rel_path or p.startswith(prefix))
+        elif is_dir:
+            scanner = TreeScanner(repo_path, ALLOWED_EXT, gitignore=gitignore)
+            for scanned in scanner.scan(rel_path):
+                consider(scanned.path, scanned.rel_path, scanned.stat)
+        elif is_indexable(rel_path):
+            consider(fpath, rel_path, st)
+
+    return list(candidates.values()), sorted(removed - candidates.keys())
+
+
+def watch_repo(
+    repo_path: Path,
+    store: VectorStore,
+    manifest: IndexManifest,
+    args: Any,
+    rate_limiter: Optional[RateLimiter] = None,
+) -> None:
+    """
+    Режим --watch: следит за каталогом и переиндексирует только затронутые
+    файлы. Изменения обрабатываются порциями по WATCH_MAX_BATCH_FILES файлов;
+    события, пришедшие во время обработки, схлопываются и образуют следующую
+    порцию. Лексический индекс обновляется дельтой по затронутым файлам после
+    каждой пачки событий (см. refresh_lexical_index).
+    Изменение .gitignore приводит к полной сверке каталога.
+    """
+    lexical_dir = collection_index_dir(LEXICAL_INDEX_PATH, args.collection, COLLECTION_NAME)
+    gitignore = not args.no_gitignore
+    changes = watch_changes(
+        repo_path,
+        ALLOWED_EXT,
+        debounce=args.debounce,
+        poll=args.poll,
+        poll_interval=args.poll_interval,
+        workers=args.scan_workers,
+        gitignore=gitignore,
+    )
+    print(f"Отслеживаем изменения в {repo_path} (Ctrl+C — выход)")
+
+    for rel_paths in changes:
+        # манифест, индексы и т.п. внутри каталога — скрытые файлы, их события не нужны
+        rel_paths = {p for p in rel_paths if not is_hidden(p) or Path(p).name == ".gitignore"}
+        if any(Path(p).name == ".gitignore" for p in rel_paths):
+            candidates, seen = find_candidates(
+                repo_path, manifest, False, None, args.scan_workers, gitignore
+            )
+            removed = sorted(set(manifest.entries) - seen)
+        else:
+            candidates, removed = changed_candidates(repo_path, manifest, rel_paths, gitignore)
+        if not candidates and not removed:
+            continue
+
+        changed = bool(removed)
+        if removed:
+            purge_files(store, manifest, removed, args.collection)
+            print(f"Удалено из индекса файлов: {len(removed)}")
+        # изменения для лексического индекса: путь -> документы (пусто — удалён)
+        lexical: Optional[Dict[str, List[Tuple[str, str]]]] = {p: [] for p in removed}
+        lexical_limit = 0 if args.no_lexical else lexical_delta_limit(lexical_dir)
+
+        for i in range(0, len(candidates), WATCH_MAX_BATCH_FILES):
+            part = candidates[i : i + WATCH_MAX_BATCH_FILES]
+            try:
+                pipeline, dropped = index_candidates(
+                    store,
+                    manifest,
+                    part,
+                    legacy=False,
+                    workers=args.workers,
+                    inflight=args.inflight,
+                    processes=args.processes,
+                    rate_limiter=rate_limiter,
+                    collection=args.collection,
+                    lexical_limit=lexical_limit,
+                )
+            except Exception as e:
+                # хранилище недоступно — файлы не попали в манифест и будут
+                # проиндексированы при следующем изменении или запуске
+                print(f"Ошибка индексации: {e}")
+                continue
+            changed = changed or bool(pipeline.indexed_files or dropped)
+            lexical = merge_lexical_changes(lexical, pipeline, dropped)
+            print(f"Переиндексировано файлов: {pipeline.indexed_files} из {len(part)}")
+            if dropped:
+                # стали слишком большими, бинарными или не читаются (удалены, нет прав)
+                print(f"Убрано из индекса пропущенных файлов: {len(dropped)}")
+            if pipeline.failed_files:
+                print(f"Не удалось проиндексировать файлов: {pipeline.failed_files}")
+
+        manifest.compact()
+        store.compact(args.collection)
+        if changed and not args.no_lexical:
+            refresh_lexical_index(store, lexical_dir, args.collection, lexical)
+        write_metrics_file(args.metrics_file)
+
+
+def ensure_collection(store: VectorStore, manifest: IndexManifest, collection: str) -> bool:
+    """
+    Создаёт коллекцию, если её нет. Новая коллекция пуста, поэтому манифест
+    и лексический индекс сбрасываются: иначе файлы, проиндексированные в
+    прежнюю коллекцию (удалённую или оставшуюся в другом хранилище), считались
+    бы уже записанными. Возвращает True, если коллекция создана.
+    """
+    if store.info(collection) is not None:
+        return False
+    # размер вектора возьмём после первого вызова get_embeddings
+    # поэтому сначала получим фиктивный embedding
+    dim = len(get_embeddings(["test"])[0])
+    store.create_collection(collection, dim)
+    if manifest.entries or manifest.meta:
+        print("Коллекция создана заново, манифест сброшен: все файлы будут проиндексированы")
+    manifest.reset()
+    lexical_dir = collection_index_dir(LEXICAL_INDEX_PATH, collection, COLLECTION_NAME)
+    shutil.rmtree(lexical_dir, ignore_errors=True)
+    return True
+
+
+def index_once(
+    repo_path: Path,
+    store: VectorStore,
+    manifest: IndexManifest,
+    args: Any,
+    rate_limiter: Optional[RateLimiter] = None,
+) -> None:
+    """
+    Однократная сверка каталога с коллекцией (обычный запуск index_repo.py).
+    """
+    legacy_log_path = repo_path / INDEXED_LOG_FILENAME
+
+    # остался старый лог: точки в коллекции могли быть записаны с
+    # последовательными id, поэтому у каждого файла заменяем все его точки
+    legacy = legacy_log_path.exists()
+
+    git: Optional[GitChanges] = None
+    if args.git:
+        since = manifest.meta.get("git_commit")
+        if legacy or manifest.meta.get("chunker") != CHUNKER.signature:
+            # параметры чанкера изменились — проверяем все файлы
+            since = None
+        try:
+            git = git_changes(repo_path, since)
+        except GitScanError as e:
+            print(f"Не удалось получить изменения из git, обходим каталог целиком: {e}")
+
+    # находим новые и изменённые (по mtime/размеру) файлы
+    candidates, seen = find_candidates(
+        repo_path,
+        manifest,
+        legacy,
+        git,
+        scan_workers=args.scan_workers,
+        gitignore=not args.no_gitignore,
+    )
+
+    def remember_commit(failed: bool) -> None:
+        # коммит запоминаем, только если все изменения проиндексированы
+        if git is not None and not failed:
+            manifest.set_meta(
+                git_commit=git.head,
+                git_dirty=sorted(git.dirty & seen),
+                chunker=CHUNKER.signature,
+            )
+
+    # файлы, которые исчезли из каталога, удаляем из коллекции
+    removed = sorted(set(manifest.entries) - seen)
+    if removed:
+        purge_files(store, manifest, removed, args.collection)
+        print(f"Удалено из индекса файлов: {len(removed)}")
+
+    lexical_dir = collection_index_dir(LEXICAL_INDEX_PATH, args.collection, COLLECTION_NAME)
+    lexical_limit = 0 if args.no_lexical else lexical_delta_limit(lexical_dir)
+    need_lexical = not args.no_lexical and (bool(removed) or not lexical_limit)
+    # со старым логом id точек могли поменяться — индекс собираем заново
+    lexical: Optional[Dict[str, List[Tuple[str, str]]]] = (
+        None if legacy else {p: [] for p in removed}
+    )
+
+    total_files = len(candidates)
+    if total_files == 0:
+        remember_commit(failed=False)
+        manifest.compact()
+        store.compact(args.collection)
+        print("Нет новых или изменённых файлов для индексации")
+        if need_lexical:
+            refresh_lexical_index(store, lexical_dir, args.collection, lexical)
+        return
+
+    try:
+        pipeline, dropped = index_candidates(
+            store,
+            manifest,
+            candidates,
+            legacy,
+            workers=args.workers,
+            inflight=args.inflight,
+            processes=args.processes,
+            rate_limiter=rate_limiter,
+            collection=args.collection,
+            lexical_limit=lexical_limit,
+        )
+        indexed_files = pipeline.indexed_files
+        remember_commit(failed=bool(pipeline.failed_files))
+    finally:
+        manifest.compact()
+        store.compact(args.collection)
+
+    if legacy and not pipeline.failed_files:
+        legacy_log_path.unlink()
+
+    if not args.no_lexical and (need_lexical or indexed_files or dropped):
+        lexical = merge_lexical_changes(lexical, pipeline, dropped)
+        refresh_lexical_index(store, lexical_dir, args.collection, lexical)
+
+    print_report(pipeline)
 
     print(
         f"Indexing finished, всего проиндексировано файлов в этом запуске: "
@@ -210,5 +1282,112 @@ def main():
     )
 
 
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("repo_path", help="Path to local git repo")
+    parser.add_argument(
+        "--collection",
+        default=COLLECTION_NAME,
+        help=f"Target collection for this repo (default: {COLLECTION_NAME})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Number of concurrent embedding requests",
+    )
+    parser.add_argument(
+        "--inflight",
+        type=int,
+        default=DEFAULT_INFLIGHT,
+        help="Capacity of each queue between pipeline stages (in files/batches)",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=DEFAULT_PROCESSES,
+        help="Number of worker processes splitting files into chunks (0: chunk in-process)",
+    )
+    parser.add_argument(
+        "--no-lexical",
+        action="store_true",
+        help="Do not rebuild the local BM25 index used for hybrid search",
+    )
+    parser.add_argument(
+        "--git",
+        action="store_true",
+        help="List files with git and only check files changed since the last indexed commit",
+    )
+    parser.add_argument(
+        "--scan-workers",
+        type=int,
+        default=DEFAULT_SCAN_WORKERS,
+        help="Number of threads scanning directories",
+    )
+    parser.add_argument(
+        "--no-gitignore",
+        action="store_true",
+        help="Index files ignored by .gitignore too",
+    )
+    parser.add_argument(
+        "--max-rps",
+        type=float,
+        default=MAX_EMBEDDING_RPS,
+        help="Maximum embedding requests per second (default: unlimited)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="Write indexer metrics in Prometheus text format to this file after each run",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="After indexing, keep watching the directory and re-index changed files",
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="In --watch mode, poll the directory instead of using file system notifications",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=DEFAULT_DEBOUNCE,
+        help="In --watch mode, group file system events arriving within this many seconds",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=DEFAULT_POLL_INTERVAL,
+        help="In --watch mode with --poll, seconds between directory scans",
+    )
+    args = parser.parse_args()
+
+    repo_path = Path(args.repo_path).resolve()
+    manifest_path = repo_path / manifest_filename(args.collection)
+
+    manifest = IndexManifest(manifest_path, signature=CHUNKER.signature)
+
+    # Qdrant или локальное хранилище — по vector_backend в конфиге RepoSearchAgent
+    store = vector_store_from_config(_repo_agent_cfg)
+
+    # создаём коллекцию, если нет
+    ensure_collection(store, manifest, args.collection)
+
+    rate_limiter = RateLimiter(args.max_rps) if args.max_rps else None
+
+    try:
+        index_once(repo_path, store, manifest, args, rate_limiter)
+    finally:
+        write_metrics_file(args.metrics_file)
+    if args.watch:
+        try:
+            watch_repo(repo_path, store, manifest, args, rate_limiter)
+        except KeyboardInterrupt:
+            pass
+
+
 if __name__ == "__main__":
     main()
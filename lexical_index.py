@@ -0,0 +1,397 @@
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import shutil
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# версия формата файлов индекса
+FORMAT_VERSION = 1
+
+# параметры BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# термы, встречающиеся больше чем в такой доле документов, почти не влияют
+# на BM25, но их списки самые длинные — при поиске их пропускаем
+MAX_DF_RATIO = 0.25
+
+# дельта индекса: документы файлов, изменившихся после последней полной сборки
+# (JSONL: {"path": путь, "docs": [[id точки, текст], ...]}, пустой docs — файл удалён)
+DELTA_FILENAME = "delta.jsonl"
+
+# идентификаторы: имена классов Puppet (`profile::nginx`), ключи hiera
+# (`nginx::worker_processes`, `app.db.port`), имена файлов и т.п.
+_TOKEN_RE = re.compile(r"[A-Za-z0-9_$][A-Za-z0-9_\-]*(?:(?:::|\.)[A-Za-z0-9_\-]+)*")
+_PART_SPLIT_RE = re.compile(r"::|\.")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Термы для лексического индекса: идентификаторы целиком (в нижнем регистре)
+    плюс их части, разделённые `::` и `.`, чтобы `profile::nginx::port`
+    находился и по полному имени, и по `nginx`.
+    """
+    terms: List[str] = []
+    for m in _TOKEN_RE.finditer(text):
+        token = m.group(0).lower().lstrip("$")
+        if len(token) < 2:
+            continue
+        terms.append(token)
+        if "::" in token or "." in token:
+            terms.extend(p for p in _PART_SPLIT_RE.split(token) if len(p) >= 2)
+    return terms
+
+
+def is_identifier(term: str) -> bool:
+    """
+    Терм похож на точный идентификатор (а не на обычное слово).
+    """
+    return "::" in term or "_" in term or "." in term
+
+
+class LexicalIndexBuilder:
+    """
+    Собирает BM25-индекс по чанкам и записывает его на диск.
+
+    Формат (каталог индекса):
+      meta.json         — версия, число документов, средняя длина, порядок байт;
+      vocab.txt         — отсортированные термы, по одному на строку;
+      offsets.u64       — смещения списков термов в postings (n_terms + 1);
+      postings_doc.u32  — номера документов, подряд для всех термов;
+      postings_tf.u16   — частоты терма в документе (параллельно postings_doc);
+      doc_len.u32       — длина каждого документа в термах;
+      doc_ids.txt       — id точки Qdrant для каждого документа;
+      doc_paths.txt     — путь файла для каждого документа.
+
+    Все массивы — плоские бинарные файлы, которые при загрузке отображаются
+    в память (mmap) без разбора.
+    """
+
+    def __init__(self) -> None:
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._doc_len = array("I")
+        self._doc_ids: List[str] = []
+        self._doc_paths: List[str] = []
+
+    def add(self, point_id: str, path: str, text: str) -> None:
+        doc = len(self._doc_ids)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            lists = self._postings.get(term)
+            if lists is None:
+                lists = (array("I"), array("H"))
+                self._postings[term] = lists
+            lists[0].append(doc)
+            lists[1].append(min(tf, 0xFFFF))
+        self._doc_len.append(sum(counts.values()))
+        self._doc_ids.append(str(point_id))
+        self._doc_paths.append(path.replace("\n", " "))
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+    def write(self, index_dir: Path) -> None:
+        """
+        Записывает индекс атомарно: сначала во временный каталог,
+        затем подменяет им старый.
+        """
+        index_dir = Path(index_dir)
+        tmp_dir = index_dir.with_name(index_dir.name + ".tmp")
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir(parents=True)
+
+        terms = sorted(self._postings)
+        offsets = array("Q", [0])
+        with (tmp_dir / "postings_doc.u32").open("wb") as fd, (
+            tmp_dir / "postings_tf.u16"
+        ).open("wb") as ft:
+            for term in terms:
+                docs, tfs = self._postings[term]
+                docs.tofile(fd)
+                tfs.tofile(ft)
+                offsets.append(offsets[-1] + len(docs))
+
+        with (tmp_dir / "offsets.u64").open("wb") as f:
+            offsets.tofile(f)
+        with (tmp_dir / "doc_len.u32").open("wb") as f:
+            self._doc_len.tofile(f)
+        (tmp_dir / "vocab.txt").write_text("\n".join(terms), encoding="utf-8")
+        (tmp_dir / "doc_ids.txt").write_text("\n".join(self._doc_ids), encoding="utf-8")
+        (tmp_dir / "doc_paths.txt").write_text("\n".join(self._doc_paths), encoding="utf-8")
+
+        n_docs = len(self._doc_ids)
+        meta = {
+            "version": FORMAT_VERSION,
+            "byteorder": sys.byteorder,
+            "n_docs": n_docs,
+            "n_terms": len(terms),
+            "avgdl": (sum(self._doc_len) / n_docs) if n_docs else 0.0,
+        }
+        (tmp_dir / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+
+        old_dir = index_dir.with_name(index_dir.name + ".old")
+        if old_dir.exists():
+            shutil.rmtree(old_dir)
+        if index_dir.exists():
+            os.replace(index_dir, old_dir)
+        os.replace(tmp_dir, index_dir)
+        if old_dir.exists():
+            shutil.rmtree(old_dir)
+
+
+def _map_array(path: Path, typecode: str):
+    """
+    Отображает бинарный файл в память как массив (memoryview нужного типа).
+    """
+    if path.stat().st_size == 0:
+        return array(typecode)
+    with path.open("rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mm).cast(typecode)
+
+
+class LexicalIndex:
+    """
+    BM25-индекс, загруженный с диска (см. LexicalIndexBuilder), вместе
+    с дельтой изменённых файлов (см. update_lexical_index).
+    """
+
+    def __init__(self, index_dir: Path) -> None:
+        self.index_dir = Path(index_dir)
+        meta = json.loads((self.index_dir / "meta.json").read_text(encoding="utf-8"))
+        if meta.get("version") != FORMAT_VERSION or meta.get("byteorder") != sys.byteorder:
+            raise ValueError(f"Unsupported lexical index format in {self.index_dir}")
+
+        self.n_docs = int(meta["n_docs"])
+        self.avgdl = float(meta["avgdl"]) or 1.0
+
+        def read_lines(name: str) -> List[str]:
+            text = (self.index_dir / name).read_text(encoding="utf-8")
+            return text.split("\n") if text else []
+
+        self._terms = read_lines("vocab.txt")
+        self._doc_ids = read_lines("doc_ids.txt")
+        self._doc_paths = read_lines("doc_paths.txt")
+        self._offsets = _map_array(self.index_dir / "offsets.u64", "Q")
+        self._post_doc = _map_array(self.index_dir / "postings_doc.u32", "I")
+        self._post_tf = _map_array(self.index_dir / "postings_tf.u16", "H")
+        self._doc_len = _map_array(self.index_dir / "doc_len.u32", "I")
+
+        # дельта: документы изменённых файлов в памяти; их документы в основном
+        # индексе (masked) при поиске пропускаются
+        self._delta_ids: List[str] = []
+        self._delta_paths: List[str] = []
+        self._delta_len: List[int] = []
+        self._delta_postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._masked: Set[int] = set()
+        delta = read_delta(self.index_dir)
+        if delta:
+            for path, docs in delta.items():
+                for point_id, text in docs:
+                    self._add_delta(str(point_id), path, text)
+            self._masked = {i for i, path in enumerate(self._doc_paths) if path in delta}
+        # терм -> сколько его документов в основном индексе замаскировано
+        # (считается при первом обращении к терму)
+        self._masked_df: Dict[str, int] = {}
+
+        # статистика BM25 с учётом дельты — как у полной сборки по тем же документам
+        total_len = self.avgdl * self.n_docs - sum(self._doc_len[i] for i in self._masked)
+        self.n_live = self.n_docs - len(self._masked) + len(self._delta_ids)
+        self.avgdl = ((total_len + sum(self._delta_len)) / self.n_live) if self.n_live else 1.0
+        self.avgdl = self.avgdl or 1.0
+
+    def _add_delta(self, point_id: str, path: str, text: str) -> None:
+        doc = len(self._delta_ids)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self._delta_postings.setdefault(term, []).append((doc, tf))
+        self._delta_len.append(sum(counts.values()))
+        self._delta_ids.append(point_id)
+        self._delta_paths.append(path.replace("\n", " "))
+
+    @property
+    def delta_size(self) -> int:
+        return len(self._delta_ids)
+
+    @staticmethod
+    def stamp(index_dir: str | Path) -> Optional[Tuple[float, Optional[float]]]:
+        """
+        Версия индекса на диске (mtime meta.json и дельты) или None, если индекса нет:
+        по ней сервер понимает, что индекс пора перечитать.
+        """
+        index_dir = Path(index_dir)
+        try:
+            meta = (index_dir / "meta.json").stat().st_mtime
+        except OSError:
+            return None
+        try:
+            delta: Optional[float] = (index_dir / DELTA_FILENAME).stat().st_mtime
+        except OSError:
+            delta = None
+        return meta, delta
+
+    @classmethod
+    def open(cls, index_dir: str | Path) -> Optional["LexicalIndex"]:
+        """
+        Загружает индекс, если он есть; иначе None.
+        """
+        if not (Path(index_dir) / "meta.json").exists():
+            return None
+        return cls(Path(index_dir))
+
+    def df(self, term: str) -> int:
+        """
+        В скольких документах встречается терм.
+        """
+        return self._df(term, self._base_range(term))
+
+    def _df(self, term: str, base: Optional[Tuple[int, int]]) -> int:
+        n_delta = len(self._delta_postings.get(term, ()))
+        if base is None:
+            return n_delta
+        return base[1] - base[0] - self._masked_count(term, base) + n_delta
+
+    def _base_range(self, term: str) -> Optional[Tuple[int, int]]:
+        i = bisect_left(self._terms, term)
+        if i == len(self._terms) or self._terms[i] != term:
+            return None
+        return self._offsets[i], self._offsets[i + 1]
+
+    def _masked_count(self, term: str, base: Tuple[int, int]) -> int:
+        if not self._masked:
+            return 0
+        n = self._masked_df.get(term)
+        if n is None:
+            n = sum(1 for j in range(base[0], base[1]) if self._post_doc[j] in self._masked)
+            self._masked_df[term] = n
+        return n
+
+    def search(self, query: str, limit: int) -> List[Dict]:
+        """
+        BM25-поиск. Возвращает до limit хитов вида
+        {"id": id точки, "path": путь, "score": BM25}.
+        """
+        if self.n_live == 0:
+            return []
+
+        # (df, диапазон в основном индексе, список в дельте) для каждого терма запроса
+        postings: List[Tuple[int, Optional[Tuple[int, int]], List[Tuple[int, int]]]] = []
+        for term in dict.fromkeys(tokenize(query)):
+            base = self._base_range(term)
+            delta = self._delta_postings.get(term, [])
+            df = self._df(term, base)
+            if df:
+                postings.append((df, base, delta))
+
+        # частые термы пропускаем, если есть более редкие
+        max_df = max(1, int(self.n_live * MAX_DF_RATIO))
+        rare = [p for p in postings if p[0] <= max_df]
+        postings = rare or postings
+
+        # ключ — номер документа основного индекса или -(номер в дельте + 1)
+        scores: Dict[int, float] = {}
+        for df, base, delta in postings:
+            idf = math.log(1.0 + max(0.0, self.n_live - df + 0.5) / (df + 0.5))
+            if base is not None:
+                for j in range(base[0], base[1]):
+                    doc = self._post_doc[j]
+                    if doc in self._masked:
+                        continue
+                    tf = self._post_tf[j]
+                    norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self._doc_len[doc] / self.avgdl)
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+            for doc, tf in delta:
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self._delta_len[doc] / self.avgdl)
+                key = -(doc + 1)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+
+        top = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+        return [
+            {"id": self._doc_ids[doc], "path": self._doc_paths[doc], "score": score}
+            if doc >= 0
+            else {
+                "id": self._delta_ids[-doc - 1],
+                "path": self._delta_paths[-doc - 1],
+                "score": score,
+            }
+            for doc, score in top
+        ]
+
+
+def collection_index_dir(base_dir: str | Path, collection: str, default_collection: str) -> Path:
+    """
+    Каталог индекса коллекции: для коллекции по умолчанию — сам base_dir,
+    для остальных — соседний каталог `<base_dir>.<коллекция>` (индекс
+    перезаписывается каталогом целиком, поэтому вложить их нельзя).
+    """
+    base_dir = Path(base_dir)
+    if collection == default_collection:
+        return base_dir
+    return base_dir.with_name(f"{base_dir.name}.{collection}")
+
+
+def build_lexical_index(records: Iterable[Tuple[str, str, str]], index_dir: Path) -> int:
+    """
+    Строит индекс по записям (id точки, путь, текст). Возвращает число документов.
+    """
+    builder = LexicalIndexBuilder()
+    for point_id, path, text in records:
+        builder.add(point_id, path, text)
+    builder.write(index_dir)
+    return len(builder)
+
+
+def read_delta(index_dir: str | Path) -> Dict[str, List[Tuple[str, str]]]:
+    """
+    Дельта индекса: путь -> [(id точки, текст), ...] (пустой список — файл удалён).
+    """
+    path = Path(index_dir) / DELTA_FILENAME
+    delta: Dict[str, List[Tuple[str, str]]] = {}
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                rec = json.loads(line)
+                delta[rec["path"]] = [(str(pid), text) for pid, text in rec["docs"]]
+    except FileNotFoundError:
+        pass
+    return delta
+
+
+def indexed_docs(index_dir: str | Path) -> Optional[int]:
+    """
+    Число документов основного индекса (по meta.json) или None, если индекса нет.
+    """
+    try:
+        meta = json.loads((Path(index_dir) / "meta.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return int(meta.get("n_docs", 0))
+
+
+def update_lexical_index(
+    index_dir: str | Path, changes: Dict[str, List[Tuple[str, str]]]
+) -> int:
+    """
+    Обновляет индекс без полной сборки: документы изменённых файлов
+    (путь -> [(id точки, текст), ...], пустой список — файл удалён) заменяют
+    их документы в основном индексе. Дельта переписывается атомарно и
+    сбрасывается следующей полной сборкой (build_lexical_index).
+    Возвращает число документов в дельте.
+    """
+    index_dir = Path(index_dir)
+    delta = read_delta(index_dir)
+    delta.update(changes)
+    tmp_path = index_dir / (DELTA_FILENAME + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        for path, docs in delta.items():
+            f.write(json.dumps({"path": path, "docs": docs}, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, index_dir / DELTA_FILENAME)
+    return sum(len(docs) for docs in delta.values())
@@ -0,0 +1,301 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# границы корзин гистограмм длительностей, секунды
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+# границы корзин гистограмм размеров (токены, байты)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# границы корзин гистограмм размеров батчей (число элементов)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+# Content-Type текстового формата Prometheus
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """
+    Гистограмма Prometheus (накопительные корзины, сумма и число наблюдений)
+    с необязательными метками. Потокобезопасна: наблюдения приходят и из
+    event loop сервера, и из потоков индексатора.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # значения меток -> [счётчики корзин..., сумма, число наблюдений]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self, **labels: str) -> Tuple[int, float]:
+        """
+        (число наблюдений, сумма) для набора меток.
+        """
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            if series is None:
+                return 0, 0.0
+            return int(series[-1]), series[-2]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-2] + [series[-1]]):
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {_format_value(count)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(series[-1])}")
+        return lines
+
+
+class Counter:
+    """
+    Монотонный счётчик Prometheus с необязательными метками.
+    """
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """
+    Набор метрик процесса и их выдача в текстовом формате Prometheus.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: List = []
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- метрики сервера ---
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_duration_seconds",
+    "Duration of a request processing stage (embedding, vector_search, llm, ...)",
+    ("stage",),
+)
+AGENT_SECONDS = REGISTRY.histogram(
+    "rag_agent_duration_seconds",
+    "Time an agent spent building its context",
+    ("agent",),
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "rag_request_duration_seconds",
+    "Time from receiving a chat request until the response starts "
+    "(LLM answer received, or the stream is opened)",
+)
+CONTEXT_TOKENS = REGISTRY.histogram(
+    "rag_context_tokens", "Size of the assembled repository context in tokens", buckets=SIZE_BUCKETS
+)
+CONTEXT_BYTES = REGISTRY.histogram(
+    "rag_context_bytes", "Size of the assembled repository context in bytes", buckets=SIZE_BUCKETS
+)
+PROMPT_TOKENS = REGISTRY.histogram(
+    "rag_prompt_tokens", "Size of the prompt sent to the LLM in tokens", buckets=SIZE_BUCKETS
+)
+PROMPT_BYTES = REGISTRY.histogram(
+    "rag_prompt_bytes", "Size of the prompt sent to the LLM in bytes", buckets=SIZE_BUCKETS
+)
+ANSWER_CACHE_REQUESTS = REGISTRY.counter(
+    "rag_answer_cache_requests_total",
+    "Semantic answer cache lookups by result (hit, miss)",
+    ("result",),
+)
+ANSWER_CACHE_INVALIDATED = REGISTRY.counter(
+    "rag_answer_cache_invalidated_total", "Cached answers dropped because a file they used changed"
+)
+CONVERSATION_TURNS = REGISTRY.counter(
+    "rag_conversation_turns_total",
+    "Chat turns in conversation mode by whether earlier turns' documents were reused",
+    ("context",),
+)
+RERANK_FALLBACKS = REGISTRY.counter(
+    "rag_rerank_fallbacks_total",
+    "Searches that kept first-stage order because reranking exceeded its budget or failed",
+)
+ADMISSION_REJECTED = REGISTRY.counter(
+    "rag_admission_rejected_total",
+    "Calls rejected by a concurrency limit (requests, embedding, vector_store, llm) "
+    "because its queue was full or the wait timed out",
+    ("limit", "reason"),
+)
+DEGRADED_REQUESTS = REGISTRY.counter(
+    "rag_degraded_requests_total",
+    "Chat requests answered without retrieval because the embedding service "
+    "or the vector store was overloaded",
+)
+QUERY_BATCH_SIZE = REGISTRY.histogram(
+    "rag_query_batch_size",
+    "Queries per micro-batch sent to the embedding service or the vector store",
+    ("kind",),
+    buckets=BATCH_BUCKETS,
+)
+
+# --- метрики клиента эмбеддингов (сервер и индексатор) ---
+
+EMBEDDING_TEXTS = REGISTRY.counter(
+    "rag_embedding_texts_total", "Texts sent to the embedding service"
+)
+EMBEDDING_TOKENS = REGISTRY.counter(
+    "rag_embedding_tokens_total", "Tokens sent to the embedding service (estimated when unknown)"
+)
+EMBEDDING_RETRIES = REGISTRY.counter(
+    "rag_embedding_retries_total", "Embedding requests retried after a transient error"
+)
+EMBEDDING_SPLITS = REGISTRY.counter(
+    "rag_embedding_splits_total", "Embedding batches split in half after a 413/context-length error"
+)
+
+# --- метрики индексатора ---
+
+INDEX_FILES = REGISTRY.counter(
+    "rag_index_files_total",
+    "Files processed by the indexer by outcome (indexed, unchanged, skipped, failed)",
+    ("status",),
+)
+INDEX_CHUNKS = REGISTRY.counter("rag_index_chunks_total", "Chunks written by the indexer")
+
+
+class Timings:
+    """
+    Длительности этапов одного запроса (для заголовка X-RAG-Timing).
+    Один этап может выполняться несколько раз — длительности суммируются.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def header_value(self) -> str:
+        """
+        Значение в синтаксисе Server-Timing: `stage;dur=<мс>, ...`.
+        """
+        with self._lock:
+            stages = dict(self.stages)
+        stages["total"] = time.perf_counter() - self.started
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages.items())
+
+
+# Timings текущего запроса; задачи asyncio и asyncio.to_thread наследуют контекст,
+# поэтому этапы агентов попадают в Timings запроса, который их запустил
+_current_timings: ContextVar[Optional[Timings]] = ContextVar("rag_timings", default=None)
+
+
+def start_timings() -> Timings:
+    """
+    Начинает сбор длительностей этапов для текущего запроса.
+    """
+    timings = Timings()
+    _current_timings.set(timings)
+    return timings
+
+
+def current_timings() -> Optional[Timings]:
+    return _current_timings.get()
+
+
+def record(stage: str, seconds: float) -> None:
+    """
+    Записывает длительность этапа в гистограмму и в Timings текущего запроса.
+    """
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Замер этапа: `with span("embedding"): ...` (работает и внутри корутин).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
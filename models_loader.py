@@ -19,6 +19,9 @@ def load_app_config(path: str = "config.yaml") -> Dict[str, Any]:
       api_base: http://host:port
       api_key: key-for-embedding
       model: some-embedding-model-name
+      cache:                      # необязательно, см. embed_cache.py
+        path: .embedding_cache.sqlite
+        max_entries: 200000
 
     agents:
       - name: RepoSearchAgent
@@ -63,7 +66,9 @@ def load_app_config(path: str = "config.yaml") -> Dict[str, Any]:
         "api_key": llm_api_key,
         "model": llm_model,
     }
+    # дополнительные ключи секции (например, cache) передаём как есть
     data["embedding"] = {
+        **emb_cfg,
         "api_base": emb_api_base,
         "api_key": emb_api_key,
         "model": emb_model,
@@ -0,0 +1,144 @@
+import time
+import asyncio
+import contextvars
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+
+class TTLCache:
+    """
+    Простой LRU-кэш с ограничением времени жизни записей.
+
+    Не потокобезопасен: рассчитан на использование из одного event loop.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300.0) -> None:
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые запросы: пока вычисление по ключу
+    не завершилось, все вызывающие ждут один и тот же результат.
+
+    Вычисление запускается отдельной задачей, поэтому отмена одного из
+    ожидающих (например, по дедлайну агента) не отменяет его для остальных.
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # помечаем исключение как полученное, даже если все ожидающие отменились
+        if not task.cancelled():
+            task.exception()
+
+
+class MicroBatcher:
+    """
+    Собирает одиночные запросы из разных корутин в батчи: первый запрос
+    открывает окно max_delay секунд, батч уходит, когда окно закрылось или
+    набралось max_batch элементов. fn получает список элементов и возвращает
+    список результатов того же размера; результаты (или исключение fn)
+    раздаются ожидающим, а если задачу батча отменили — ожидающие тоже
+    отменяются.
+
+    Как и в SingleFlight, батч выполняется отдельной задачей: отмена одного
+    из ожидающих не отменяет запрос для остальных. Задача запускается в пустом
+    контексте, чтобы замеры этапов батча не попали в Timings одного из запросов.
+    Не потокобезопасен: рассчитан на использование из одного event loop.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch: int = 32,
+        max_delay: float = 0.005,
+    ) -> None:
+        self.fn = fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_delay = max(0.0, float(max_delay))
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        # create_task копирует текущий контекст, поэтому создаём задачу внутри пустого
+        task = contextvars.Context().run(asyncio.ensure_future, self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        try:
+            results = await self.fn([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"batch of {len(batch)} items returned {len(results)} results")
+        except Exception as e:
+            for _, future in batch:
+                # ожидающий мог отмениться — его future уже завершён
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except BaseException:
+            # задачу батча отменили (например, при остановке loop) — ожидающие
+            # не должны зависнуть навсегда
+            for _, future in batch:
+                if not future.done():
+                    future.cancel()
+            raise
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,178 @@
+import time
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from lexical_index import is_identifier, tokenize
+
+logger = logging.getLogger("uvicorn.error")
+
+# вес терма-идентификатора (класс Puppet, ключ hiera, имя файла) относительно обычного слова
+IDENTIFIER_WEIGHT = 3.0
+
+# совпадение терма в пути файла ценится как совпадение в тексте с таким множителем
+PATH_MATCH_WEIGHT = 0.5
+
+# модель кросс-энкодера по умолчанию (небольшая, работает на CPU)
+DEFAULT_CROSS_ENCODER = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+class LexicalScorer:
+    """
+    Дешёвая оценка пары (запрос, чанк): взвешенная доля термов запроса,
+    встречающихся в тексте чанка или в его пути. Идентификаторы весят
+    больше обычных слов.
+    """
+
+    def prepare(self) -> None:
+        pass
+
+    def score(
+        self, query: str, hits: Sequence[Dict[str, Any]], deadline: float
+    ) -> Optional[List[float]]:
+        weights: Dict[str, float] = {}
+        for term in tokenize(query):
+            weights[term] = IDENTIFIER_WEIGHT if is_identifier(term) else 1.0
+        total = sum(weights.values())
+        if not total:
+            return [0.0] * len(hits)
+
+        scores: List[float] = []
+        for hit in hits:
+            if time.monotonic() > deadline:
+                return None
+            payload = hit.get("payload") or {}
+            text_terms = set(tokenize(payload.get("text", "")))
+            path_terms = set(tokenize(payload.get("path", "")))
+            matched = sum(
+                w * (1.0 if t in text_terms else PATH_MATCH_WEIGHT if t in path_terms else 0.0)
+                for t, w in weights.items()
+            )
+            scores.append(matched / total)
+        return scores
+
+
+class CrossEncoderScorer:
+    """
+    Оценка кросс-энкодером (sentence-transformers), батчами по batch_size пар.
+    Дедлайн проверяется между батчами. Модель загружается при первом вызове
+    (в prepare, до начала отсчёта бюджета).
+    """
+
+    def __init__(self, model: str = DEFAULT_CROSS_ENCODER, batch_size: int = 16) -> None:
+        self.model_name = model
+        self.batch_size = max(1, int(batch_size))
+        self._model: Any = None
+
+    def load(self) -> None:
+        from sentence_transformers import CrossEncoder
+
+        self._model = CrossEncoder(self.model_name, device="cpu")
+
+    def prepare(self) -> None:
+        if self._model is None:
+            self.load()
+
+    def score(
+        self, query: str, hits: Sequence[Dict[str, Any]], deadline: float
+    ) -> Optional[List[float]]:
+        self.prepare()
+        pairs = [(query, (hit.get("payload") or {}).get("text", "")) for hit in hits]
+        scores: List[float] = []
+        for start in range(0, len(pairs), self.batch_size):
+            if time.monotonic() > deadline:
+                return None
+            batch = pairs[start : start + self.batch_size]
+            scores.extend(float(s) for s in self._model.predict(batch, batch_size=len(batch)))
+        return scores
+
+
+class Reranker:
+    """
+    Второй этап поиска: первые candidates хитов векторного (или гибридного)
+    поиска переоцениваются на CPU и сокращаются до limit.
+
+    Итоговый score — weight * нормированная оценка scorer'а
+    + (1 - weight) * позиция после первого этапа (1 для первого хита,
+    близко к 0 для последнего). Если оценка не уложилась в budget секунд,
+    возвращается порядок первого этапа. Бюджет отсчитывается от начала самой
+    оценки: загрузка модели и всё, что было до вызова rerank (поиск, ожидание
+    свободного потока), в него не входят.
+    """
+
+    def __init__(
+        self,
+        scorer: Any,
+        candidates: int = 50,
+        budget: float = 0.05,
+        weight: float = 0.7,
+    ) -> None:
+        self.scorer = scorer
+        self.candidates = max(1, int(candidates))
+        self.budget = float(budget)
+        self.weight = float(weight)
+
+    def rerank(self, query: str, hits: List[Dict], limit: int) -> Tuple[List[Dict], bool]:
+        """
+        Возвращает хиты и признак, что переоценка уложилась в бюджет.
+        """
+        if len(hits) <= 1:
+            return hits[:limit], True
+        try:
+            self.scorer.prepare()
+            deadline = time.monotonic() + self.budget
+            scores = self.scorer.score(query, hits, deadline)
+        except Exception as e:
+            logger.warning("Reranking failed, keeping first-stage order: %s", e)
+            scores = None
+        if scores is None:
+            return hits[:limit], False
+
+        low, high = min(scores), max(scores)
+        spread = (high - low) or 1.0
+        n = len(hits)
+        combined = [
+            self.weight * (s - low) / spread + (1.0 - self.weight) * (1.0 - rank / n)
+            for rank, s in enumerate(scores)
+        ]
+        order = sorted(range(n), key=lambda i: combined[i], reverse=True)[:limit]
+        return [{**hits[i], "score": combined[i]} for i in order], True
+
+
+def reranker_from_config(config: Dict[str, Any]) -> Optional[Reranker]:
+    """
+    Reranker по конфигу RepoSearchAgent (None, если переранжирование выключено):
+
+      rerank: none | lexical | cross_encoder
+      rerank_candidates: 50     — сколько хитов первого этапа переоценивать
+      rerank_budget_ms: 50      — бюджет времени на переоценку
+      rerank_weight: 0.7        — доля оценки реранкера в итоговом score
+      rerank_model: cross-encoder/ms-marco-MiniLM-L-6-v2   — для cross_encoder
+      rerank_batch_size: 16     — для cross_encoder
+
+    Если кросс-энкодер недоступен (нет sentence-transformers или модели),
+    используется лексическая оценка.
+    """
+    method = str(config.get("rerank") or "none").lower()
+    if method in ("none", "false", "off"):
+        return None
+
+    scorer: Any = LexicalScorer()
+    if method == "cross_encoder":
+        cross_encoder = CrossEncoderScorer(
+            model=config.get("rerank_model", DEFAULT_CROSS_ENCODER),
+            batch_size=config.get("rerank_batch_size", 16),
+        )
+        try:
+            cross_encoder.load()
+            scorer = cross_encoder
+        except Exception as e:
+            logger.warning("Cross-encoder reranker is unavailable (%s), using lexical scoring", e)
+    elif method != "lexical":
+        raise ValueError(f"Unsupported rerank method: {method}")
+
+    return Reranker(
+        scorer,
+        candidates=config.get("rerank_candidates", 50),
+        budget=float(config.get("rerank_budget_ms", 50.0)) / 1000.0,
+        weight=config.get("rerank_weight", 0.7),
+    )
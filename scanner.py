@@ -0,0 +1,311 @@
+import os
+import re
+import subprocess
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Collection, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+# число потоков обхода по умолчанию: на сетевых ФС время уходит на ожидание
+# ответа сервера, поэтому потоков больше, чем ядер
+DEFAULT_SCAN_WORKERS = 16
+
+
+@dataclass
+class ScannedFile:
+    path: Path  # абсолютный путь
+    rel_path: str  # путь относительно корня репозитория (через "/")
+    stat: os.stat_result
+
+
+def _translate_pattern(pattern: str) -> str:
+    """
+    Glob из .gitignore -> регулярное выражение для пути относительно
+    каталога, где лежит .gitignore.
+    """
+    out: List[str] = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == len(pattern):
+            out.append("/.*")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 1)
+            if j == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1 : j].replace("\\", "\\\\")
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = j
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class GitIgnore:
+    """
+    Правила .gitignore одного каталога (и всех родительских).
+
+    Поддерживаются маски `*`, `?`, `[...]`, `**`, отрицание `!`, привязка
+    к каталогу `/` в начале или середине шаблона и шаблоны только для
+    каталогов (`/` в конце). Побеждает последнее совпавшее правило.
+    """
+
+    def __init__(self, rules: Optional[List[Tuple[str, "re.Pattern[str]", bool, bool]]] = None) -> None:
+        # (каталог .gitignore относительно корня, regex, отрицание, только каталоги)
+        self.rules = rules or []
+
+    def extend(self, base: str, lines: List[str]) -> "GitIgnore":
+        """
+        Новый набор правил: текущие плюс правила .gitignore из каталога base.
+        """
+        rules = list(self.rules)
+        for line in lines:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            if not line.endswith("\\ "):
+                line = line.rstrip()
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            elif line.startswith("\\!") or line.startswith("\\#"):
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            if "/" in line:
+                regex = _translate_pattern(line.lstrip("/"))
+            else:
+                # шаблон без "/" совпадает с именем на любой глубине
+                regex = "(?:.*/)?" + _translate_pattern(line)
+            rules.append((base, re.compile(regex + r"\Z", re.DOTALL), negate, dir_only))
+        return GitIgnore(rules)
+
+    def ignored(self, rel_path: str, is_dir: bool) -> bool:
+        result = False
+        for base, regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if base:
+                if not rel_path.startswith(base + "/"):
+                    continue
+                sub = rel_path[len(base) + 1 :]
+            else:
+                sub = rel_path
+            if regex.match(sub):
+                result = not negate
+        return result
+
+
+def _read_gitignore(dir_path: Path) -> Optional[List[str]]:
+    try:
+        return (dir_path / ".gitignore").read_text(encoding="utf-8", errors="ignore").splitlines()
+    except OSError:
+        return None
+
+
+class IgnoreRules:
+    """
+    Проверка отдельных путей по .gitignore (для путей из событий ФС, без
+    обхода дерева). Прочитанные .gitignore кэшируются в объекте, поэтому
+    для учёта их изменений создаётся новый IgnoreRules.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = Path(root)
+        self._dirs: Dict[str, GitIgnore] = {}
+
+    def for_dir(self, rel_dir: str) -> GitIgnore:
+        """
+        Правила для содержимого каталога rel_dir: из .gitignore всех
+        каталогов от корня до rel_dir включительно.
+        """
+        ignore = self._dirs.get(rel_dir)
+        if ignore is None:
+            parent = self.for_dir(rel_dir.rpartition("/")[0]) if rel_dir else GitIgnore()
+            lines = _read_gitignore(self.root / rel_dir if rel_dir else self.root)
+            ignore = parent.extend(rel_dir, lines) if lines else parent
+            self._dirs[rel_dir] = ignore
+        return ignore
+
+    def ignored(self, rel_path: str, is_dir: bool = False) -> bool:
+        """
+        Путь исключён .gitignore сам или через один из родительских каталогов.
+        """
+        parts = rel_path.split("/")
+        for i in range(1, len(parts) + 1):
+            sub = "/".join(parts[:i])
+            sub_is_dir = is_dir if i == len(parts) else True
+            if self.for_dir("/".join(parts[: i - 1])).ignored(sub, sub_is_dir):
+                return True
+        return False
+
+
+class TreeScanner:
+    """
+    Параллельный обход дерева каталогов через os.scandir.
+
+    Каждый каталог сканируется отдельной задачей в пуле потоков, поэтому
+    задержки сетевой ФС перекрываются. Тип записи берётся из DirEntry
+    (без лишнего stat), stat делается только для подходящих файлов и
+    возвращается вызывающему, чтобы не повторять его.
+
+    Как и раньше, скрытые каталоги и файлы (с точки в начале имени)
+    пропускаются; при gitignore=True учитываются файлы .gitignore.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        allowed_ext: Collection[str],
+        workers: int = DEFAULT_SCAN_WORKERS,
+        gitignore: bool = True,
+    ) -> None:
+        self.root = Path(root)
+        self.allowed_ext = {e.lower() for e in allowed_ext}
+        self.workers = max(1, workers)
+        self.gitignore = gitignore
+
+    def _scan_dir(
+        self, dir_path: Path, rel_dir: str, ignore: GitIgnore
+    ) -> Tuple[List[ScannedFile], List[Tuple[Path, str, GitIgnore]]]:
+        if self.gitignore:
+            lines = _read_gitignore(dir_path)
+            if lines:
+                ignore = ignore.extend(rel_dir, lines)
+
+        files: List[ScannedFile] = []
+        subdirs: List[Tuple[Path, str, GitIgnore]] = []
+        try:
+            entries = list(os.scandir(dir_path))
+        except OSError:
+            return files, subdirs
+
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                if not ignore.ignored(rel_path, True):
+                    subdirs.append((Path(entry.path), rel_path, ignore))
+                continue
+            if os.path.splitext(entry.name)[1].lower() not in self.allowed_ext:
+                continue
+            if ignore.ignored(rel_path, False):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            files.append(ScannedFile(Path(entry.path), rel_path, st))
+        return files, subdirs
+
+    def scan(self, start: str = "") -> Iterator[ScannedFile]:
+        """
+        Файлы дерева (или его подкаталога start) в произвольном порядке,
+        по мере обхода.
+        """
+        pending: Deque[Future] = deque()
+        ignore = GitIgnore()
+        if start and self.gitignore:
+            ignore = IgnoreRules(self.root).for_dir(start.rpartition("/")[0])
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scan") as pool:
+            pending.append(
+                pool.submit(self._scan_dir, self.root / start if start else self.root, start, ignore)
+            )
+            while pending:
+                files, subdirs = pending.popleft().result()
+                for sub in subdirs:
+                    pending.append(pool.submit(self._scan_dir, *sub))
+                yield from files
+
+
+class GitScanError(Exception):
+    """
+    Каталог не является git-репозиторием или git недоступен.
+    """
+
+
+def _git(repo_path: Path, *args: str) -> str:
+    try:
+        res = subprocess.run(
+            ["git", "-C", str(repo_path), *args],
+            capture_output=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise GitScanError(str(e)) from e
+    return res.stdout.decode("utf-8", errors="surrogateescape")
+
+
+def _split_z(out: str) -> List[str]:
+    return [p for p in out.split("\0") if p]
+
+
+@dataclass
+class GitChanges:
+    head: str  # текущий коммит
+    files: Set[str]  # все файлы репозитория (отслеживаемые и не игнорируемые)
+    changed: Set[str]  # изменившиеся с прошлого коммита + незакоммиченные
+    dirty: Set[str]  # изменённые и неотслеживаемые файлы рабочей копии
+
+
+def git_changes(repo_path: Path, since: Optional[str]) -> GitChanges:
+    """
+    Быстрое определение изменений через git, без обхода дерева:
+
+      git ls-files                    — список файлов (читается из индекса git);
+      git diff --name-only --relative <since> — что изменилось с прошлой индексации;
+      git ls-files -m -o              — незакоммиченные и новые файлы.
+
+    Без since (первый запуск) changed — все файлы. Бросает GitScanError,
+    если git недоступен или коммит since не найден.
+    """
+    head = _git(repo_path, "rev-parse", "HEAD").strip()
+    files = set(_split_z(_git(repo_path, "ls-files", "-z", "--cached", "--others", "--exclude-standard")))
+    dirty = set(_split_z(_git(repo_path, "ls-files", "-z", "-m", "-o", "--exclude-standard")))
+    if since is None:
+        changed = set(files)
+    else:
+        # --relative: пути относительно repo_path, как у ls-files (repo_path может быть
+        # подкаталогом репозитория git — изменения вне него не попадают в список)
+        changed = set(
+            _split_z(_git(repo_path, "diff", "-z", "--name-only", "--relative", since, head, "--"))
+        )
+        changed |= dirty
+    return GitChanges(head=head, files=files, changed=changed, dirty=dirty)
+
+
+def is_hidden(rel_path: str) -> bool:
+    """
+    Путь содержит скрытый каталог или файл (с точки в начале имени).
+    """
+    return any(part.startswith(".") for part in rel_path.split("/"))
@@ -1,13 +1,29 @@
 import os
+import json
+import time
+import asyncio
 import logging
-from typing import List, Dict, Any
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
 from importlib import import_module
 
 import httpx
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
-
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+import metrics
+from admission import DEGRADED_MODE, Overloaded, check_retrieval, get_limit, pool_limits
+from answer_cache import (
+    answer_cache_from_config,
+    completion_text,
+    completion_to_sse,
+    context_chunks,
+    conversation_scope,
+)
 from models_loader import load_app_config
+from context_builder import context_builder_from_config
+from conversation import conversation_from_config, user_turns
+from tokens import count_tokens
 from agents.agent1 import RepoSearchAgent
 from agents.agent2 import ExampleAgent
 
@@ -35,12 +51,69 @@ llm_client = httpx.AsyncClient(
     base_url=llm_cfg["api_base"],
     headers={"Authorization": f"Bearer {llm_cfg['api_key']}"} if llm_cfg["api_key"] else {},
     timeout=120.0,
+    limits=pool_limits("llm"),
     trust_env=False,
 )
 
 LLM_MODEL = llm_cfg["model"]
 
-app = FastAPI()
+# сборка итогового контекста: склейка чанков, дедупликация, бюджет токенов
+context_builder = context_builder_from_config(cfg)
+
+# дедлайн по умолчанию (в секундах) на построение контекста одним агентом;
+# переопределяется ключом `deadline` у записи агента в config.yaml
+DEFAULT_AGENT_DEADLINE = 30.0
+
+# маршрут запроса (какие коллекции/репозитории искать): из этого заголовка,
+# а если его нет — из поля `model` запроса
+ROUTE_HEADER = "X-RAG-Route"
+
+# клиент, приславший этот заголовок (любое непустое значение), получает в ответе
+# такой же заголовок с длительностями этапов (синтаксис Server-Timing)
+TIMING_HEADER = "X-RAG-Timing"
+
+# эндпоинт /metrics в формате Prometheus (секция metrics в config.yaml)
+METRICS_ENABLED = bool((cfg.get("metrics") or {}).get("enabled", True))
+
+# семантический кэш ответов LLM (секция answer_cache в config.yaml, по умолчанию выключен)
+answer_cache = answer_cache_from_config(cfg)
+
+# поиск с учётом разговора (секция conversation в config.yaml, по умолчанию выключен)
+conversation = conversation_from_config(cfg)
+
+# ответ из кэша помечается этим заголовком со значением hit
+ANSWER_CACHE_HEADER = "X-RAG-Answer-Cache"
+
+# заголовки SSE-ответа: без кэширования и буферизации на прокси
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# ответ без поиска по репозиторию (деградированный режим) помечается этим
+# заголовком со значением retrieval-skipped
+DEGRADED_HEADER = "X-RAG-Degraded"
+
+# ограничения параллельности (секция admission в config.yaml): запросы
+# /v1/chat/completions до начала ответа и вызовы LLM (для stream — на всё время потока)
+request_limit = get_limit("requests")
+llm_limit = get_limit("llm")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Старт и остановка агентов. Агент может реализовать `async def astartup()`
+    (прогрев, проверка конфигурации — исключение останавливает запуск сервера)
+    и `async def aclose()` (освобождение ресурсов).
+    """
+    for agent in agents:
+        if hasattr(agent, "astartup"):
+            await agent.astartup()
+    yield
+    for agent in agents:
+        if hasattr(agent, "aclose"):
+            await agent.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 SYSTEM_PROMPT = (
     "You are a code assistant. Use ONLY the repository context below to answer. "
@@ -52,18 +125,21 @@ SYSTEM_PROMPT = (
 async def call_llm(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
     Вызов LLM. При ошибке подключения возвращаем контролируемый JSON,
-    чтобы FastAPI не падал 500 с трейсбеком.
+    чтобы FastAPI не падал 500 с трейсбеком. Если LLM перегружена
+    (см. llm_limit), пробрасывается Overloaded — клиент получит 503.
     """
     try:
-        resp = await llm_client.post(
-            "/v1/chat/completions",
-            json={
-                "model": LLM_MODEL,
-                "messages": messages,
-            },
-        )
-        resp.raise_for_status()
-        return resp.json()
+        async with llm_limit:
+            with metrics.span("llm"):
+                resp = await llm_client.post(
+                    "/v1/chat/completions",
+                    json={
+                        "model": LLM_MODEL,
+                        "messages": messages,
+                    },
+                )
+                resp.raise_for_status()
+                return resp.json()
     except httpx.HTTPError as e:
         logger.exception("LLM request failed: %s", e)
         return {
@@ -74,6 +150,78 @@ async def call_llm(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
         }
 
 
+async def stream_llm(messages: List[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """
+    Потоковый вызов LLM (`stream: true`): SSE-поток апстрима проксируется
+    клиенту чанк за чанком, без буферизации ответа.
+
+    Следующий чанк читается из апстрима только после того, как предыдущий
+    отдан клиенту, поэтому медленный клиент притормаживает и чтение из LLM.
+    При отключении клиента Starlette отменяет генератор, и выход из
+    `llm_client.stream(...)` закрывает соединение с LLM.
+
+    Время до первого чанка пишется в метрику этапа llm_first_chunk,
+    время всего потока — llm_stream. Слот llm_limit занят до конца потока.
+    """
+    started = time.perf_counter()
+    first_chunk = True
+    try:
+        async with llm_limit:
+            async with llm_client.stream(
+                "POST",
+                "/v1/chat/completions",
+                json={
+                    "model": LLM_MODEL,
+                    "messages": messages,
+                    "stream": True,
+                },
+            ) as resp:
+                if resp.is_error:
+                    await resp.aread()
+                    resp.raise_for_status()
+                async for chunk in resp.aiter_raw():
+                    if first_chunk:
+                        metrics.record("llm_first_chunk", time.perf_counter() - started)
+                        first_chunk = False
+                    yield chunk
+        metrics.record("llm_stream", time.perf_counter() - started)
+    except Overloaded as e:
+        logger.warning("LLM streaming request rejected: %s", e)
+        for event in sse_error("overloaded", f"LLM backend is overloaded: {e}"):
+            yield event
+    except httpx.HTTPError as e:
+        logger.exception("LLM streaming request failed: %s", e)
+        for event in sse_error("llm_connection_error", f"Failed to connect to LLM backend: {e}"):
+            yield event
+
+
+def sse_error(error_type: str, message: str) -> List[bytes]:
+    """
+    Ошибка в SSE-потоке (заголовки ответа уже отправлены): событие с ошибкой и [DONE].
+    """
+    error = {"error": {"type": error_type, "message": message}}
+    return [
+        f"data: {json.dumps(error, ensure_ascii=False)}\n\n".encode("utf-8"),
+        b"data: [DONE]\n\n",
+    ]
+
+
+async def respond_llm(messages: List[Dict[str, Any]], stream: bool):
+    """
+    Отвечает клиенту: JSON целиком или SSE-поток, если клиент прислал `stream: true`.
+    """
+    if stream:
+        # пока заголовки не отправлены, при перегрузке LLM ещё можно ответить 503
+        llm_limit.check()
+        return StreamingResponse(
+            stream_llm(messages),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
+    resp = await call_llm(messages)
+    return JSONResponse(resp)
+
+
 def init_agents(app_cfg: Dict[str, Any]) -> List[Any]:
     """
     Инициализирует агентов на основе секции `agents` в config.yaml.
@@ -82,6 +230,7 @@ def init_agents(app_cfg: Dict[str, Any]) -> List[Any]:
       - name: RepoSearchAgent
         module: agents.agent1
         enabled: true
+        deadline: 10.0   # необязательно, секунды
         config: {...}
     """
     agents_cfg = app_cfg.get("agents", [])
@@ -125,6 +274,9 @@ def init_agents(app_cfg: Dict[str, Any]) -> List[Any]:
             logger.exception("Не удалось инициализировать агента %s: %s", class_name, e)
             continue
 
+        if a.get("deadline") is not None:
+            agent.deadline = float(a["deadline"])
+
         result.append(agent)
 
     return result
@@ -133,33 +285,161 @@ def init_agents(app_cfg: Dict[str, Any]) -> List[Any]:
 # Инициализируем агентов, которые будут наполнять контекст
 agents = init_agents(cfg)
 
+# эмбеддинг вопроса для кэша ответов считает агент поиска (он уже посчитан для поиска)
+embedding_agent = next((agent for agent in agents if hasattr(agent, "aembed_query")), None)
+if answer_cache is not None and embedding_agent is None:
+    logger.warning("answer_cache is enabled, but no agent provides query embeddings; disabling it")
+    answer_cache = None
+
+
+async def run_agent(
+    agent: Any, user_message: str, route: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Запускает одного агента с учётом его дедлайна и возвращает его документы.
+
+    Агенты, возвращающие документы (`async def abuild_documents`), дают
+    фрагменты с путём и диапазоном строк — их ContextBuilder склеивает и
+    дедуплицирует. Контекст-строка остальных агентов превращается в один
+    документ без пути. Агенты с асинхронным протоколом (`async def abuild_context`)
+    выполняются прямо в event loop; старые синхронные агенты (`build_context`,
+    например ExampleAgent) выносятся в пул потоков, чтобы не блокировать сервер.
+    Агенты с атрибутом `routable = True` получают маршрут запроса (`route=...`).
+    Ошибки и таймауты логируются, агент при этом просто не даёт контекста.
+    """
+    name = agent.__class__.__name__
+    deadline = getattr(agent, "deadline", DEFAULT_AGENT_DEADLINE)
+    started = time.perf_counter()
+
+    kwargs = {"route": route} if getattr(agent, "routable", False) else {}
+    if hasattr(agent, "abuild_documents"):
+        coro = agent.abuild_documents(user_message, **kwargs)
+    elif hasattr(agent, "abuild_context"):
+        coro = agent.abuild_context(user_message, **kwargs)
+    else:
+        coro = asyncio.to_thread(agent.build_context, user_message)
+
+    try:
+        result = await asyncio.wait_for(coro, timeout=deadline)
+    except Overloaded:
+        # решение (деградированный режим или 503) принимает retrieve
+        raise
+    except asyncio.TimeoutError:
+        logger.warning("Agent %s exceeded deadline of %.1fs, skipping its context", name, deadline)
+        return []
+    except Exception as e:
+        logger.exception("Agent %s failed to build context: %s", name, e)
+        return []
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.AGENT_SECONDS.observe(elapsed, agent=name)
+        timings = metrics.current_timings()
+        if timings is not None:
+            timings.add(f"agent.{name}", elapsed)
+
+    if isinstance(result, str):
+        return [{"path": None, "text": result, "source": name}] if result else []
+    return list(result or [])
+
+
+def observe_prompt(context_text: str, messages: List[Dict[str, Any]]) -> None:
+    """
+    Размеры контекста и итогового промпта (токены и байты) — в гистограммы.
+    """
+    metrics.CONTEXT_TOKENS.observe(count_tokens(context_text))
+    metrics.CONTEXT_BYTES.observe(len(context_text.encode("utf-8")))
+    metrics.PROMPT_TOKENS.observe(
+        sum(count_tokens(m.get("content") or "") for m in messages if isinstance(m.get("content"), str))
+    )
+    metrics.PROMPT_BYTES.observe(len(json.dumps(messages, ensure_ascii=False).encode("utf-8")))
+
+
+async def retrieve(query: str, route: Optional[str]) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Документы от всех агентов (параллельно, порядок агентов сохраняется)
+    и признак деградированного режима.
+
+    Если сервис эмбеддингов или хранилище векторов перегружены (очередь их
+    ограничения полна или ожидание в ней истекло), поиск пропускается и
+    ответ строится без контекста из репозитория. С `admission.degraded_mode:
+    false` перегрузка пробрасывается, и клиент получает 503.
+    """
+    try:
+        check_retrieval()
+        results = await asyncio.gather(*(run_agent(agent, query, route) for agent in agents))
+    except Overloaded as e:
+        if not DEGRADED_MODE:
+            raise
+        logger.warning("Retrieval skipped, answering without repository context: %s", e)
+        metrics.DEGRADED_REQUESTS.inc()
+        return [], True
+    return [doc for docs in results for doc in docs], False
+
+
+def overloaded_response(e: Overloaded) -> Response:
+    """
+    Быстрый отказ с Retry-After: 429, если переполнена очередь самих запросов,
+    503 — если истекло ожидание в ней или перегружен бэкенд.
+    """
+    status = 429 if e.limit == "requests" and e.reason == "queue_full" else 503
+    return JSONResponse(
+        {"error": {"type": "overloaded", "message": f"Server is overloaded: {e}"}},
+        status_code=status,
+        headers={"Retry-After": e.retry_after_header},
+    )
+
 
 @app.post("/v1/chat/completions")
 async def chat_completions(request: Request):
+    timings = metrics.start_timings()
+    try:
+        # слот занят до начала ответа; поток ответа LLM ограничивает llm_limit
+        async with request_limit:
+            response = await answer_chat(request)
+    except Overloaded as e:
+        response = overloaded_response(e)
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - timings.started)
+    if request.headers.get(TIMING_HEADER):
+        response.headers[TIMING_HEADER] = timings.header_value()
+    return response
+
+
+async def answer_chat(request: Request):
     body = await request.json()
     messages = body.get("messages", [])
+    stream = bool(body.get("stream", False))
     user_msg = ""
+    user_entry: Optional[Dict[str, Any]] = None
     for m in reversed(messages):
         if m.get("role") == "user":
             user_msg = m.get("content", "")
+            user_entry = m
             break
 
     # Если нет пользовательского сообщения — просто проксируем в LLM
     if not user_msg:
-        resp = await call_llm(messages)
-        return JSONResponse(resp)
+        return await respond_llm(messages, stream)
 
-    # Собираем контекст от всех агентов
-    context_parts: List[str] = []
-    for agent in agents:
-        try:
-            ctx = agent.build_context(user_msg)
-            if ctx:
-                context_parts.append(ctx)
-        except Exception as e:
-            logger.exception("Agent %s failed to build context: %s", agent.__class__.__name__, e)
+    route = request.headers.get(ROUTE_HEADER) or body.get("model")
+
+    # в режиме разговора документы прошлых ходов берутся из кэша разговора,
+    # а без них запрос строится из последних реплик пользователя
+    query = user_msg
+    prior: List[Dict[str, Any]] = []
+    turns = user_turns(messages) if conversation is not None else []
+    if turns:
+        prior = conversation.prior_documents(turns, route or "")
+        query = conversation.search_query(turns, prior)
+        metrics.CONVERSATION_TURNS.inc(context="reused" if prior else "fresh")
 
-    context_text = "\n\n".join(context_parts) if context_parts else ""
+    documents, degraded = await retrieve(query, route)
+    if turns:
+        documents = conversation.merge(prior, documents)
+        if not degraded:
+            conversation.remember(turns, route or "", documents)
+
+    with metrics.span("context"):
+        context_text = context_builder.build(documents)
 
     new_messages: List[Dict[str, Any]] = [
         {"role": "system", "content": SYSTEM_PROMPT},
@@ -174,11 +454,73 @@ async def chat_completions(request: Request):
         )
 
     new_messages.extend(messages)
-
-    resp = await call_llm(new_messages)
+    observe_prompt(context_text, new_messages)
+
+    if degraded:
+        # ответ без поиска не кэшируем: у похожего вопроса позже будет полный контекст
+        response = await respond_llm(new_messages, stream)
+        response.headers[DEGRADED_HEADER] = "retrieval-skipped"
+        return response
+    if answer_cache is None:
+        return await respond_llm(new_messages, stream)
+    scope = conversation_scope(messages, user_entry, route or "")
+    return await respond_cached(new_messages, stream, query, scope, documents)
+
+
+async def respond_cached(
+    messages: List[Dict[str, Any]],
+    stream: bool,
+    user_message: str,
+    scope: str,
+    documents: List[Dict[str, Any]],
+):
+    """
+    respond_llm через семантический кэш ответов: если похожий вопрос с тем же
+    найденным контекстом уже задавался в этом разговоре, ответ LLM берётся
+    из кэша (для `stream: true` — в виде SSE-потока). В кэш попадают только
+    ответы, полученные целиком (без `stream`).
+    """
+    fingerprint, chunks = context_chunks(documents)
+    with metrics.span("answer_cache"):
+        metrics.ANSWER_CACHE_INVALIDATED.inc(answer_cache.observe(chunks))
+        try:
+            embedding = await embedding_agent.aembed_query(user_message)
+        except Exception as e:
+            logger.warning("Answer cache skipped, failed to embed the question: %s", e)
+            embedding = None
+        cached = answer_cache.get(scope, embedding, fingerprint) if embedding is not None else None
+
+    if cached is not None:
+        metrics.ANSWER_CACHE_REQUESTS.inc(result="hit")
+        if stream:
+            response: Response = StreamingResponse(
+                iter(completion_to_sse(cached)), media_type="text/event-stream", headers=SSE_HEADERS
+            )
+        else:
+            response = JSONResponse(cached)
+        response.headers[ANSWER_CACHE_HEADER] = "hit"
+        return response
+
+    metrics.ANSWER_CACHE_REQUESTS.inc(result="miss")
+    if stream or embedding is None:
+        return await respond_llm(messages, stream)
+    resp = await call_llm(messages)
+    if "error" not in resp and completion_text(resp):
+        answer_cache.set(scope, embedding, fingerprint, chunks, resp)
     return JSONResponse(resp)
 
 
+async def metrics_endpoint() -> Response:
+    """
+    Метрики процесса в текстовом формате Prometheus.
+    """
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+if METRICS_ENABLED:
+    app.add_api_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,38 @@
+import os
+import sys
+import shutil
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# admission.py, embedder.py и index_repo.py читают config.yaml из текущего
+# каталога при импорте, поэтому тесты работают во временном каталоге
+# с минимальным конфигом (сервисы не нужны: тесты в них не ходят)
+TEST_CONFIG = """\
+llm:
+  api_base: http://127.0.0.1:9
+  model: test-llm
+embedding:
+  api_base: http://127.0.0.1:9
+  model: test-embedding
+  cache:
+    enabled: false
+agents: []
+"""
+
+_cwd = os.getcwd()
+_workdir = ""
+
+
+def pytest_configure(config):
+    global _workdir
+    _workdir = tempfile.mkdtemp(prefix="rag-tests-")
+    Path(_workdir, "config.yaml").write_text(TEST_CONFIG, encoding="utf-8")
+    os.chdir(_workdir)
+
+
+def pytest_unconfigure(config):
+    os.chdir(_cwd)
+    shutil.rmtree(_workdir, ignore_errors=True)
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from admission import ConcurrencyLimit, Overloaded
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_unlimited_never_waits():
+    async def main():
+        limit = ConcurrencyLimit("test")
+        for _ in range(100):
+            await limit.acquire()
+        assert limit.active == 100
+        assert not limit.saturated
+
+    run(main())
+
+
+def test_queue_is_fifo_and_slot_is_handed_over():
+    async def main():
+        limit = ConcurrencyLimit("test", max_concurrent=1, max_queue=3)
+        order = []
+
+        async def worker(i):
+            async with limit:
+                order.append(i)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(worker(i) for i in range(4)))
+        assert order == [0, 1, 2, 3]
+        assert limit.active == 0
+        assert limit.waiting == 0
+
+    run(main())
+
+
+def test_full_queue_is_rejected_immediately():
+    async def main():
+        limit = ConcurrencyLimit("test", max_concurrent=1, max_queue=1)
+        await limit.acquire()
+        waiter = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0)
+        assert limit.saturated
+        with pytest.raises(Overloaded) as exc:
+            await limit.acquire()
+        assert exc.value.reason == "queue_full"
+        with pytest.raises(Overloaded):
+            limit.check()
+
+        limit.release()
+        await waiter
+        assert limit.active == 1
+        limit.release()
+        assert limit.active == 0
+
+    run(main())
+
+
+def test_queue_timeout():
+    async def main():
+        limit = ConcurrencyLimit("test", max_concurrent=1, max_queue=1, queue_timeout=0.01)
+        await limit.acquire()
+        with pytest.raises(Overloaded) as exc:
+            await limit.acquire()
+        assert exc.value.reason == "timeout"
+        assert limit.waiting == 0
+        limit.release()
+        assert limit.active == 0
+
+    run(main())
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def main():
+        limit = ConcurrencyLimit("test", max_concurrent=1, max_queue=2)
+        await limit.acquire()
+        waiter = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limit.waiting == 0
+        limit.release()
+        assert limit.active == 0
+
+        # слот уже передан ожидающему, но его отменили до того, как он проснулся
+        await limit.acquire()
+        waiter = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0)
+        limit.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limit.active == 0
+
+    run(main())
+
+
+def test_retry_after_header_is_whole_seconds():
+    error = Overloaded("test", "queue_full")
+    error.retry_after = 0.2
+    assert error.retry_after_header == "1"
+    error.retry_after = 2.5
+    assert error.retry_after_header == "3"
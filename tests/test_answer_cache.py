@@ -0,0 +1,71 @@
+import time
+
+from answer_cache import AnswerCache, context_chunks, conversation_scope
+
+RESPONSE = {"choices": [{"message": {"role": "assistant", "content": "42"}}]}
+
+
+def docs(text="port: 80"):
+    return [
+        {"path": "a.yaml", "id": "a0", "text": text},
+        {"path": None, "text": "agent context"},
+    ]
+
+
+def cached(cache, scope="s", embedding=(1.0, 0.0), documents=None):
+    fingerprint, chunks = context_chunks(documents or docs())
+    cache.observe(chunks)
+    return cache.get(scope, embedding, fingerprint)
+
+
+def store(cache, scope="s", embedding=(1.0, 0.0), documents=None):
+    fingerprint, chunks = context_chunks(documents or docs())
+    cache.set(scope, embedding, fingerprint, chunks, RESPONSE)
+
+
+def test_similarity_threshold():
+    cache = AnswerCache(threshold=0.95)
+    store(cache)
+    # косинус 0.98 и 0.89
+    assert cached(cache, embedding=(5.0, 1.0)) == RESPONSE
+    assert cached(cache, embedding=(2.0, 1.0)) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = AnswerCache(ttl=60.0)
+    store(cache)
+    now[0] += 59.0
+    assert cached(cache) == RESPONSE
+    now[0] += 2.0
+    assert cached(cache) is None
+    assert len(cache) == 0
+
+
+def test_context_mismatch_misses():
+    cache = AnswerCache()
+    store(cache)
+    assert cached(cache, documents=docs()[:1]) is None
+    assert cached(cache, documents=docs() + [{"path": "b.md", "id": "b0", "text": "b"}]) is None
+    assert cached(cache, scope="other") is None
+    assert cached(cache) == RESPONSE
+
+
+def test_reindexed_file_invalidates_entries():
+    cache = AnswerCache()
+    store(cache)
+    assert cached(cache, documents=docs("port: 8080")) is None
+    assert cache.invalidated == 1
+    assert cached(cache) is None
+
+
+def test_conversation_scope_ignores_only_the_last_question():
+    question = {"role": "user", "content": "and the port?"}
+    history = [{"role": "user", "content": "nginx config"}, {"role": "assistant", "content": "ok"}]
+    scope = conversation_scope(history + [question], question, "repo")
+    other_question = {"role": "user", "content": "and the user?"}
+    assert scope == conversation_scope(history + [other_question], other_question, "repo")
+    assert scope != conversation_scope(history + [question], question, "docs")
+    assert scope != conversation_scope(history[:1] + [question], question, "repo")
@@ -0,0 +1,71 @@
+from chunker import Chunker
+from tokens import count_tokens
+
+
+def numbered_lines(text):
+    return dict(enumerate(text.splitlines(keepends=True), 1))
+
+
+def test_small_file_is_one_chunk():
+    text = "# Title\n\nsome text\nmore text\n"
+    chunks = Chunker(max_tokens=512).chunk_text(text, ".md")
+    assert len(chunks) == 1
+    assert chunks[0].text == text
+    assert (chunks[0].start_line, chunks[0].end_line) == (1, 4)
+
+
+def test_chunks_fit_max_tokens_and_match_line_ranges():
+    text = "".join(f"key_{i}: value number {i} with some words\n" for i in range(200))
+    chunker = Chunker(max_tokens=64, overlap_tokens=16)
+    chunks = chunker.chunk_text(text, ".txt")
+    lines = numbered_lines(text)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.tokens <= chunker.max_tokens
+        assert chunk.text == "".join(lines[n] for n in range(chunk.start_line, chunk.end_line + 1))
+    assert chunks[0].start_line == 1
+    assert chunks[-1].end_line == len(lines)
+
+
+def test_overlap_repeats_lines_between_chunks():
+    text = "".join(f"line {i} of a long paragraph without breaks\n" for i in range(100))
+    chunks = Chunker(max_tokens=64, overlap_tokens=16).chunk_text(text, ".txt")
+    assert any(b.start_line <= a.end_line for a, b in zip(chunks, chunks[1:]))
+
+    chunks = Chunker(max_tokens=64, overlap_tokens=0).chunk_text(text, ".txt")
+    assert "".join(chunk.text for chunk in chunks) == text
+    assert all(b.start_line == a.end_line + 1 for a, b in zip(chunks, chunks[1:]))
+
+
+def test_markdown_chunks_start_at_headings():
+    sections = [f"# Section {i}\n" + "word " * 40 + "\n\n" for i in range(6)]
+    text = "".join(sections)
+    chunks = Chunker(max_tokens=128, overlap_tokens=0).chunk_text(text, ".md")
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.text.startswith("# Section")
+
+
+def test_yaml_comment_moves_with_next_key():
+    text = "first:\n" + "  - item\n" * 40 + "# about second\nsecond:\n  value: 1\n"
+    chunks = Chunker(max_tokens=64, overlap_tokens=0).chunk_text(text, ".yaml")
+    last = chunks[-1]
+    assert last.text.startswith("# about second\nsecond:")
+
+
+def test_long_line_is_split_into_pieces_of_that_line():
+    long_line = "x" * 2000 + "\n"
+    text = "before\n" + long_line + "after\n"
+    chunker = Chunker(max_tokens=32, overlap_tokens=0)
+    chunks = chunker.chunk_text(text, ".txt")
+    pieces = [chunk for chunk in chunks if chunk.start_line == chunk.end_line == 2]
+    assert len(pieces) > 1
+    assert "".join(piece.text for piece in pieces) == long_line
+    assert all(count_tokens(piece.text) <= chunker.max_tokens for piece in pieces)
+    assert chunks[0].text == "before\n"
+    assert chunks[-1].text == "after\n"
+
+
+def test_signature_depends_on_parameters():
+    assert Chunker(max_tokens=256).signature != Chunker(max_tokens=512).signature
+    assert Chunker(max_tokens=256).signature == Chunker(max_tokens=256).signature
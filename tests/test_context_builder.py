@@ -0,0 +1,109 @@
+import random
+
+from chunker import Chunker
+from context_builder import ContextBuilder
+from tokens import count_tokens
+
+
+def doc(path, start, end, text, score=1.0, chunk_index=None):
+    return {
+        "path": path,
+        "start_line": start,
+        "end_line": end,
+        "text": text,
+        "score": score,
+        "chunk_index": chunk_index,
+    }
+
+
+def file_docs(text, chunker, path="f.txt"):
+    return [
+        doc(path, chunk.start_line, chunk.end_line, chunk.text, chunk_index=i)
+        for i, chunk in enumerate(chunker.chunk_text(text, ".txt"))
+    ]
+
+
+def test_merge_joins_overlapping_and_adjacent_chunks():
+    builder = ContextBuilder()
+    docs = [
+        doc("a", 3, 4, "l3\nl4\n", score=0.5),
+        doc("a", 1, 3, "l1\nl2\nl3\n", score=0.9),
+        doc("a", 5, 5, "l5\n", score=0.1),
+    ]
+    merged = builder._merge(docs)
+    assert len(merged) == 1
+    assert merged[0]["text"] == "l1\nl2\nl3\nl4\nl5\n"
+    assert (merged[0]["start_line"], merged[0]["end_line"]) == (1, 5)
+    assert merged[0]["score"] == 0.9
+    assert "_rank" not in merged[0] and "_last_chunk" not in merged[0]
+
+
+def test_merge_keeps_gaps_and_order_by_relevance():
+    builder = ContextBuilder()
+    docs = [
+        doc("b", 10, 10, "b10\n"),
+        doc("a", 1, 1, "a1\n"),
+        doc("b", 1, 1, "b1\n"),
+    ]
+    merged = builder._merge(docs)
+    assert [(d["path"], d["start_line"]) for d in merged] == [("b", 10), ("a", 1), ("b", 1)]
+
+
+def test_merge_leaves_documents_without_lines_alone():
+    builder = ContextBuilder()
+    docs = [{"path": None, "text": "agent context"}, doc("a", 1, 1, "a1\n")]
+    merged = builder._merge(docs)
+    assert merged[0] == {"path": None, "text": "agent context"}
+    assert merged[1]["text"] == "a1\n"
+
+
+def test_merge_restores_split_long_line():
+    text = "before\n" + "y" * 1500 + "\n" + "after\n"
+    docs = file_docs(text, Chunker(max_tokens=32, overlap_tokens=0))
+    assert len(docs) > 3
+    random.Random(1).shuffle(docs)
+    merged = ContextBuilder()._merge(docs)
+    assert len(merged) == 1
+    assert merged[0]["text"] == text
+    assert (merged[0]["start_line"], merged[0]["end_line"]) == (1, 3)
+
+
+def test_merge_keeps_non_adjacent_pieces_of_long_line_apart():
+    text = "z" * 1500 + "\n"
+    docs = file_docs(text, Chunker(max_tokens=32, overlap_tokens=0))
+    chosen = [docs[0], docs[2]]
+    merged = ContextBuilder()._merge(chosen)
+    assert [d["text"] for d in merged] == [docs[0]["text"], docs[2]["text"]]
+
+
+def test_merge_with_overlapping_chunks_reproduces_file():
+    text = "".join(f"line {i} with a few words\n" for i in range(120))
+    docs = file_docs(text, Chunker(max_tokens=48, overlap_tokens=16))
+    random.Random(2).shuffle(docs)
+    merged = ContextBuilder()._merge(docs)
+    assert len(merged) == 1
+    assert merged[0]["text"] == text
+
+
+def test_select_drops_duplicates():
+    builder = ContextBuilder(max_tokens=1000)
+    body = "".join(f"word{i} " for i in range(30)) + "\n"
+    docs = [
+        doc("a", 1, 1, body),
+        doc("vendor/a", 1, 1, body),
+        doc("c", 1, 3, "c1\nc2\nc3\n"),
+    ]
+    assert [d["path"] for d in builder.select(docs)] == ["a", "c"]
+
+
+def test_select_fits_budget_truncating_by_lines():
+    builder = ContextBuilder(max_tokens=300, dedup_threshold=1.0)
+    first = "".join(f"first {i} alpha beta gamma\n" for i in range(30))
+    second = "".join(f"second {i} delta epsilon zeta\n" for i in range(60))
+    selected = builder.select([doc("a", 1, 30, first), doc("b", 1, 60, second)])
+    assert selected[0]["text"] == first
+    assert len(selected) == 2
+    truncated = selected[1]
+    assert second.startswith(truncated["text"]) and truncated["text"] != second
+    assert truncated["end_line"] == len(truncated["text"].splitlines())
+    assert sum(count_tokens(d["text"]) for d in selected) <= builder.max_tokens
@@ -0,0 +1,75 @@
+from conversation import ConversationContext, user_turns
+from tokens import count_tokens
+
+
+def doc(path, i, words=20):
+    return {"path": path, "id": f"{path}#{i}", "text": f"{path} chunk {i} " + "word " * words}
+
+
+def tokens(docs):
+    return sum(count_tokens(d["text"]) for d in docs)
+
+
+def test_user_turns_skip_other_roles_and_empty_messages():
+    messages = [
+        {"role": "system", "content": "be brief"},
+        {"role": "user", "content": "nginx config"},
+        {"role": "assistant", "content": "see profile::nginx"},
+        {"role": "user", "content": [{"type": "image_url"}]},
+        {"role": "user", "content": ""},
+        {"role": "user", "content": "and the port?"},
+    ]
+    assert user_turns(messages) == ["nginx config", "and the port?"]
+
+
+def test_search_query_uses_recent_turns_without_prior_documents():
+    conv = ConversationContext(query_turns=2, max_query_chars=30)
+    turns = ["first question", "nginx config", "and the port?"]
+    assert conv.search_query(turns, []) == "nginx config\nand the port?"
+    assert conv.search_query(turns, [doc("a", 0)]) == "and the port?"
+    # длинный запрос теряет начало, а не текущую реплику
+    long_turns = ["x" * 100, "where is the port set?"]
+    assert conv.search_query(long_turns, []) == ("x" * 100 + "\nwhere is the port set?")[-30:]
+
+
+def test_prior_documents_are_carried_to_next_turn():
+    conv = ConversationContext(carry_tokens=10_000)
+    first = [doc("a", 0), {"path": None, "text": "agent context"}]
+    conv.remember(["nginx config"], "repo", first)
+    assert conv.prior_documents(["nginx config"], "repo") == []
+    assert conv.prior_documents(["nginx config", "port?"], "repo") == first[:1]
+    assert conv.prior_documents(["nginx config", "port?"], "other") == []
+    assert conv.prior_documents(["other topic", "port?"], "repo") == []
+
+
+def test_remember_keeps_newest_documents_within_carry_budget():
+    docs = [doc("a", i) for i in range(5)]
+    conv = ConversationContext(carry_tokens=tokens(docs[:2]))
+    conv.remember(["q1"], "repo", docs)
+    assert conv.prior_documents(["q1", "q2"], "repo") == docs[3:]
+
+
+def test_merge_puts_prior_first_and_drops_duplicates():
+    conv = ConversationContext(context_tokens=10_000)
+    prior = [doc("a", 0), doc("a", 1)]
+    new = [doc("b", 0), dict(doc("a", 1)), {"path": None, "text": "agent context"}]
+    merged = conv.merge(prior, new)
+    assert [d.get("id") for d in merged] == ["a#0", "a#1", "b#0", None]
+
+
+def test_merge_gives_budget_to_new_documents_first():
+    new = [doc("b", 0), doc("b", 1)]
+    prior = [doc("a", i) for i in range(4)]
+    conv = ConversationContext(context_tokens=tokens(new) + tokens(prior[:2]))
+    merged = conv.merge(prior, new)
+    # из прошлых ходов остаются самые новые документы, помещающиеся в остаток
+    assert [d["id"] for d in merged] == ["a#2", "a#3", "b#0", "b#1"]
+    assert tokens(merged) <= conv.context_tokens
+
+    # документ, найденный снова, остаётся на прежнем месте и бюджет повторно не занимает
+    again = [doc("b", 0), doc("a", 3)]
+    conv = ConversationContext(context_tokens=tokens(again))
+    assert [d["id"] for d in conv.merge(prior, again)] == ["a#3", "b#0"]
+
+    conv = ConversationContext(context_tokens=tokens(new))
+    assert conv.merge(prior, new) == new
@@ -0,0 +1,126 @@
+import json
+
+import httpx
+import numpy as np
+import pytest
+
+import embedder
+from embedder import AdaptiveBatchLimit, BatchTooLargeError, get_embeddings
+
+
+def embedding(text):
+    return [float(len(text)), 1.0]
+
+
+def ok(texts):
+    data = [{"index": i, "embedding": embedding(t)} for i, t in enumerate(texts)]
+    return httpx.Response(200, json={"data": data})
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """
+    Сервис эмбеддингов на httpx.MockTransport: service.handler(texts) -> ответ,
+    service.batches — тексты каждого запроса, service.sleeps — паузы между повторами.
+    """
+
+    class Service:
+        handler = staticmethod(ok)
+        batches = []
+        sleeps = []
+
+    def handle(request):
+        texts = json.loads(request.content)["input"]
+        Service.batches.append(texts)
+        return Service.handler(texts)
+
+    client = httpx.Client(base_url="http://embeddings", transport=httpx.MockTransport(handle))
+    monkeypatch.setattr(embedder, "_client", client)
+    monkeypatch.setattr(embedder, "batch_limit", AdaptiveBatchLimit(initial_tokens=1000))
+    monkeypatch.setattr(embedder.time, "sleep", Service.sleeps.append)
+    yield Service
+    client.close()
+
+
+def test_batch_limit_grows_additively_and_shrinks_multiplicatively():
+    limit = AdaptiveBatchLimit(
+        initial_tokens=1000, min_tokens=100, max_tokens=1600, target_latency=1.0, step_tokens=200
+    )
+    limit.on_success(900, 0.1)
+    assert limit.tokens == 1200
+    # маленький батч не говорит о пределе сервиса
+    limit.on_success(100, 0.1)
+    assert limit.tokens == 1200
+    for _ in range(5):
+        limit.on_success(1600, 0.1)
+    assert limit.tokens == 1600
+
+    limit.on_success(1600, 2.0)
+    assert limit.tokens == 1066
+    limit.on_error()
+    assert limit.tokens == 533
+    limit.on_too_large(400)
+    assert limit.tokens == 200
+    for _ in range(5):
+        limit.on_error()
+    assert limit.tokens == 100
+
+
+def test_retry_delay_is_jittered_and_honours_retry_after(monkeypatch):
+    monkeypatch.setattr(embedder, "RETRY_BACKOFF", 0.5)
+    monkeypatch.setattr(embedder, "RETRY_BACKOFF_MAX", 30.0)
+    for attempt in range(8):
+        assert 0 <= embedder._retry_delay(attempt) <= min(30.0, 0.5 * 2**attempt)
+    assert embedder._retry_delay(0, "7") >= 7.0
+    assert embedder._retry_delay(0, "3600") == 30.0
+    assert embedder._retry_delay(0, "Wed, 21 Oct 2015 07:28:00 GMT") <= 0.5
+
+
+def test_retries_temporary_errors(service):
+    responses = iter([httpx.Response(503), httpx.Response(429, headers={"Retry-After": "2"})])
+    service.handler = lambda texts: next(responses, None) or ok(texts)
+
+    vectors = get_embeddings(["alpha", "beta"])
+    assert vectors.tolist() == [embedding("alpha"), embedding("beta")]
+    assert len(service.batches) == 3
+    assert service.sleeps[1] >= 2.0
+    # каждая ошибка вдвое уменьшила лимит
+    assert embedder.batch_limit.tokens < 1000
+
+
+def test_gives_up_after_max_retries(service, monkeypatch):
+    monkeypatch.setattr(embedder, "MAX_RETRIES", 2)
+    service.handler = lambda texts: httpx.Response(500)
+    with pytest.raises(httpx.HTTPStatusError):
+        get_embeddings(["alpha"])
+    assert len(service.batches) == 3
+
+
+def test_too_large_batch_is_split(service):
+    def handler(texts):
+        if len(texts) > 2:
+            return httpx.Response(413)
+        return ok(texts)
+
+    service.handler = handler
+    texts = [f"text {i}" * (i + 1) for i in range(5)]
+    vectors = get_embeddings(texts)
+    assert vectors.tolist() == [embedding(t) for t in texts]
+    assert [len(b) for b in service.batches] == [5, 2, 3, 1, 2]
+    assert service.sleeps == []
+    assert embedder.batch_limit.tokens < 1000
+
+
+def test_context_length_error_is_split_but_single_text_fails(service):
+    service.handler = lambda texts: httpx.Response(
+        400, text="This model's maximum context length is 8192 tokens"
+    )
+    with pytest.raises(BatchTooLargeError):
+        get_embeddings(["a" * 100, "b" * 100])
+    assert [len(b) for b in service.batches] == [2, 1]
+
+
+def test_duplicate_texts_are_sent_once(service):
+    vectors = get_embeddings(["same", "other", "same"])
+    assert service.batches == [["same", "other"]]
+    assert np.array_equal(vectors[0], vectors[2])
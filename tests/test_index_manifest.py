@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+
+import index_repo
+from index_repo import IndexManifest, ensure_collection
+from lexical_index import build_lexical_index
+from vector_store import LocalStore
+
+
+def entry(sha256="aaa", mtime_ns=1, size=10, chunks=2):
+    return {"mtime_ns": mtime_ns, "size": size, "sha256": sha256, "chunks": chunks}
+
+
+def test_records_survive_reload(tmp_path):
+    path = tmp_path / "manifest.jsonl"
+    manifest = IndexManifest(path, signature="v1")
+    manifest.record("a.md", entry())
+    manifest.record("b.md", entry(sha256="bbb"))
+    manifest.record("a.md", entry(sha256="ccc"))
+    manifest.remove("b.md")
+    manifest.set_meta(git_commit="abc")
+
+    reloaded = IndexManifest(path, signature="v1")
+    assert set(reloaded.entries) == {"a.md"}
+    assert reloaded.get("a.md")["sha256"] == "ccc"
+    assert reloaded.meta == {"git_commit": "abc"}
+
+
+def test_compact_keeps_one_record_per_file(tmp_path):
+    path = tmp_path / "manifest.jsonl"
+    manifest = IndexManifest(path, signature="v1")
+    for i in range(5):
+        manifest.record("a.md", entry(sha256=str(i)))
+    manifest.remove("gone.md")
+    manifest.set_meta(git_commit="abc")
+    manifest.compact()
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 2
+    reloaded = IndexManifest(path, signature="v1")
+    assert reloaded.get("a.md")["sha256"] == "4"
+    assert reloaded.meta == {"git_commit": "abc"}
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    path = tmp_path / "manifest.jsonl"
+    manifest = IndexManifest(path, signature="v1")
+    manifest.record("a.md", entry())
+    with path.open("a", encoding="utf-8") as f:
+        f.write('{"path": "b.md", "sha2')
+
+    reloaded = IndexManifest(path, signature="v1")
+    assert set(reloaded.entries) == {"a.md"}
+
+
+def test_unchanged_checks_stat_and_signature(tmp_path):
+    fpath = tmp_path / "a.md"
+    fpath.write_text("hello\n", encoding="utf-8")
+    st = os.stat(fpath)
+    path = tmp_path / "manifest.jsonl"
+    manifest = IndexManifest(path, signature="v1")
+    manifest.record("a.md", entry(mtime_ns=st.st_mtime_ns, size=st.st_size))
+
+    assert manifest.is_unchanged("a.md", st)
+    assert manifest.has_content("a.md", "aaa")
+    assert not manifest.has_content("a.md", "other")
+    assert not manifest.is_unchanged("missing.md", st)
+
+    # записи другого чанкера считаются устаревшими
+    other = IndexManifest(path, signature="v2")
+    assert not other.is_unchanged("a.md", st)
+    assert not other.has_content("a.md", "aaa")
+
+
+def test_recreated_collection_resets_manifest(tmp_path, monkeypatch):
+    lexical_dir = tmp_path / "lexical"
+    monkeypatch.setattr(index_repo, "LEXICAL_INDEX_PATH", str(lexical_dir))
+    monkeypatch.setattr(index_repo, "get_embeddings", lambda texts: np.zeros((len(texts), 8)))
+    path = tmp_path / "manifest.jsonl"
+    manifest = IndexManifest(path, signature="v1")
+    manifest.record("a.md", entry())
+    manifest.set_meta(git_commit="abc")
+    build_lexical_index([("a0", "a.md", "hello")], lexical_dir)
+
+    # коллекция удалена (или сменилось хранилище), манифест остался
+    store = LocalStore(tmp_path / "store")
+    assert ensure_collection(store, manifest, index_repo.COLLECTION_NAME)
+    assert store.info(index_repo.COLLECTION_NAME) == {"points_count": 0, "vector_size": 8}
+    assert manifest.entries == {} and manifest.meta == {}
+    reloaded = IndexManifest(path, signature="v1")
+    assert reloaded.entries == {} and reloaded.meta == {}
+    assert not lexical_dir.exists()
+
+    # существующая коллекция манифест не трогает
+    manifest.record("a.md", entry())
+    assert not ensure_collection(store, manifest, index_repo.COLLECTION_NAME)
+    assert set(IndexManifest(path, signature="v1").entries) == {"a.md"}
@@ -0,0 +1,47 @@
+import threading
+
+import index_repo
+from index_repo import IndexManifest, IndexPipeline
+from vector_store import LocalStore
+
+
+def test_chunker_failure_stops_pipeline(tmp_path, monkeypatch):
+    def broken_pool(*args, **kwargs):
+        raise OSError("cannot start worker processes")
+
+    monkeypatch.setattr(index_repo, "ProcessPoolExecutor", broken_pool)
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    files = []
+    for i in range(6):
+        fpath = repo / f"f{i}.md"
+        fpath.write_text(f"# file {i}\n", encoding="utf-8")
+        files.append((fpath, fpath.name, False, fpath.stat()))
+
+    store = LocalStore(tmp_path / "store")
+    store.create_collection("c", 8)
+    pipeline = IndexPipeline(
+        store,
+        IndexManifest(tmp_path / "manifest.jsonl"),
+        total_files=len(files),
+        workers=2,
+        inflight=1,
+        collection="c",
+        processes=1,
+    )
+    errors = []
+
+    def run():
+        try:
+            pipeline.run(files)
+        except Exception as e:
+            errors.append(e)
+
+    # reader не должен зависнуть на полной очереди, воркеры — без _STOP
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+    assert not thread.is_alive()
+    assert [str(e) for e in errors] == ["cannot start worker processes"]
+    assert pipeline.indexed_files == 0
+    assert pipeline.manifest.get("f0.md") is None
@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+from agents.agent1 import RepoSearchAgent
+from lexical_index import (
+    LexicalIndex,
+    build_lexical_index,
+    indexed_docs,
+    read_delta,
+    tokenize,
+    update_lexical_index,
+)
+from vector_store import LocalStore
+
+DOCS = {
+    "manifests/nginx.pp": [
+        ("n0", "class profile::nginx { $worker_processes = 4 }"),
+        ("n1", "nginx::vhost { 'default': port => 80 }"),
+    ],
+    "hiera/common.yaml": [("h0", "app.db.port: 5432\napp.db.host: db01")],
+    "README.md": [("r0", "How to deploy the web tier with puppet")],
+}
+
+
+def records(docs):
+    return [(pid, path, text) for path, items in docs.items() for pid, text in items]
+
+
+def ids(hits):
+    return [h["id"] for h in hits]
+
+
+def test_tokenize_keeps_identifiers_and_parts():
+    assert tokenize("include profile::nginx; $app.db.port") == [
+        "include",
+        "profile::nginx",
+        "profile",
+        "nginx",
+        "app.db.port",
+        "app",
+        "db",
+        "port",
+    ]
+
+
+def test_build_and_search(tmp_path):
+    index_dir = tmp_path / "lex"
+    assert build_lexical_index(records(DOCS), index_dir) == 4
+    assert indexed_docs(index_dir) == 4
+
+    index = LexicalIndex.open(index_dir)
+    assert index.df("nginx") == 2
+    assert ids(index.search("profile::nginx", 3))[0] == "n0"
+    hits = index.search("app.db.host", 3)
+    assert hits[0] == {"id": "h0", "path": "hiera/common.yaml", "score": hits[0]["score"]}
+    assert index.search("kubernetes", 3) == []
+    assert LexicalIndex.open(tmp_path / "missing") is None
+
+
+def test_delta_masks_and_readds_documents(tmp_path):
+    index_dir = tmp_path / "lex"
+    build_lexical_index(records(DOCS), index_dir)
+    stamp = LexicalIndex.stamp(index_dir)
+
+    # nginx.pp переписан, README удалён
+    changes = {
+        "manifests/nginx.pp": [("n2", "class profile::haproxy { balance => roundrobin }")],
+        "README.md": [],
+    }
+    assert update_lexical_index(index_dir, changes) == 1
+    assert read_delta(index_dir) == changes
+    assert LexicalIndex.stamp(index_dir) != stamp
+
+    index = LexicalIndex.open(index_dir)
+    assert index.delta_size == 1
+    assert index.n_live == 2
+    assert index.df("nginx") == 0
+    assert index.search("nginx", 3) == []
+    assert index.search("deploy puppet", 3) == []
+    assert ids(index.search("haproxy", 3)) == ["n2"]
+    assert ids(index.search("app.db.port", 3)) == ["h0"]
+
+    # файл вернулся: его документы снова находятся (уже из дельты)
+    update_lexical_index(index_dir, {"README.md": [("r1", "deploy with puppet again")]})
+    index = LexicalIndex.open(index_dir)
+    assert index.n_live == 3
+    assert ids(index.search("puppet", 3)) == ["r1"]
+    assert index.search("puppet", 3)[0]["path"] == "README.md"
+
+
+def test_rebuild_matches_delta(tmp_path):
+    changes = {
+        "manifests/nginx.pp": [
+            ("n2", "class profile::haproxy { balance => roundrobin }"),
+            ("n3", "nginx::vhost { 'api': port => 8080 }"),
+        ],
+        "README.md": [],
+        "docs/ops.md": [("o0", "Rotate nginx logs daily, restart haproxy on config change")],
+    }
+    delta_dir = tmp_path / "delta"
+    build_lexical_index(records(DOCS), delta_dir)
+    update_lexical_index(delta_dir, changes)
+    rebuilt_dir = tmp_path / "rebuilt"
+    build_lexical_index(records({**DOCS, **changes}), rebuilt_dir)
+
+    with_delta = LexicalIndex.open(delta_dir)
+    rebuilt = LexicalIndex.open(rebuilt_dir)
+    assert with_delta.n_live == rebuilt.n_live == 4
+    for query in ["nginx", "haproxy", "port", "app.db.port", "puppet", "nginx::vhost"]:
+        assert with_delta.df(query) == rebuilt.df(query)
+        expected = {(h["id"], h["path"]): h["score"] for h in rebuilt.search(query, 10)}
+        got = {(h["id"], h["path"]): h["score"] for h in with_delta.search(query, 10)}
+        assert got == pytest.approx(expected), query
+
+    # полная сборка сбрасывает дельту
+    build_lexical_index(records({**DOCS, **changes}), delta_dir)
+    assert read_delta(delta_dir) == {}
+    assert LexicalIndex.open(delta_dir).delta_size == 0
+
+
+def test_rrf_fuses_vector_and_lexical_hits(tmp_path):
+    store = LocalStore(tmp_path / "store")
+    store.create_collection("repo", 4)
+    store.upsert(
+        "repo",
+        ["v0", "v1", "x0"],
+        [[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0]],
+        [{"path": f"{pid}.md", "text": pid} for pid in ["v0", "v1", "x0"]],
+    )
+    agent = RepoSearchAgent(
+        {
+            "vector_backend": "local",
+            "vector_store_path": str(tmp_path / "store"),
+            "collection_name": "repo",
+            "lexical_index_path": str(tmp_path / "lex"),
+            "limit": 3,
+            "rrf_k": 60,
+        }
+    )
+    vector_hits = [
+        {"id": "v0", "collection": "repo", "score": 0.9, "payload": {"path": "v0.md"}},
+        {"id": "v1", "collection": "repo", "score": 0.8, "payload": {"path": "v1.md"}},
+    ]
+    lexical_hits = {"repo": [{"id": "v1", "score": 7.0}, {"id": "x0", "score": 3.0}]}
+
+    fused = asyncio.run(agent._afuse(vector_hits, lexical_hits))
+    # v1 есть в обоих списках; x0 найден только BM25 и подтягивается из хранилища
+    assert ids(fused) == ["v1", "v0", "x0"]
+    assert fused[0]["score"] == 1 / 62 + 1 / 61
+    assert fused[1]["score"] == 1 / 61
+    assert fused[2]["payload"] == {"path": "x0.md", "text": "x0"}
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from query_cache import MicroBatcher, SingleFlight, TTLCache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_single_flight_runs_once():
+    calls = 0
+
+    async def fn():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        flight = SingleFlight()
+        return await asyncio.gather(*(flight.do("key", fn) for _ in range(5)))
+
+    assert run(main()) == ["result"] * 5
+    assert calls == 1
+
+
+def test_ttl_cache_expires_and_evicts():
+    cache = TTLCache(maxsize=2, ttl=60.0)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    cache = TTLCache(maxsize=2, ttl=0.0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_micro_batcher_batches_concurrent_submits():
+    calls = []
+
+    async def fn(items):
+        calls.append(list(items))
+        return [item * 2 for item in items]
+
+    async def main():
+        batcher = MicroBatcher(fn, max_batch=3, max_delay=0.01)
+        return await asyncio.gather(*(batcher.submit(i) for i in range(7)))
+
+    assert run(main()) == [0, 2, 4, 6, 8, 10, 12]
+    assert calls == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_micro_batcher_passes_error_to_every_caller():
+    async def fn(items):
+        raise RuntimeError("backend down")
+
+    async def main():
+        batcher = MicroBatcher(fn, max_batch=8, max_delay=0.001)
+        return await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+
+    results = run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_micro_batcher_rejects_wrong_result_count():
+    async def fn(items):
+        return items[:1]
+
+    async def main():
+        batcher = MicroBatcher(fn, max_batch=8, max_delay=0.001)
+        return await asyncio.gather(*(batcher.submit(i) for i in range(2)), return_exceptions=True)
+
+    assert all(isinstance(r, ValueError) for r in run(main()))
+
+
+def test_micro_batcher_cancelled_caller_does_not_cancel_batch():
+    async def fn(items):
+        await asyncio.sleep(0.02)
+        return items
+
+    async def main():
+        batcher = MicroBatcher(fn, max_batch=8, max_delay=0.001)
+        first = asyncio.ensure_future(batcher.submit(1))
+        second = asyncio.ensure_future(batcher.submit(2))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        return await second
+
+    assert run(main()) == 2
+
+
+def test_micro_batcher_cancelled_batch_releases_callers():
+    async def fn(items):
+        await asyncio.sleep(10)
+        return items
+
+    async def main():
+        batcher = MicroBatcher(fn, max_batch=8, max_delay=0.001)
+        waiters = [asyncio.ensure_future(batcher.submit(i)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        for task in list(batcher._tasks):
+            task.cancel()
+        done, pending = await asyncio.wait(waiters, timeout=1.0)
+        assert not pending
+        return waiters
+
+    for waiter in run(main()):
+        with pytest.raises(asyncio.CancelledError):
+            waiter.result()
@@ -0,0 +1,80 @@
+import time
+
+from reranker import LexicalScorer, Reranker, reranker_from_config
+
+
+def hit(pid, text, path="x.pp", score=0.5):
+    return {"id": pid, "score": score, "payload": {"path": path, "text": text}}
+
+
+HITS = [
+    hit("h0", "unrelated text about logging"),
+    hit("h1", "class profile::nginx { port => 80 }"),
+    hit("h2", "nothing here either"),
+]
+
+
+class SlowScorer:
+    """
+    Оценивает хиты наоборот, но не укладывается в бюджет; загрузка модели
+    (prepare) в бюджет не входит.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.prepared = False
+
+    def prepare(self):
+        time.sleep(self.delay)
+        self.prepared = True
+
+    def score(self, query, hits, deadline):
+        scores = []
+        for i in range(len(hits)):
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(self.delay)
+            scores.append(float(i))
+        return scores
+
+
+def test_reranks_by_lexical_match():
+    reranker = Reranker(LexicalScorer(), budget=10.0, weight=0.7)
+    hits, complete = reranker.rerank("profile::nginx port", HITS, 2)
+    assert complete
+    assert [h["id"] for h in hits] == ["h1", "h0"]
+    assert hits[0]["score"] > hits[1]["score"]
+
+
+def test_budget_exceeded_keeps_first_stage_order():
+    scorer = SlowScorer(delay=0.05)
+    reranker = Reranker(scorer, budget=0.02)
+    hits, complete = reranker.rerank("query", HITS, 2)
+    assert scorer.prepared
+    assert not complete
+    assert hits == HITS[:2]
+
+
+def test_preparation_is_outside_budget():
+    scorer = SlowScorer(delay=0.0)
+    scorer.prepare = lambda: time.sleep(0.05)
+    reranker = Reranker(scorer, budget=0.02)
+    hits, complete = reranker.rerank("query", HITS, 3)
+    assert complete
+    assert [h["id"] for h in hits] == ["h2", "h1", "h0"]
+
+
+def test_scorer_error_keeps_first_stage_order():
+    class Broken(LexicalScorer):
+        def score(self, query, hits, deadline):
+            raise RuntimeError("model crashed")
+
+    hits, complete = Reranker(Broken()).rerank("query", HITS, 3)
+    assert (hits, complete) == (HITS, False)
+
+
+def test_reranker_from_config():
+    assert reranker_from_config({}) is None
+    reranker = reranker_from_config({"rerank": "lexical", "rerank_budget_ms": 20})
+    assert isinstance(reranker.scorer, LexicalScorer)
+    assert reranker.budget == 0.02
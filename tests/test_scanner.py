@@ -0,0 +1,80 @@
+import shutil
+import subprocess
+
+import pytest
+
+from index_repo import IndexManifest, find_candidates
+from scanner import git_changes
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+
+def git(repo, *args):
+    subprocess.run(
+        [
+            "git",
+            "-C",
+            str(repo),
+            "-c",
+            "user.name=test",
+            "-c",
+            "user.email=test@example.com",
+            *args,
+        ],
+        check=True,
+        capture_output=True,
+    )
+
+
+def commit_all(repo, message):
+    git(repo, "add", "-A")
+    git(repo, "commit", "-q", "-m", message)
+
+
+@pytest.fixture
+def monorepo(tmp_path):
+    repo = tmp_path / "mono"
+    (repo / "sub" / "docs").mkdir(parents=True)
+    (repo / "other").mkdir()
+    (repo / "sub" / "a.md").write_text("# a\n", encoding="utf-8")
+    (repo / "sub" / "docs" / "b.md").write_text("# b\n", encoding="utf-8")
+    (repo / "other" / "c.md").write_text("# c\n", encoding="utf-8")
+    git(repo, "init", "-q")
+    commit_all(repo, "initial")
+    return repo
+
+
+def record_all(manifest, root, rel_paths):
+    for rel_path in rel_paths:
+        st = (root / rel_path).stat()
+        manifest.record(rel_path, {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha256": ""})
+
+
+def test_git_changes_in_subdirectory_are_relative(monorepo):
+    sub = monorepo / "sub"
+    first = git_changes(sub, None)
+    assert first.files == {"a.md", "docs/b.md"}
+
+    (sub / "docs" / "b.md").write_text("# b, edited\n", encoding="utf-8")
+    (monorepo / "other" / "c.md").write_text("# c, edited\n", encoding="utf-8")
+    commit_all(monorepo, "edit")
+
+    changes = git_changes(sub, first.head)
+    assert changes.changed == {"docs/b.md"}
+    assert changes.dirty == set()
+
+
+def test_committed_edit_in_subdirectory_is_a_candidate(monorepo, tmp_path):
+    sub = monorepo / "sub"
+    manifest = IndexManifest(tmp_path / "manifest.jsonl")
+    first = git_changes(sub, None)
+    candidates, seen = find_candidates(sub, manifest, False, first)
+    assert sorted(rel_path for _, rel_path, _, _ in candidates) == ["a.md", "docs/b.md"]
+    record_all(manifest, sub, seen)
+
+    (sub / "a.md").write_text("# a, edited and committed\n", encoding="utf-8")
+    commit_all(monorepo, "edit a")
+
+    candidates, seen = find_candidates(sub, manifest, False, git_changes(sub, first.head))
+    assert [(rel_path, replace) for _, rel_path, replace, _ in candidates] == [("a.md", True)]
+    assert seen == {"a.md", "docs/b.md"}
@@ -0,0 +1,101 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import admission
+import server
+from admission import ConcurrencyLimit
+
+QUESTION = {"messages": [{"role": "user", "content": "where is the nginx port set?"}]}
+
+
+class ContextAgent:
+    async def abuild_context(self, user_message):
+        return "port => 80 in profile::nginx"
+
+
+def busy(name, max_queue=0, queue_timeout=0.0):
+    """
+    Ограничение с max_concurrent: 1, единственный слот которого занят другим запросом.
+    """
+    limit = ConcurrencyLimit(
+        name, max_concurrent=1, max_queue=max_queue, queue_timeout=queue_timeout
+    )
+    limit.active = 1
+    return limit
+
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    calls = []
+
+    async def call_llm(messages):
+        calls.append(messages)
+        return {"choices": [{"message": {"role": "assistant", "content": "in nginx.pp"}}]}
+
+    monkeypatch.setattr(server, "call_llm", call_llm)
+    monkeypatch.setattr(server, "agents", [ContextAgent()])
+    monkeypatch.setattr(server, "answer_cache", None)
+    monkeypatch.setattr(server, "conversation", None)
+    return calls
+
+
+@pytest.fixture
+def client(llm_calls):
+    with TestClient(server.app) as client:
+        yield client
+
+
+def context_of(messages):
+    return [m["content"] for m in messages if m["content"].startswith("Repository context")]
+
+
+def test_answers_with_repository_context(client, llm_calls):
+    resp = client.post("/v1/chat/completions", json=QUESTION)
+    assert resp.status_code == 200
+    assert resp.json()["choices"][0]["message"]["content"] == "in nginx.pp"
+    assert server.DEGRADED_HEADER not in resp.headers
+    assert "profile::nginx" in context_of(llm_calls[0])[0]
+
+
+def test_full_request_queue_is_429(client, llm_calls, monkeypatch):
+    monkeypatch.setattr(server, "request_limit", busy("requests"))
+    resp = client.post("/v1/chat/completions", json=QUESTION)
+    assert resp.status_code == 429
+    assert resp.json()["error"]["type"] == "overloaded"
+    assert int(resp.headers["Retry-After"]) >= 1
+    assert llm_calls == []
+
+
+def test_request_queue_timeout_is_503(client, llm_calls, monkeypatch):
+    monkeypatch.setattr(server, "request_limit", busy("requests", max_queue=1, queue_timeout=0.01))
+    resp = client.post("/v1/chat/completions", json=QUESTION)
+    assert resp.status_code == 503
+    assert "Retry-After" in resp.headers
+    assert llm_calls == []
+
+
+def test_saturated_llm_stream_is_503(client, monkeypatch):
+    monkeypatch.setattr(server, "llm_limit", busy("llm"))
+    resp = client.post("/v1/chat/completions", json={**QUESTION, "stream": True})
+    assert resp.status_code == 503
+    assert "Retry-After" in resp.headers
+
+
+def test_saturated_retrieval_answers_without_context(client, llm_calls, monkeypatch):
+    monkeypatch.setitem(admission._limits, "embedding", busy("embedding"))
+    monkeypatch.setattr(server, "DEGRADED_MODE", True)
+    resp = client.post("/v1/chat/completions", json=QUESTION)
+    assert resp.status_code == 200
+    assert resp.headers[server.DEGRADED_HEADER] == "retrieval-skipped"
+    assert len(llm_calls) == 1
+    assert context_of(llm_calls[0]) == []
+    assert llm_calls[0][-1] == QUESTION["messages"][0]
+
+
+def test_saturated_retrieval_without_degraded_mode_is_503(client, llm_calls, monkeypatch):
+    monkeypatch.setitem(admission._limits, "vector_store", busy("vector_store"))
+    monkeypatch.setattr(server, "DEGRADED_MODE", False)
+    resp = client.post("/v1/chat/completions", json=QUESTION)
+    assert resp.status_code == 503
+    assert "Retry-After" in resp.headers
+    assert llm_calls == []
@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+
+from vector_store import LocalStore, VectorStore
+
+
+def unit_vectors(n, dim=8):
+    return np.eye(n, dim, dtype=np.float32)
+
+
+def payloads(prefix, n):
+    return [{"path": f"{prefix}{i}.md", "text": f"{prefix} {i}"} for i in range(n)]
+
+
+def test_search_resolves_hits_from_its_own_generation(tmp_path):
+    writer = LocalStore(tmp_path)
+    writer.create_collection("c", 8)
+    writer.upsert("c", [f"old{i}" for i in range(4)], unit_vectors(4), payloads("old", 4))
+    reader = LocalStore(tmp_path)
+    assert reader.info("c")["points_count"] == 4
+    col = reader._collection("c")
+
+    # новое поколение, где у тех же векторов другие номера строк
+    writer.delete_paths("c", ["old0.md", "old1.md"])
+    writer.upsert("c", ["new0", "new1"], unit_vectors(2), payloads("new", 2))
+    writer.compact("c")
+
+    class RefreshingMatrix(np.ndarray):
+        # refresh() из другого потока между оценкой и разбором хитов
+        def __getitem__(self, key):
+            col.refresh()
+            return np.asarray(self).__getitem__(key)
+
+    col._matrix = np.asarray(col._matrix).view(RefreshingMatrix)
+    query = np.zeros(8, dtype=np.float32)
+    query[3] = 1.0
+    hits = col.search(query, 1)
+    assert col.generation == 1
+    assert [(h["id"], h["payload"]["path"]) for h in hits] == [("old3", "old3.md")]
+
+    hits = col.search(query, 1)
+    assert [(h["id"], h["payload"]["path"]) for h in hits] == [("old3", "old3.md")]
+
+
+def hit_ids(hits):
+    return [h["id"] for h in hits]
+
+
+def test_upsert_delete_and_reload_from_disk(tmp_path):
+    store = LocalStore(tmp_path)
+    assert store.info("c") is None
+    store.create_collection("c", 8)
+    store.upsert("c", ["a0", "a1", "b0"], unit_vectors(3), payloads("a", 2) + payloads("b", 1))
+    # повторный upsert того же id заменяет точку
+    store.upsert("c", ["a1"], unit_vectors(5)[4:], [{"path": "a1.md", "text": "a 1, v2"}])
+    store.delete_paths("c", ["b0.md"])
+    store.delete_stale("c", "a0.md", keep_ids=[])
+    assert store.info("c") == {"points_count": 1, "vector_size": 8}
+
+    reloaded = LocalStore(tmp_path)
+    assert reloaded.info("c") == {"points_count": 1, "vector_size": 8}
+    assert dict(reloaded.scroll_payloads("c")) == {"a1": {"path": "a1.md", "text": "a 1, v2"}}
+    hits = reloaded.search("c", unit_vectors(5)[4], 3)
+    assert hit_ids(hits) == ["a1"]
+    assert hits[0]["score"] == pytest.approx(1.0)
+
+
+def test_compaction_writes_new_generation(tmp_path):
+    store = LocalStore(tmp_path)
+    store.create_collection("c", 8)
+    store.upsert("c", [f"p{i}" for i in range(6)], unit_vectors(6), payloads("p", 6))
+    reader = LocalStore(tmp_path)
+    assert reader.info("c")["points_count"] == 6
+
+    store.delete_paths("c", ["p0.md", "p1.md", "p2.md"])
+    store.compact("c")
+    col = store._collection("c")
+    assert col.generation == 1
+    assert len(col._ids) == 3
+    assert (tmp_path / "c" / "vectors.1.bin").stat().st_size == 3 * 8 * 4
+
+    # читатель на старом поколении видит удаление и переключается после refresh()
+    col = reader._collection("c")
+    assert col.generation == 0
+    col.refresh()
+    assert col.generation == 1
+    assert hit_ids(reader.search("c", unit_vectors(6)[4], 1)) == ["p4"]
+    assert sorted(pid for pid, _ in reader.scroll_payloads("c")) == ["p3", "p4", "p5"]
+
+    # следующее уплотнение удаляет файлы поколения 0
+    store.delete_paths("c", ["p3.md", "p4.md"])
+    store.compact("c")
+    assert sorted(f.name for f in (tmp_path / "c").glob("*.bin")) == [
+        "vectors.1.bin",
+        "vectors.2.bin",
+    ]
+    assert reader.info("c")["points_count"] == 1
+    assert hit_ids(reader.search("c", unit_vectors(6)[4], 3)) == ["p5"]
+
+
+def test_compaction_skips_few_dead_rows(tmp_path):
+    store = LocalStore(tmp_path)
+    store.create_collection("c", 8)
+    store.upsert("c", [f"p{i}" for i in range(8)], unit_vectors(8), payloads("p", 8))
+    store.delete_paths("c", ["p0.md"])
+    store.compact("c")
+    assert store._collection("c").generation == 0
+
+
+@pytest.mark.parametrize("dtype, itemsize", [("float16", 2), ("int8", 1)])
+def test_quantized_dtypes_round_trip(tmp_path, dtype, itemsize):
+    store = LocalStore(tmp_path, dtype=dtype)
+    store.create_collection("c", 8)
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(20, 8)).astype(np.float32)
+    store.upsert("c", [f"p{i}" for i in range(20)], vectors, payloads("p", 20))
+    assert (tmp_path / "c" / "vectors.0.bin").stat().st_size == 20 * 8 * itemsize
+
+    reloaded = LocalStore(tmp_path, dtype="float32")
+    assert reloaded._collection("c").dtype == np.dtype(dtype)
+    for i in (0, 7, 19):
+        hits = reloaded.search("c", vectors[i], 1)
+        assert hit_ids(hits) == [f"p{i}"]
+        assert hits[0]["score"] == pytest.approx(1.0, abs=0.02)
+        assert hits[0]["payload"] == {"path": f"p{i}.md", "text": f"p {i}"}
+
+
+def test_incomplete_backend_fails_at_construction():
+    class NoSearch(LocalStore):
+        search = VectorStore.search
+
+    with pytest.raises(TypeError, match="search"):
+        NoSearch("unused")
@@ -0,0 +1,52 @@
+import logging
+from functools import lru_cache
+from typing import List
+
+logger = logging.getLogger("uvicorn.error")
+
+DEFAULT_ENCODING = "cl100k_base"
+
+# оценка числа символов на токен, если tiktoken недоступен
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def get_encoding(name: str = DEFAULT_ENCODING):
+    """
+    Возвращает кодировку tiktoken или None, если её не удалось загрузить
+    (например, файл BPE не скачан и нет доступа в интернет).
+    Тогда число токенов оценивается по длине текста.
+    """
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(
+            "tiktoken encoding %s is unavailable (%s), falling back to ~%d chars per token",
+            name,
+            e,
+            CHARS_PER_TOKEN,
+        )
+        return None
+
+
+def count_tokens(text: str, encoding: str = DEFAULT_ENCODING) -> int:
+    enc = get_encoding(encoding)
+    if enc is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def split_by_tokens(text: str, max_tokens: int, encoding: str = DEFAULT_ENCODING) -> List[str]:
+    """
+    Режет текст на куски не длиннее max_tokens токенов
+    (для строк, которые сами по себе не помещаются в чанк).
+    """
+    max_tokens = max(1, max_tokens)
+    enc = get_encoding(encoding)
+    if enc is None:
+        step = max_tokens * CHARS_PER_TOKEN
+        return [text[i : i + step] for i in range(0, len(text), step)]
+    ids = enc.encode(text, disallowed_special=())
+    return [enc.decode(ids[i : i + max_tokens]) for i in range(0, len(ids), max_tokens)]
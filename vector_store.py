@@ -0,0 +1,818 @@
+import os
+import abc
+import json
+import asyncio
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, TypeVar
+
+import httpx
+import numpy as np
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http import models as qmodels
+
+from admission import pool_limits
+
+# сколько строк матрицы перемножаем за один шаг при поиске в локальном хранилище
+SEARCH_BLOCK_ROWS = 65536
+
+# локальная коллекция уплотняется, когда мёртвых строк больше этой доли
+COMPACT_DEAD_RATIO = 0.3
+
+T = TypeVar("T")
+
+# масштаб скалярного квантования int8 нормированных векторов (компоненты в [-1, 1])
+INT8_SCALE = 127.0
+
+
+class CollectionNotFoundError(Exception):
+    """
+    Коллекция не существует (в Qdrant — ответ 404).
+    """
+
+
+class VectorStore(abc.ABC):
+    """
+    Интерфейс хранилища векторов, общий для index_repo.py и RepoSearchAgent.
+
+    Точка — id (строка), вектор и payload (`text`, `path`, `chunk_index`, ...).
+    Синхронные методы используются индексатором, асинхронные — сервером.
+    Расстояние — косинусное. Бэкенд без какого-либо из абстрактных методов
+    не создаётся (TypeError при конструировании).
+    """
+
+    # --- индексатор ---
+
+    @abc.abstractmethod
+    def info(self, collection: str) -> Optional[Dict[str, Any]]:
+        """
+        {"points_count": int, "vector_size": int | None} или None, если коллекции нет.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def create_collection(self, collection: str, dim: int) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def upsert(
+        self,
+        collection: str,
+        ids: Sequence[str],
+        vectors: Sequence[Sequence[float]],
+        payloads: Sequence[Dict[str, Any]],
+    ) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_paths(self, collection: str, rel_paths: List[str]) -> None:
+        """
+        Удаляет все точки перечисленных файлов.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_stale(self, collection: str, rel_path: str, keep_ids: List[str]) -> None:
+        """
+        Удаляет точки файла, id которых нет в keep_ids.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def scroll_payloads(self, collection: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Все точки коллекции в виде (id, payload), без векторов.
+        """
+        raise NotImplementedError
+
+    def compact(self, collection: str) -> None:
+        """
+        Освобождает место после удалений (если хранилищу это нужно).
+        """
+
+    @abc.abstractmethod
+    def search(self, collection: str, vector: Sequence[float], limit: int) -> List[Dict]:
+        raise NotImplementedError
+
+    # --- сервер ---
+
+    @abc.abstractmethod
+    async def ainfo(self, collection: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def asearch(self, collection: str, vector: Sequence[float], limit: int) -> List[Dict]:
+        """
+        Хиты вида {"id", "score", "payload"} по убыванию score.
+        """
+        raise NotImplementedError
+
+    async def asearch_batch(
+        self, collection: str, vectors: Sequence[Sequence[float]], limit: int
+    ) -> List[List[Dict]]:
+        """
+        Несколько поисков одним вызовом: список хитов на каждый вектор.
+        По умолчанию — параллельные asearch.
+        """
+        return list(
+            await asyncio.gather(*(self.asearch(collection, v, limit) for v in vectors))
+        )
+
+    @abc.abstractmethod
+    async def aretrieve(self, collection: str, ids: List[str]) -> Dict[str, Dict]:
+        """
+        Точки по id: {id: {"id", "payload"}}; отсутствующие id пропускаются.
+        """
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        pass
+
+
+def path_filter(rel_paths: List[str]) -> qmodels.Filter:
+    """
+    Фильтр Qdrant по полю payload `path`.
+    """
+    if len(rel_paths) == 1:
+        match: Any = qmodels.MatchValue(value=rel_paths[0])
+    else:
+        match = qmodels.MatchAny(any=rel_paths)
+    return qmodels.Filter(must=[qmodels.FieldCondition(key="path", match=match)])
+
+
+def _qdrant_info(resp: httpx.Response) -> Optional[Dict[str, Any]]:
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    result = resp.json().get("result", {})
+    vectors = result.get("config", {}).get("params", {}).get("vectors") or {}
+    size = vectors.get("size")
+    return {
+        "points_count": result.get("points_count"),
+        "vector_size": int(size) if size is not None else None,
+    }
+
+
+def _qdrant_search_result(resp: httpx.Response) -> List[Dict]:
+    if resp.status_code == 404:
+        raise CollectionNotFoundError(resp.request.url.path)
+    resp.raise_for_status()
+    return resp.json().get("result", [])
+
+
+def _grpc_hits(points) -> List[Dict]:
+    return [{"id": str(p.id), "score": p.score, "payload": p.payload or {}} for p in points]
+
+
+def _is_grpc_not_found(e: Exception) -> bool:
+    code = getattr(e, "code", None)
+    return callable(code) and getattr(code(), "name", None) == "NOT_FOUND"
+
+
+def _as_vector(vector: Sequence[float]) -> np.ndarray:
+    return np.asarray(vector, dtype=np.float32).reshape(-1)
+
+
+class QdrantStore(VectorStore):
+    """
+    Хранилище в Qdrant: запись через qdrant_client, поиск через REST API
+    (синхронный httpx.Client для индексатора, httpx.AsyncClient для сервера).
+
+    prefer_grpc=True переводит запись и серверный поиск на gRPC: векторы
+    передаются бинарно (protobuf), а не текстом JSON.
+    quantization="int8" создаёт коллекцию со скалярным квантованием:
+    квантованные векторы держатся в памяти, исходные — на диске.
+    """
+
+    # сколько точек читаем за один scroll
+    SCROLL_BATCH_SIZE = 1024
+
+    def __init__(
+        self,
+        url: str,
+        timeout: float = 30.0,
+        prefer_grpc: bool = False,
+        grpc_port: int = 6334,
+        quantization: Optional[str] = None,
+        limits: Optional[httpx.Limits] = None,
+    ) -> None:
+        if quantization not in (None, "int8"):
+            raise ValueError(f"Unsupported quantization: {quantization}")
+        self.url = url
+        self.prefer_grpc = prefer_grpc
+        self.quantization = quantization
+        self.client = QdrantClient(
+            url=url,
+            prefer_grpc=prefer_grpc,
+            grpc_port=grpc_port,
+            timeout=int(timeout),
+        )
+        limits = limits or httpx.Limits()
+        self.http_client = httpx.Client(
+            base_url=url, timeout=timeout, limits=limits, trust_env=False
+        )
+        self.async_http_client = httpx.AsyncClient(
+            base_url=url, timeout=timeout, limits=limits, trust_env=False
+        )
+        self.async_client: Optional[AsyncQdrantClient] = None
+        if prefer_grpc:
+            self.async_client = AsyncQdrantClient(
+                url=url,
+                prefer_grpc=True,
+                grpc_port=grpc_port,
+                timeout=int(timeout),
+            )
+
+    @staticmethod
+    def _search_body(vector: Sequence[float], limit: int) -> Dict:
+        return {
+            "vector": _as_vector(vector).tolist(),
+            "limit": limit,
+            "with_payload": True,
+        }
+
+    def info(self, collection: str) -> Optional[Dict[str, Any]]:
+        return _qdrant_info(self.http_client.get(f"/collections/{collection}"))
+
+    def create_collection(self, collection: str, dim: int) -> None:
+        quantization_config = None
+        if self.quantization == "int8":
+            quantization_config = qmodels.ScalarQuantization(
+                scalar=qmodels.ScalarQuantizationConfig(
+                    type=qmodels.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True,
+                )
+            )
+        self.client.recreate_collection(
+            collection_name=collection,
+            vectors_config=qmodels.VectorParams(
+                size=dim,
+                distance=qmodels.Distance.COSINE,
+                on_disk=quantization_config is not None,
+            ),
+            quantization_config=quantization_config,
+        )
+
+    def upsert(self, collection, ids, vectors, payloads) -> None:
+        # Batch — колоночный формат без PointStruct на каждую точку
+        self.client.upsert(
+            collection_name=collection,
+            points=qmodels.Batch(
+                ids=list(ids),
+                vectors=np.asarray(vectors, dtype=np.float32).tolist(),
+                payloads=list(payloads),
+            ),
+        )
+
+    def delete_paths(self, collection: str, rel_paths: List[str]) -> None:
+        self.client.delete(
+            collection_name=collection,
+            points_selector=qmodels.FilterSelector(filter=path_filter(rel_paths)),
+        )
+
+    def delete_stale(self, collection: str, rel_path: str, keep_ids: List[str]) -> None:
+        stale_filter = path_filter([rel_path])
+        if keep_ids:
+            stale_filter.must_not = [qmodels.HasIdCondition(has_id=keep_ids)]
+        self.client.delete(
+            collection_name=collection,
+            points_selector=qmodels.FilterSelector(filter=stale_filter),
+        )
+
+    def scroll_payloads(self, collection: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=collection,
+                limit=self.SCROLL_BATCH_SIZE,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
+            )
+            for point in points:
+                yield str(point.id), point.payload or {}
+            if offset is None:
+                break
+
+    def search(self, collection: str, vector: Sequence[float], limit: int) -> List[Dict]:
+        resp = self.http_client.post(
+            f"/collections/{collection}/points/search",
+            json=self._search_body(vector, limit),
+        )
+        return _qdrant_search_result(resp)
+
+    async def ainfo(self, collection: str) -> Optional[Dict[str, Any]]:
+        if self.async_client is not None:
+            try:
+                info = await self.async_client.get_collection(collection)
+            except Exception as e:
+                if _is_grpc_not_found(e):
+                    return None
+                raise
+            vectors = info.config.params.vectors
+            return {
+                "points_count": info.points_count,
+                "vector_size": getattr(vectors, "size", None),
+            }
+        return _qdrant_info(await self.async_http_client.get(f"/collections/{collection}"))
+
+    async def asearch(self, collection: str, vector: Sequence[float], limit: int) -> List[Dict]:
+        if self.async_client is not None:
+            try:
+                res = await self.async_client.query_points(
+                    collection_name=collection,
+                    query=_as_vector(vector),
+                    limit=limit,
+                    with_payload=True,
+                )
+            except Exception as e:
+                if _is_grpc_not_found(e):
+                    raise CollectionNotFoundError(collection) from e
+                raise
+            return _grpc_hits(res.points)
+        resp = await self.async_http_client.post(
+            f"/collections/{collection}/points/search",
+            json=self._search_body(vector, limit),
+        )
+        return _qdrant_search_result(resp)
+
+    async def asearch_batch(
+        self, collection: str, vectors: Sequence[Sequence[float]], limit: int
+    ) -> List[List[Dict]]:
+        if self.async_client is not None:
+            try:
+                responses = await self.async_client.query_batch_points(
+                    collection_name=collection,
+                    requests=[
+                        qmodels.QueryRequest(
+                            query=_as_vector(v).tolist(), limit=limit, with_payload=True
+                        )
+                        for v in vectors
+                    ],
+                )
+            except Exception as e:
+                if _is_grpc_not_found(e):
+                    raise CollectionNotFoundError(collection) from e
+                raise
+            return [_grpc_hits(res.points) for res in responses]
+        resp = await self.async_http_client.post(
+            f"/collections/{collection}/points/search/batch",
+            json={"searches": [self._search_body(v, limit) for v in vectors]},
+        )
+        return _qdrant_search_result(resp)
+
+    async def aretrieve(self, collection: str, ids: List[str]) -> Dict[str, Dict]:
+        if not ids:
+            return {}
+        if self.async_client is not None:
+            try:
+                points = await self.async_client.retrieve(
+                    collection_name=collection,
+                    ids=ids,
+                    with_payload=True,
+                    with_vectors=False,
+                )
+            except Exception as e:
+                if _is_grpc_not_found(e):
+                    raise CollectionNotFoundError(collection) from e
+                raise
+            return {str(p.id): {"id": str(p.id), "payload": p.payload or {}} for p in points}
+        resp = await self.async_http_client.post(
+            f"/collections/{collection}/points",
+            json={"ids": ids, "with_payload": True, "with_vector": False},
+        )
+        if resp.status_code == 404:
+            raise CollectionNotFoundError(collection)
+        resp.raise_for_status()
+        return {str(p["id"]): p for p in resp.json().get("result", [])}
+
+    async def aclose(self) -> None:
+        await self.async_http_client.aclose()
+        if self.async_client is not None:
+            await self.async_client.close()
+
+
+class LocalCollection:
+    """
+    Коллекция локального хранилища — каталог с файлами:
+
+      meta.json                — размерность, тип (float32/float16/int8), поколение;
+      vectors.<gen>.bin        — нормированные векторы, строка за строкой;
+      payloads.<gen>.jsonl     — журнал операций: upsert (id, номер строки, payload)
+                                 и delete (id).
+
+    Векторы отображаются в память (np.memmap), в памяти держатся только
+    соответствия id -> строка и смещения payload в журнале; сами payload
+    читаются с диска только для найденных точек.
+
+    Запись только дописывает файлы, поэтому читатель (сервер) подхватывает
+    изменения индексатора, дочитывая журнал с последней позиции (refresh).
+    Уплотнение (compact) пишет файлы нового поколения и переключает meta.json;
+    файлы предыдущего поколения удаляются только следующим уплотнением, чтобы
+    читатель, ещё не заметивший переключения, мог дочитать их. Если файлы
+    поколения всё же исчезли (ENOENT), читатель переходит на текущее поколение
+    и повторяет чтение (см. _reading).
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.RLock()
+        self._load()
+
+    # --- загрузка и чтение журнала ---
+
+    def _load(self) -> None:
+        meta = json.loads((self.path / "meta.json").read_text(encoding="utf-8"))
+        self.dim = int(meta["dim"])
+        self.dtype = np.dtype(meta.get("dtype", "float32"))
+        self.generation = int(meta.get("generation", 0))
+        self._row_bytes = self.dim * self.dtype.itemsize
+
+        self._ids: List[Optional[str]] = []
+        self._paths: List[Optional[str]] = []
+        self._offsets: List[int] = []
+        self._row_of: Dict[str, int] = {}
+        self._path_rows: Dict[str, Set[int]] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._matrix: Optional[np.ndarray] = None
+        self._log_pos = 0
+        self._replay()
+
+    @property
+    def vectors_path(self) -> Path:
+        return self.path / f"vectors.{self.generation}.bin"
+
+    @property
+    def log_path(self) -> Path:
+        return self.path / f"payloads.{self.generation}.jsonl"
+
+    def refresh(self) -> None:
+        """
+        Подхватывает изменения, сделанные другим процессом.
+        """
+        with self._lock:
+            meta = json.loads((self.path / "meta.json").read_text(encoding="utf-8"))
+            if int(meta.get("generation", 0)) != self.generation:
+                self._load()
+            else:
+                self._replay()
+
+    def _replay(self) -> None:
+        with self.log_path.open("rb") as f:
+            f.seek(self._log_pos)
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    # недописанная строка — дочитаем в следующий раз
+                    break
+                self._apply(json.loads(line), offset)
+                self._log_pos = f.tell()
+        self._map_vectors()
+
+    def _apply(self, rec: Dict[str, Any], offset: int) -> None:
+        if rec["op"] == "delete":
+            row = self._row_of.pop(rec["id"], None)
+            if row is not None:
+                self._kill(row)
+            return
+
+        row = rec["row"]
+        old = self._row_of.get(rec["id"])
+        if old is not None:
+            self._kill(old)
+        while len(self._ids) <= row:
+            self._ids.append(None)
+            self._paths.append(None)
+            self._offsets.append(0)
+        path = rec["payload"].get("path")
+        self._ids[row] = rec["id"]
+        self._paths[row] = path
+        self._offsets[row] = offset
+        self._row_of[rec["id"]] = row
+        self._path_rows.setdefault(path, set()).add(row)
+        if len(self._alive) <= row:
+            grown = np.zeros(max(row + 1, len(self._alive) * 2), dtype=bool)
+            grown[: len(self._alive)] = self._alive
+            self._alive = grown
+        self._alive[row] = True
+
+    def _kill(self, row: int) -> None:
+        self._alive[row] = False
+        rows = self._path_rows.get(self._paths[row])
+        if rows is not None:
+            rows.discard(row)
+            if not rows:
+                del self._path_rows[self._paths[row]]
+        self._ids[row] = None
+
+    def _map_vectors(self) -> None:
+        n_rows = self.vectors_path.stat().st_size // self._row_bytes
+        if n_rows == 0:
+            self._matrix = None
+        elif self._matrix is None or self._matrix.shape[0] != n_rows:
+            self._matrix = np.memmap(
+                self.vectors_path, dtype=self.dtype, mode="r", shape=(n_rows, self.dim)
+            )
+
+    def _reading(self, read: Callable[[], T]) -> T:
+        # файлы поколения удалены уплотнением в другом процессе — перечитываем
+        # meta.json и повторяем чтение уже по новому поколению
+        try:
+            return read()
+        except FileNotFoundError:
+            self.refresh()
+            return read()
+
+    def _payload(self, row: int) -> Dict[str, Any]:
+        with self.log_path.open("rb") as f:
+            f.seek(self._offsets[row])
+            return json.loads(f.readline())["payload"]
+
+    # --- запись ---
+
+    def _write(self, vectors: Optional[np.ndarray], records: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            if vectors is not None:
+                with self.vectors_path.open("ab") as f:
+                    row0 = f.tell() // self._row_bytes
+                    f.write(np.ascontiguousarray(vectors, dtype=self.dtype).tobytes())
+                for i, rec in enumerate(records):
+                    rec["row"] = row0 + i
+            with self.log_path.open("ab") as f:
+                f.write(
+                    b"".join(
+                        json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n"
+                        for rec in records
+                    )
+                )
+            self._replay()
+
+    def upsert(self, ids, vectors, payloads) -> None:
+        if not ids:
+            return
+        vecs = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        vecs = vecs / np.maximum(norms, 1e-12)
+        if self.dtype == np.int8:
+            vecs = np.clip(np.rint(vecs * INT8_SCALE), -INT8_SCALE, INT8_SCALE)
+        records = [
+            {"op": "upsert", "id": str(pid), "payload": payload}
+            for pid, payload in zip(ids, payloads)
+        ]
+        self._write(vecs, records)
+
+    def delete_ids(self, ids: List[str]) -> None:
+        with self._lock:
+            ids = [pid for pid in ids if pid in self._row_of]
+            if ids:
+                self._write(None, [{"op": "delete", "id": pid} for pid in ids])
+
+    def ids_for_path(self, rel_path: str) -> List[str]:
+        with self._lock:
+            return [self._ids[row] for row in self._path_rows.get(rel_path, ())]
+
+    def compact(self) -> None:
+        """
+        Переписывает коллекцию без удалённых строк, если их накопилось много.
+        """
+        with self._lock:
+            total = len(self._ids)
+            alive_rows = np.flatnonzero(self._alive[:total])
+            if total == 0 or (total - len(alive_rows)) <= total * COMPACT_DEAD_RATIO:
+                return
+
+            new_gen = self.generation + 1
+            vec_path = self.path / f"vectors.{new_gen}.bin"
+            log_path = self.path / f"payloads.{new_gen}.jsonl"
+            with vec_path.open("wb") as fv, log_path.open("wb") as fl:
+                for new_row, row in enumerate(alive_rows):
+                    fv.write(np.asarray(self._matrix[row]).tobytes())
+                    rec = {
+                        "op": "upsert",
+                        "id": self._ids[row],
+                        "row": new_row,
+                        "payload": self._payload(row),
+                    }
+                    fl.write(json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n")
+
+            _write_meta(self.path, self.dim, self.dtype.name, new_gen)
+            self._matrix = None
+            self._load()
+            # предыдущее поколение остаётся для читателей до следующего уплотнения
+            for f in [*self.path.glob("vectors.*.bin"), *self.path.glob("payloads.*.jsonl")]:
+                gen = f.name.split(".")[1]
+                if gen.isdigit() and int(gen) < new_gen - 1:
+                    f.unlink(missing_ok=True)
+
+    # --- чтение ---
+
+    @property
+    def points_count(self) -> int:
+        return len(self._row_of)
+
+    def search(self, vector: Sequence[float], limit: int) -> List[Dict]:
+        return self.search_batch([vector], limit)[0]
+
+    def search_batch(self, vectors: Sequence[Sequence[float]], limit: int) -> List[List[Dict]]:
+        """
+        Поиск сразу по нескольким векторам: матрица коллекции читается один
+        раз и умножается на матрицу запросов.
+        """
+        return self._reading(lambda: self._search_batch(vectors, limit))
+
+    def _search_batch(self, vectors: Sequence[Sequence[float]], limit: int) -> List[List[Dict]]:
+        with self._lock:
+            matrix = self._matrix
+            if matrix is None or not self._row_of:
+                return [[] for _ in vectors]
+            alive = self._alive[: matrix.shape[0]].copy()
+            # хиты разрешаются по снимку этого поколения: refresh() из другого потока
+            # может загрузить новое, где номера строк другие (_load создаёт новые
+            # списки, а в пределах поколения строки только дописываются)
+            row_ids, offsets, log_path = self._ids, self._offsets, self.log_path
+
+        q = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        q = q / np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+        scores = np.empty((matrix.shape[0], len(q)), dtype=np.float32)
+        for start in range(0, matrix.shape[0], SEARCH_BLOCK_ROWS):
+            block = matrix[start : start + SEARCH_BLOCK_ROWS]
+            scores[start : start + len(block)] = block.astype(np.float32, copy=False) @ q.T
+        if self.dtype == np.int8:
+            scores /= INT8_SCALE
+        scores[~alive] = -np.inf
+
+        k = min(limit, int(alive.sum()))
+        if k <= 0:
+            return [[] for _ in vectors]
+        results: List[List[Dict]] = []
+        with log_path.open("rb") as f:
+            for column in scores.T:
+                top = np.argpartition(-column, k - 1)[:k]
+                top = top[np.argsort(-column[top])]
+                hits: List[Dict] = []
+                for row in top:
+                    pid = row_ids[row]
+                    if pid is None:
+                        continue
+                    f.seek(offsets[row])
+                    payload = json.loads(f.readline())["payload"]
+                    hits.append({"id": pid, "score": float(column[row]), "payload": payload})
+                results.append(hits)
+        return results
+
+    def retrieve(self, ids: List[str]) -> Dict[str, Dict]:
+        def read() -> Dict[str, Dict]:
+            with self._lock:
+                return {
+                    pid: {"id": pid, "payload": self._payload(self._row_of[pid])}
+                    for pid in ids
+                    if pid in self._row_of
+                }
+
+        return self._reading(read)
+
+    def scroll_payloads(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        # читаем журнал последовательно, по возрастанию смещений
+        def snapshot() -> Tuple[List[Tuple[int, str]], Any]:
+            with self._lock:
+                items = sorted((self._offsets[row], pid) for pid, row in self._row_of.items())
+                return items, self.log_path.open("rb")
+
+        items, f = self._reading(snapshot)
+        with f:
+            for offset, pid in items:
+                f.seek(offset)
+                yield pid, json.loads(f.readline())["payload"]
+
+
+def _write_meta(path: Path, dim: int, dtype: str, generation: int) -> None:
+    tmp = path / "meta.json.tmp"
+    tmp.write_text(
+        json.dumps({"dim": dim, "dtype": dtype, "generation": generation, "distance": "cosine"}),
+        encoding="utf-8",
+    )
+    os.replace(tmp, path / "meta.json")
+
+
+class LocalStore(VectorStore):
+    """
+    Встроенное хранилище без сервера: полный перебор по матрице векторов
+    (NumPy, блоками по SEARCH_BLOCK_ROWS строк). Подходит для небольших и
+    средних репозиториев и для CI — поиск по 100k чанков занимает миллисекунды
+    и не требует сетевых запросов.
+
+    Каждая коллекция — отдельный каталог внутри path (см. LocalCollection).
+    dtype float16 вдвое уменьшает размер файла векторов, int8 (скалярное
+    квантование нормированных векторов) — вчетверо.
+    """
+
+    def __init__(self, path: str | Path, dtype: str = "float32") -> None:
+        self.path = Path(path)
+        self.dtype = np.dtype(dtype).name
+        self._collections: Dict[str, LocalCollection] = {}
+        self._lock = threading.Lock()
+
+    def _collection(self, collection: str) -> LocalCollection:
+        with self._lock:
+            col = self._collections.get(collection)
+            if col is None:
+                col_path = self.path / collection
+                if not (col_path / "meta.json").exists():
+                    raise CollectionNotFoundError(collection)
+                col = LocalCollection(col_path)
+                self._collections[collection] = col
+            return col
+
+    def info(self, collection: str) -> Optional[Dict[str, Any]]:
+        try:
+            col = self._collection(collection)
+        except CollectionNotFoundError:
+            return None
+        col.refresh()
+        return {"points_count": col.points_count, "vector_size": col.dim}
+
+    def create_collection(self, collection: str, dim: int) -> None:
+        col_path = self.path / collection
+        col_path.mkdir(parents=True, exist_ok=True)
+        for f in col_path.iterdir():
+            f.unlink()
+        (col_path / "vectors.0.bin").touch()
+        (col_path / "payloads.0.jsonl").touch()
+        _write_meta(col_path, dim, self.dtype, 0)
+        with self._lock:
+            self._collections.pop(collection, None)
+
+    def upsert(self, collection, ids, vectors, payloads) -> None:
+        self._collection(collection).upsert(ids, vectors, payloads)
+
+    def delete_paths(self, collection: str, rel_paths: List[str]) -> None:
+        col = self._collection(collection)
+        ids: List[str] = []
+        for rel_path in rel_paths:
+            ids.extend(col.ids_for_path(rel_path))
+        col.delete_ids(ids)
+
+    def delete_stale(self, collection: str, rel_path: str, keep_ids: List[str]) -> None:
+        col = self._collection(collection)
+        keep = set(keep_ids)
+        col.delete_ids([pid for pid in col.ids_for_path(rel_path) if pid not in keep])
+
+    def scroll_payloads(self, collection: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        return self._collection(collection).scroll_payloads()
+
+    def compact(self, collection: str) -> None:
+        self._collection(collection).compact()
+
+    def search(self, collection: str, vector: Sequence[float], limit: int) -> List[Dict]:
+        return self._collection(collection).search(vector, limit)
+
+    async def ainfo(self, collection: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.info, collection)
+
+    async def asearch(self, collection: str, vector: Sequence[float], limit: int) -> List[Dict]:
+        # NumPy отпускает GIL при умножении матриц, поэтому поиск уходит в поток
+        return await asyncio.to_thread(self.search, collection, vector, limit)
+
+    async def asearch_batch(
+        self, collection: str, vectors: Sequence[Sequence[float]], limit: int
+    ) -> List[List[Dict]]:
+        return await asyncio.to_thread(self._collection(collection).search_batch, vectors, limit)
+
+    async def aretrieve(self, collection: str, ids: List[str]) -> Dict[str, Dict]:
+        return await asyncio.to_thread(self._collection(collection).retrieve, ids)
+
+
+def vector_store_from_config(config: Dict[str, Any]) -> VectorStore:
+    """
+    Создаёт хранилище по конфигу RepoSearchAgent (общему с index_repo.py):
+
+      vector_backend: qdrant | local
+      qdrant_url: http://127.0.0.1:6333      — для qdrant
+      timeout: 30.0                          — для qdrant
+      prefer_grpc: false                     — для qdrant: запись и поиск по gRPC
+      grpc_port: 6334                        — для qdrant
+      quantization: int8                     — для qdrant: квантование новой коллекции
+      vector_store_path: .vector_store       — для local
+      vector_dtype: float32 | float16 | int8 — для local
+
+    Пул соединений REST-клиентов Qdrant — по секции admission.vector_store
+    (см. admission.pool_limits).
+    """
+    backend = config.get("vector_backend", "qdrant")
+    if backend == "local":
+        return LocalStore(
+            path=config.get("vector_store_path", ".vector_store"),
+            dtype=config.get("vector_dtype", "float32"),
+        )
+    if backend == "qdrant":
+        return QdrantStore(
+            url=config.get("qdrant_url", "http://127.0.0.1:6333"),
+            timeout=config.get("timeout", 30.0),
+            prefer_grpc=bool(config.get("prefer_grpc", False)),
+            grpc_port=int(config.get("grpc_port", 6334)),
+            quantization=config.get("quantization"),
+            limits=pool_limits("vector_store"),
+        )
+    raise ValueError(f"Unknown vector_backend: {backend}")
@@ -0,0 +1,101 @@
+import os
+import time
+from pathlib import Path
+from typing import Collection, Dict, Iterator, Optional, Set, Tuple
+
+from scanner import DEFAULT_SCAN_WORKERS, TreeScanner
+
+try:
+    import watchfiles
+except ImportError:  # уведомления ФС недоступны — остаётся опрос
+    watchfiles = None
+
+# события, пришедшие с интервалом меньше debounce, объединяются в одну пачку
+DEFAULT_DEBOUNCE = 1.0
+
+# период опроса дерева, если уведомления ФС недоступны или выключены
+DEFAULT_POLL_INTERVAL = 5.0
+
+
+def _rel_path(root: Path, path: str) -> Optional[str]:
+    rel = os.path.relpath(path, root)
+    if rel == "." or rel.startswith(".."):
+        return None
+    return rel.replace(os.sep, "/")
+
+
+def watch_native(root: Path, debounce: float = DEFAULT_DEBOUNCE) -> Iterator[Set[str]]:
+    """
+    Изменения через уведомления ФС (inotify на Linux, библиотека watchfiles).
+
+    Отдаёт множества изменившихся путей (относительно root): события одного
+    файла за пачку схлопываются, тип события не важен — индексатор сам
+    проверяет, существует ли файл. Переименование приходит как удаление
+    старого пути и появление нового. Пока вызывающий обрабатывает пачку,
+    новые события копятся и придут следующей пачкой.
+    """
+    debounce_ms = max(1, int(debounce * 1000))
+    for changes in watchfiles.watch(
+        root,
+        debounce=debounce_ms,
+        step=min(debounce_ms, 200),
+        raise_interrupt=False,
+    ):
+        rel_paths = {rel for _, path in changes if (rel := _rel_path(root, path)) is not None}
+        if rel_paths:
+            yield rel_paths
+
+
+def _snapshot(scanner: TreeScanner) -> Dict[str, Tuple[int, int]]:
+    return {f.rel_path: (f.stat.st_mtime_ns, f.stat.st_size) for f in scanner.scan()}
+
+
+def watch_polling(
+    root: Path,
+    allowed_ext: Collection[str],
+    interval: float = DEFAULT_POLL_INTERVAL,
+    workers: int = DEFAULT_SCAN_WORKERS,
+    gitignore: bool = True,
+) -> Iterator[Set[str]]:
+    """
+    Изменения через периодический обход дерева (scanner.TreeScanner):
+    сравниваются mtime и размер подходящих файлов. Работает на любых ФС,
+    в том числе сетевых, где inotify не доставляет события.
+    """
+    scanner = TreeScanner(root, allowed_ext, workers=workers, gitignore=gitignore)
+    snapshot = _snapshot(scanner)
+    while True:
+        time.sleep(interval)
+        current = _snapshot(scanner)
+        changed = {
+            rel_path
+            for rel_path in snapshot.keys() | current.keys()
+            if snapshot.get(rel_path) != current.get(rel_path)
+        }
+        snapshot = current
+        if changed:
+            yield changed
+
+
+def watch_changes(
+    root: Path,
+    allowed_ext: Collection[str],
+    debounce: float = DEFAULT_DEBOUNCE,
+    poll: bool = False,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    workers: int = DEFAULT_SCAN_WORKERS,
+    gitignore: bool = True,
+) -> Iterator[Set[str]]:
+    """
+    Уведомления ФС, если доступны (и не выбран poll), иначе опрос.
+    """
+    if not poll and watchfiles is not None:
+        try:
+            yield from watch_native(root, debounce)
+            return
+        except OSError as e:
+            # например, исчерпан лимит inotify watches
+            print(f"Уведомления ФС недоступны ({e}), переключаемся на опрос каталога")
+    elif not poll:
+        print("Библиотека watchfiles не установлена, изменения отслеживаются опросом каталога")
+    yield from watch_polling(root, allowed_ext, poll_interval, workers, gitignore)